@@ -0,0 +1,192 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.rate_limiter as RL
+from rag_demos.bm25_index import tokenize
+
+log = U.get_logger(__name__)
+
+_UNKNOWN = object()
+
+# defaults of AnswerCache: ANSWER_CACHE_SEMANTIC_THRESHOLD is the cosine similarity above which a cached answer is
+# reused for a differently worded question (0 disables), ANSWER_CACHE_INDEXER_CHECK the seconds between checks of the
+# indexer's last successful run, a newer run drops the cached answers (0 disables)
+__getattr__ = S.lazy_constants(__name__, {"ANSWER_CACHE_SIZE": "answer_cache_size",
+                                          "ANSWER_CACHE_TTL": "answer_cache_ttl",
+                                          "ANSWER_CACHE_SEMANTIC_THRESHOLD": "answer_cache_semantic_threshold",
+                                          "ANSWER_CACHE_INDEXER_CHECK": "answer_cache_indexer_check"})
+
+
+def normalize_question(question):
+    """
+    Case, punctuation, whitespace, script and diacritic insensitive form of a question
+    """
+    return " ".join(tokenize(question))
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of chat answers keyed on the normalized question and the retrieval/generation settings.
+    With a semantic threshold, a miss falls back to the most similar cached question with the same settings.
+    All entries are dropped when the index generation changes (see utils.bump_index_generation) or the indexer
+    finishes a run, including the scheduled ones, so answers given while the index was being filled are not kept.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, semantic_threshold=None, embedder=None, indexer_check=None):
+        settings = S.get_settings()
+        self.max_entries = settings.answer_cache_size if max_entries is None else max_entries
+        self.ttl = settings.answer_cache_ttl if ttl is None else ttl
+        self.semantic_threshold = (settings.answer_cache_semantic_threshold if semantic_threshold is None
+                                   else semantic_threshold)
+        self.embedder = embedder
+        self.indexer_check = settings.answer_cache_indexer_check if indexer_check is None else indexer_check
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # end of the indexer's last successful run, _UNKNOWN until the first check returns
+        self._indexer_checked = None
+        self._indexer_checking = False
+        self._indexer_end = _UNKNOWN
+        self._generation = U.index_generation()
+        # question vectors computed on a semantic miss, reused by the put that follows
+        self._vectors = {}
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._check_indexer()
+
+    @staticmethod
+    def _settings(model, temperature, top_p, top_k, query_type):
+        return model, round(float(temperature), 2), round(float(top_p), 2), int(top_k), query_type
+
+    def _embed(self, question):
+        if self.embedder is None:
+            from rag_demos.embedders import AzureOpenAIEmbedder
+            # query embeddings are on the path of a chat request
+            self.embedder = AzureOpenAIEmbedder(priority=RL.INTERACTIVE)
+        return self.embedder.embed([question])[0]
+
+    def _question_vector(self, question):
+        v = np.asarray(self._embed(question), dtype=np.float32)
+        v = v / (np.linalg.norm(v) or 1)
+        if len(self._vectors) > 64:
+            self._vectors.clear()
+        self._vectors[question] = v
+        return v
+
+    def _check_indexer(self):
+        # at most every indexer_check seconds and one at a time, the status call runs in a background thread so a
+        # slow search service never holds up a lookup
+        now = time.monotonic()
+        with self._lock:
+            if not self.indexer_check or self._indexer_checking or (
+                    self._indexer_checked is not None and now - self._indexer_checked < self.indexer_check):
+                return
+            self._indexer_checked = now
+            self._indexer_checking = True
+        threading.Thread(target=self._refresh_indexer_end, name="answer-cache-indexer", daemon=True).start()
+
+    def _refresh_indexer_end(self):
+        try:
+            import rag_demos.zakon_index as ZI
+            import rag_demos.index_helpers as IH
+            import rag_demos.indexer_monitor as IM
+            end = IM.last_success_end(IH.get_indexer_status(ZI.indexer_name(), full=True))
+        except Exception as e:
+            log.debug(f"Could not check the indexer status: {e}")
+            end = self._indexer_end
+        with self._lock:
+            self._indexer_checking = False
+            if self._indexer_end is not _UNKNOWN and end != self._indexer_end:
+                log.info("Indexer finished a run, clearing the answer cache")
+                self._entries.clear()
+            self._indexer_end = end
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            log.info("Index was rebuilt, clearing the answer cache")
+            self._entries.clear()
+            self._generation = generation
+
+    def _expire(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry["stored"] <= self.ttl:
+                break
+            del self._entries[key]
+
+    def get(self, question, model, temperature, top_p, top_k, query_type):
+        """
+        :return: (answer, full_js, "exact" or "semantic") for a cached answer, None on a miss
+        """
+        settings = self._settings(model, temperature, top_p, top_k, query_type)
+        key = (normalize_question(question), settings)
+        now = time.time()
+        self._check_indexer()
+        generation = U.index_generation()
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["stored"] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry["latency"]
+                return entry["answer"], entry["full_js"], "exact"
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if k[1] == settings and e["vector"] is not None and now - e["stored"] <= self.ttl]
+        if self.semantic_threshold > 0 and candidates:
+            vector = self._question_vector(question)
+            sims = np.stack([e["vector"] for _, e in candidates]) @ vector
+            best = int(np.argmax(sims))
+            if sims[best] >= self.semantic_threshold:
+                best_key, entry = candidates[best]
+                with self._lock:
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    self.saved_seconds += entry["latency"]
+                log.info(f"Semantic cache hit ({sims[best]:.3f}) for: {question}")
+                return entry["answer"], entry["full_js"], "semantic"
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question, answer, full_js, latency, model, temperature, top_p, top_k, query_type):
+        """
+        Store an answer with the latency it took to produce, which is what a later hit saves
+        """
+        settings = self._settings(model, temperature, top_p, top_k, query_type)
+        vector = None
+        if self.semantic_threshold > 0:
+            vector = self._vectors.pop(question, None)
+            if vector is None:
+                vector = self._question_vector(question)
+                self._vectors.pop(question, None)
+        now = time.time()
+        generation = U.index_generation()
+        with self._lock:
+            self._check_generation(generation)
+            key = (normalize_question(question), settings)
+            self._entries[key] = {"answer": answer, "full_js": full_js, "latency": latency,
+                                  "stored": now, "vector": vector}
+            self._entries.move_to_end(key)
+            self._expire(now)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3)}
@@ -0,0 +1,89 @@
+import asyncio
+import weakref
+import importlib.util
+from urllib.parse import urlsplit
+
+import httpx
+import rag_demos.utils as U
+import rag_demos.settings as S
+from rag_demos.http_transport import CA_BUNDLE
+
+log = U.get_logger(__name__)
+
+# HTTP/2 multiplexes many requests over one connection, httpx needs the h2 package for it
+H2_INSTALLED = importlib.util.find_spec('h2') is not None
+
+__getattr__ = S.lazy_constants(__name__, {"ASYNC_MAX_CONNECTIONS": "http_async_max_connections",
+                                          "ASYNC_MAX_KEEPALIVE": "http_async_max_keepalive"})
+
+# clients are bound to the event loop they were created in: loop -> endpoint -> client
+_clients = weakref.WeakKeyDictionary()
+
+
+def _endpoint_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_client(url) -> httpx.AsyncClient:
+    """
+    Return the pooled async client for the endpoint of the url in the running event loop
+    """
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    key = _endpoint_key(url)
+    client = clients.get(key)
+    if client is None or client.is_closed:
+        settings = S.get_settings()
+        http2 = settings.http_async_http2 and H2_INSTALLED
+        client = httpx.AsyncClient(
+            http2=http2, verify=CA_BUNDLE,
+            timeout=httpx.Timeout(settings.http_read_timeout, connect=settings.http_connect_timeout),
+            limits=httpx.Limits(max_connections=settings.http_async_max_connections,
+                                max_keepalive_connections=settings.http_async_max_keepalive))
+        clients[key] = client
+        log.debug(f"Created async client for {key} (http2={http2})")
+    return client
+
+
+async def request(method, url, **kwargs) -> httpx.Response:
+    """
+    Send a request through the pooled async client of the url's endpoint.
+    Accepts httpx keyword arguments (params, headers, json, content, ...).
+    """
+    return await get_client(url).request(method, url, **kwargs)
+
+
+async def get(url, **kwargs):
+    return await request('GET', url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request('POST', url, **kwargs)
+
+
+async def aclose_all():
+    """
+    Close the clients of the running event loop
+    """
+    for client in _clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.aclose()
+
+
+def run(coro):
+    """
+    asyncio.run for the blocking wrappers of the async helpers, closing the clients of its event loop when done.
+    Called where an event loop is already running (Jupyter, async Gradio handlers), asyncio.run would fail, so the
+    coroutine then runs on a new loop in a worker thread while the caller blocks.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aclose_all()
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(main())
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="async-run") as pool:
+        return pool.submit(asyncio.run, main()).result()
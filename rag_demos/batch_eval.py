@@ -0,0 +1,236 @@
+import json
+import time
+import hashlib
+import itertools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.rate_limiter as RL
+import rag_demos.telemetry as TM
+
+log = U.get_logger(__name__)
+
+RESULTS_DIR = U.CACHE_DIR / "eval"
+__getattr__ = S.lazy_constants(__name__, {"EVAL_CONCURRENCY": "eval_concurrency"})
+# the defaults of the settings accordion of the chat app
+DEFAULT_GRID = {"model": ["gpt-4o"], "temperature": [1.0], "top_p": [0.2], "top_k": [5],
+                "query_type": ["vector_semantic_hybrid"]}
+
+
+def load_questions(path):
+    """
+    Questions of a JSONL file, one object per line with "question" and optionally "id", a reference "answer" and
+    the expected "sources" (file names or titles of the documents that should be cited)
+    """
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", hashlib.sha1(item["question"].encode("utf-8")).hexdigest()[:12])
+            questions.append(item)
+    return questions
+
+
+def _normalize(knob, value):
+    # the type of the knob's default, so 1 and 1.0 give the same config id and resume the same checkpoint entries
+    return type(DEFAULT_GRID[knob][0])(value)
+
+
+def config_id(config):
+    return "|".join(f"{k}={_normalize(k, config[k])}" for k in DEFAULT_GRID)
+
+
+def config_grid(**knobs):
+    """
+    Every combination of the given knob values, the chat app defaults for the others
+    :param knobs: Lists of values for model, temperature, top_p, top_k and query_type
+    """
+    unknown = set(knobs) - set(DEFAULT_GRID)
+    if unknown:
+        raise Exception(f"Unknown settings {unknown}, use {list(DEFAULT_GRID)}")
+    grid = {**DEFAULT_GRID, **{k: [_normalize(k, x) for x in (v if isinstance(v, (list, tuple)) else [v])]
+                               for k, v in knobs.items()}}
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def load_checkpoint(path):
+    """
+    Results already recorded in a checkpoint, keyed by (config id, question id). Failed calls are not kept,
+    so they are retried on resume.
+    """
+    done = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by an interrupted run
+                if record.get("error") is None:
+                    done[(record["config_id"], record["question_id"])] = record
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def _cited(full_js):
+    citations = ((full_js.get("message") or {}).get("context") or {}).get("citations") or []
+    return sorted({c.get("filepath") or c.get("title") or c.get("url") for c in citations} - {None})
+
+
+def run_one(question, config):
+    """
+    Answer one question with one configuration, bypassing the answer cache, in the batch lane of the rate limiter
+    """
+    import rag_demos.oyd_chat as OC
+    record = {"config_id": config_id(config), "question_id": question["id"], "config": config}
+    started = time.perf_counter()
+    try:
+        with TM.request(model=config["model"], query_type=config["query_type"]) as stages:
+            bot_response, full_js = OC.answer(question["question"], priority=RL.BATCH, **config)
+    except Exception as e:
+        log.error(f"{record['config_id']} failed on {question['id']}: {e}")
+        return {**record, "error": str(e), "latency": time.perf_counter() - started}
+    usage = full_js.get("usage") or {}
+    return {**record, "error": None, "latency": time.perf_counter() - started,
+            "stages": {k: round(v, 4) for k, v in stages.items()}, "answer": bot_response,
+            "citations": _cited(full_js), "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens")}
+
+
+def run(questions, configs, checkpoint_path, concurrency=None, max_calls=None):
+    """
+    Answer every question with every configuration concurrently, appending each result to a JSONL checkpoint as it
+    completes. Pairs already in the checkpoint are skipped, so an interrupted run resumes where it stopped.
+    :param concurrency: Calls in flight, EVAL_CONCURRENCY by default
+    :param max_calls: Stop after this many calls, e.g. to spread a large grid over several runs
+    :return: All successful results of the checkpoint, keyed by (config id, question id)
+    """
+    concurrency = concurrency or S.get_settings().eval_concurrency
+    checkpoint_path = Path(checkpoint_path)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+    done = load_checkpoint(checkpoint_path)
+    pending = [(q, c) for c in configs for q in questions if (config_id(c), q["id"]) not in done]
+    if max_calls is not None:
+        pending = pending[:max_calls]
+    log.info(f"{len(done)} results in {checkpoint_path}, {len(pending)} calls to make")
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        with open(checkpoint_path, "a", encoding="utf-8") as out:
+            futures = [pool.submit(run_one, q, c) for q, c in pending]
+            for n, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                if record["error"] is None:
+                    done[(record["config_id"], record["question_id"])] = record
+                if n % 50 == 0:
+                    log.info(f"{n}/{len(pending)} calls done")
+    finally:
+        # on an interruption, calls not started yet are dropped and picked up by the next run
+        pool.shutdown(cancel_futures=True)
+    return done
+
+
+def _token_f1(a, b):
+    from rag_demos.bm25_index import tokenize
+    a, b = tokenize(a or ""), tokenize(b or "")
+    if not a or not b:
+        return 0.0
+    common = sum(min(a.count(t), b.count(t)) for t in set(a))
+    if not common:
+        return 0.0
+    precision, recall = common / len(a), common / len(b)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def _source_recall(expected, cited):
+    # citations are file paths, expected sources may be given as file names
+    cited = set(cited) | {Path(c).name for c in cited}
+    return len(set(expected) & cited) / len(set(expected))
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return round(float(np.mean(values)), 4) if values else None
+
+
+def report(results, questions, configs):
+    """
+    Per configuration: latency percentiles, token usage, and agreement of answers and citations with the
+    reference answers and expected sources of the questions, and with the first configuration of the grid
+    :return: dict config id -> metrics
+    """
+    baseline = config_id(configs[0])
+    out = {}
+    for config in configs:
+        cid = config_id(config)
+        rows = [(q, results.get((cid, q["id"]))) for q in questions]
+        rows = [(q, r) for q, r in rows if r is not None]
+        if not rows:
+            out[cid] = {"answered": 0}
+            continue
+        latencies = [r["latency"] for _, r in rows]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        base = [(r, results.get((baseline, q["id"]))) for q, r in rows]
+        out[cid] = {
+            "answered": len(rows),
+            "p50_ms": round(float(p50) * 1000, 1), "p95_ms": round(float(p95) * 1000, 1),
+            "p99_ms": round(float(p99) * 1000, 1),
+            "prompt_tokens": sum(r["prompt_tokens"] or 0 for _, r in rows),
+            "completion_tokens": sum(r["completion_tokens"] or 0 for _, r in rows),
+            "mean_prompt_tokens": _mean([r["prompt_tokens"] for _, r in rows]),
+            "mean_completion_tokens": _mean([r["completion_tokens"] for _, r in rows]),
+            "answer_f1_reference": _mean([_token_f1(r["answer"], q["answer"]) for q, r in rows if q.get("answer")]),
+            "source_recall": _mean([_source_recall(q["sources"], r["citations"]) for q, r in rows if q.get("sources")]),
+            "answer_f1_baseline": _mean([_token_f1(r["answer"], b["answer"]) for r, b in base if b]),
+            "citation_jaccard_baseline": _mean([_jaccard(r["citations"], b["citations"]) for r, b in base if b]),
+        }
+    return out
+
+
+def evaluate(questions_path, name=None, concurrency=None, max_calls=None, results_dir=RESULTS_DIR,
+             **knobs):
+    """
+    Run (or resume) an evaluation of a question file over a grid of chat settings and write its report
+    :param name: Name of the run, its checkpoint is results_dir/<name>.jsonl; the question file name by default
+    :param knobs: Lists of values for model, temperature, top_p, top_k and query_type
+    :return: The report, see report()
+    """
+    questions = load_questions(questions_path)
+    configs = config_grid(**knobs)
+    name = name or Path(questions_path).stem
+    checkpoint = Path(results_dir) / f"{name}.jsonl"
+    log.info(f"Evaluating {len(questions)} questions x {len(configs)} configurations")
+    results = run(questions, configs, checkpoint, concurrency, max_calls)
+    result = report(results, questions, configs)
+    with open(Path(results_dir) / f"{name}.report.json", "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=1, ensure_ascii=False)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Batch evaluation of the chat settings on a JSONL of questions")
+    parser.add_argument("questions")
+    parser.add_argument("--name")
+    parser.add_argument("--grid", default="{}",
+                        help='JSON object of setting -> values, e.g. {"top_k": [3, 5], "query_type": ["vector"]}')
+    parser.add_argument("--concurrency", type=int, default=S.get_settings().eval_concurrency)
+    parser.add_argument("--max-calls", type=int)
+    args = parser.parse_args()
+    result = evaluate(args.questions, args.name, args.concurrency, args.max_calls, **json.loads(args.grid))
+    columns = ("answered", "p50_ms", "p95_ms", "mean_prompt_tokens", "mean_completion_tokens",
+               "answer_f1_reference", "source_recall", "answer_f1_baseline", "citation_jaccard_baseline")
+    print(f"{'configuration':<70}" + "".join(f"{c:>27}" for c in columns))
+    for cid, metrics in result.items():
+        print(f"{cid:<70}" + "".join(f"{str(metrics.get(c, '')):>27}" for c in columns))
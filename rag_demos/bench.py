@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import tracemalloc
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+from rag_demos.stub_server import StubServer, StubConfig
+
+log = U.get_logger(__name__)
+
+RESULTS_DIR = U.CACHE_DIR / "bench"
+BENCH_INDEX = "bench-index"
+SCENARIOS = ("search", "asearch", "search_scan", "respond", "respond_stream", "bulk_upload", "embeddings")
+SCAN_INDEX = "bench-scan-index"
+SCAN_DOCUMENTS = 5000
+# importing these must stay cheap and must not need credentials
+IMPORT_BUDGET_MODULES = ("rag_demos.zakon_index", "rag_demos.index_helpers", "rag_demos.openai_helpers",
+                         "rag_demos.oyd_chat", "rag_demos.local_ingest")
+__getattr__ = S.lazy_constants(__name__, {"IMPORT_BUDGET_MS": "import_budget_ms"})
+
+
+def _configure_environment(url):
+    # the settings are read from the environment on first use and cached, so they are reloaded after setting it
+    os.environ["AZURE_SEARCH_ENDPOINT"] = url
+    os.environ["AZURE_OPENAI_ENDPOINT"] = url
+    os.environ["RETRIEVAL_MODE"] = "remote"
+    for key, value in {"AZURE_SEARCH_KEY": "stub", "AZURE_SEARCH_API_VERSION": "2024-07-01",
+                       "AZURE_OPENAI_API_KEY": "stub", "AZURE_OPENAI_API_VERSION": "2024-05-01-preview",
+                       "GPT4_DEPLOYMENT_NAME": "gpt-4o", "EMBEDDING_DEPLOYMENT_NAME": "text-embedding-3-large",
+                       "EMBEDDING_DIMENSIONS": "1536", "ENVIRONMENT": "bench",
+                       "BLOB_CONNECTION_STRING": "stub"}.items():
+        os.environ.setdefault(key, value)
+    S.get_settings.cache_clear()
+
+
+def _load_scan_index(count):
+    """
+    Create the index scanned by search_scan and fill it with documents carrying full-size vectors
+    """
+    import rag_demos.index_helpers as IH
+    import rag_demos.bulk_upload as BU
+    import rag_demos.zakon_index as ZI
+    from rag_demos.embedders import FakeEmbedder
+    IH.create_object(SCAN_INDEX, 'index', ZI.index_payload_for(SCAN_INDEX))
+    embedder = FakeEmbedder()
+    chunk = "Član 1. " * 250
+    BU.upload_documents(SCAN_INDEX, ({"id": str(n), "title": f"Zakon {n}", "chunk": chunk,
+                                      "chunkVector": embedder.embed([str(n)])[0].tolist()} for n in range(count)))
+
+
+def _scenario(name, docs_per_upload, texts_per_embed):
+    """
+    The operation of a scenario, a function of the iteration number driving the real client code
+    """
+    import rag_demos.index_helpers as IH
+    search_payload = {"search": "kazna za ubistvo", "top": 5, "count": True, "select": "id,title,chunk"}
+    if name == "search":
+        return lambda i: IH.search(BENCH_INDEX, search_payload)
+    if name == "asearch":
+        # one event loop per worker thread, so the async client pool is reused across iterations
+        loops = {}
+
+        def run(i):
+            loop = loops.get(threading.get_ident())
+            if loop is None:
+                loop = loops[threading.get_ident()] = asyncio.new_event_loop()
+            return loop.run_until_complete(IH.asearch(BENCH_INDEX, search_payload))
+        return run
+    if name == "search_scan":
+        _load_scan_index(SCAN_DOCUMENTS)
+        return lambda i: sum(1 for _ in IH.iter_search(SCAN_INDEX, {"search": "*"}))
+    if name in ("respond", "respond_stream"):
+        import rag_demos.oyd_chat as OC
+        settings = ("gpt-4o", 0.5, 0.2, 5, "vector_simple_hybrid")
+        if name == "respond":
+            # distinct questions, so the answer cache never hits
+            return lambda i: OC.respond(f"benchmark question {i} {time.time_ns()}", [], *settings)
+        return lambda i: list(OC.respond_stream(f"benchmark question {i} {time.time_ns()}", [], *settings))
+    if name == "bulk_upload":
+        import rag_demos.bulk_upload as BU
+        chunk = "Član 1. " * 250
+        return lambda i: BU.upload_documents(
+            BENCH_INDEX, ({"id": f"{i}_{n}", "chunk": chunk} for n in range(docs_per_upload)))
+    if name == "embeddings":
+        from rag_demos.embedding_client import EmbeddingClient
+        client = EmbeddingClient()
+        return lambda i: client.embed(f"tekst {i} {n} " * 50 for n in range(texts_per_embed))
+    raise ValueError(f"Unknown scenario {name}")
+
+
+def _percentiles(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50_ms": round(p50 * 1000, 3), "p95_ms": round(p95 * 1000, 3), "p99_ms": round(p99 * 1000, 3),
+            "mean_ms": round(float(np.mean(latencies)) * 1000, 3)}
+
+
+def measure(operation, iterations=100, concurrency=1, warmup=5, alloc_iterations=5):
+    """
+    Latency percentiles, throughput and allocations of an operation
+    :param operation: Function of the iteration number
+    :param concurrency: Number of threads issuing operations
+    :param alloc_iterations: Sequential iterations run under tracemalloc, 0 to skip
+    :return: dict with p50_ms, p95_ms, p99_ms, mean_ms, ops_per_sec, alloc_peak_kb, alloc_retained_kb
+    """
+    for i in range(warmup):
+        operation(-1 - i)
+
+    def timed(i):
+        started = time.perf_counter()
+        operation(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, range(iterations)))
+    else:
+        latencies = [timed(i) for i in range(iterations)]
+    elapsed = time.perf_counter() - started
+    result = {**_percentiles(latencies), "ops_per_sec": round(iterations / elapsed, 2)}
+
+    if alloc_iterations:
+        peaks, retained = [], []
+        tracemalloc.start()
+        try:
+            for i in range(alloc_iterations):
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                operation(iterations + i)
+                after, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(after - before)
+        finally:
+            tracemalloc.stop()
+        result["alloc_peak_kb"] = round(float(np.median(peaks)) / 1024, 1)
+        result["alloc_retained_kb"] = round(float(np.median(retained)) / 1024, 1)
+    return result
+
+
+def import_time(module):
+    """
+    Cumulative import time of a module in milliseconds, measured with -X importtime in a fresh interpreter
+    without credentials in the environment
+    """
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("AZURE_", "EMBEDDING_", "GPT4_", "BLOB_"))}
+    env["PYTHONPATH"] = str(Path(__file__).resolve().parent.parent)
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                         text=True, env=env, check=True).stderr
+    for line in reversed(out.splitlines()):
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise ValueError(f"No import time reported for {module}")
+
+
+def check_import_budget(modules=IMPORT_BUDGET_MODULES, budget_ms=None, repeat=3):
+    """
+    Import time of the package entry points against the budget, the best of `repeat` runs per module
+    :param budget_ms: IMPORT_BUDGET_MS by default
+    :return: dict module -> import time in ms, raises AssertionError listing the modules over budget
+    """
+    budget_ms = budget_ms or S.get_settings().import_budget_ms
+    times = {module: round(min(import_time(module) for _ in range(repeat)), 1) for module in modules}
+    over = {module: ms for module, ms in times.items() if ms > budget_ms}
+    assert not over, f"Import time over the {budget_ms} ms budget: {over}"
+    return times
+
+
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=Path(__file__).resolve().parent).returncode
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results, revision, results_dir=RESULTS_DIR):
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    path = results_dir / f"{revision}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    return path
+
+
+def compare(current, baseline):
+    """
+    Relative change of every metric against a baseline run, as new / old
+    """
+    changes = {}
+    for scenario, metrics in current["scenarios"].items():
+        old = baseline["scenarios"].get(scenario)
+        if not old:
+            continue
+        changes[scenario] = {k: round(v / old[k], 3) for k, v in metrics.items() if old.get(k)}
+    return changes
+
+
+def run(scenarios=SCENARIOS, iterations=100, concurrency=1, config=None, docs_per_upload=1000,
+        texts_per_embed=256, alloc_iterations=5, save=True):
+    """
+    Run the benchmark scenarios against a local stub server
+    :param config: StubConfig of the server (latency, throttling, payload sizes)
+    :return: dict with the revision, settings, per-scenario metrics and server statistics
+    """
+    config = config or StubConfig()
+    with StubServer(config) as server:
+        _configure_environment(server.url)
+        results = {"revision": git_revision(), "recorded": datetime.now(timezone.utc).isoformat(),
+                   "settings": {"iterations": iterations, "concurrency": concurrency, **vars(config)},
+                   "scenarios": {}}
+        for name in scenarios:
+            operation = _scenario(name, docs_per_upload, texts_per_embed)
+            n = max(iterations // 10, 5) if name in ("search_scan", "bulk_upload", "embeddings") else iterations
+            results["scenarios"][name] = measure(operation, n, concurrency, alloc_iterations=alloc_iterations)
+            log.info(f"{name}: {results['scenarios'][name]}")
+        results["server"] = server.stats()
+        import rag_demos.http_transport as HT
+        results["http"] = HT.get_stats()
+    if save:
+        results["path"] = str(save_results(results, results["revision"]))
+    return results
+
+
+def _print_table(results, changes=None):
+    columns = ("p50_ms", "p95_ms", "p99_ms", "ops_per_sec", "alloc_peak_kb", "alloc_retained_kb")
+    print(f"{'scenario':<16}" + "".join(f"{c:>20}" for c in columns))
+    for name, metrics in results["scenarios"].items():
+        cells = []
+        for c in columns:
+            cell = f"{metrics.get(c, '')}"
+            if changes and c in changes.get(name, {}):
+                cell += f" ({changes[name][c]:.2f}x)"
+            cells.append(f"{cell:>20}")
+        print(f"{name:<16}" + "".join(cells))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the request paths against a local stub server")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="server time per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.05)
+    parser.add_argument("--chunk-chars", type=int, default=2000)
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    parser.add_argument("--compare", help="revision (or result file) to compare with")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--check-imports", action="store_true",
+                        help="only check the import time of the entry points against IMPORT_BUDGET_MS")
+    args = parser.parse_args()
+
+    if args.check_imports:
+        try:
+            print(check_import_budget())
+        except AssertionError as e:
+            print(e)
+            sys.exit(1)
+        sys.exit(0)
+
+    results = run(args.scenarios, args.iterations, args.concurrency,
+                  StubConfig(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                             retry_after=args.retry_after, chunk_chars=args.chunk_chars,
+                             completion_tokens=args.completion_tokens),
+                  save=not args.no_save)
+    changes = None
+    if args.compare:
+        path = Path(args.compare) if args.compare.endswith(".json") else RESULTS_DIR / f"{args.compare}.json"
+        with open(path, encoding="utf-8") as f:
+            changes = compare(results, json.load(f))
+    _print_table(results, changes)
+    print(f"server: {results['server']}, http: {results['http']}")
+    if "path" in results:
+        print(f"saved to {results['path']}")
@@ -0,0 +1,154 @@
+import re
+import json
+import unicodedata
+from collections import Counter
+from pathlib import Path
+import numpy as np
+import rag_demos.utils as U
+
+log = U.get_logger(__name__)
+
+# Serbian Cyrillic to Latin, so both scripts of the same law text share one vocabulary
+# ђ goes straight to the folded "dj": a translate pass does not apply the "đ" mapping to its own output
+_CYRILLIC = dict(zip("абвгдђежзијклљмнњопрстћуфхцчџш",
+                     ["a", "b", "v", "g", "d", "dj", "e", "ž", "z", "i", "j", "k", "l", "lj", "m", "n", "nj", "o", "p",
+                      "r", "s", "t", "ć", "u", "f", "h", "c", "č", "dž", "š"]))
+_TRANSLIT = str.maketrans({**_CYRILLIC, "đ": "dj"})
+# saved with an index, an index built by an older tokenize is rebuilt (see LocalSearch)
+TOKENIZER_VERSION = 2
+_TOKEN = re.compile(r"\w+")
+
+
+def _fold(text):
+    # č ć š ž lose their diacritics, đ has no decomposition and is mapped to dj like users type it
+    text = unicodedata.normalize("NFKC", text).lower().translate(_TRANSLIT)
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """
+    Lowercased, script- and diacritic-folded word tokens of a Serbian/Bosnian text in Latin or Cyrillic
+    """
+    return [t for t in _TOKEN.findall(_fold(text)) if len(t) > 1 or t.isdigit()]
+
+
+def rrf_fuse(rankings, k=60, top=None):
+    """
+    Reciprocal rank fusion of several ranked lists of documents (dicts with an id)
+    :param rankings: Lists of documents, best first
+    :param k: RRF constant
+    :param top: Number of fused results to return
+    :return: Documents ordered by fused score, with @search.score set to the RRF score
+    """
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (k + rank + 1)
+            docs.setdefault(doc["id"], doc)
+    fused = sorted(scores, key=scores.get, reverse=True)[:top]
+    return [{**docs[i], "@search.score": scores[i]} for i in fused]
+
+
+class BM25Index:
+    """
+    Inverted index over the chunk field with BM25 scoring.
+    Postings of all terms live in two flat arrays: document id gaps (delta-encoded, in the smallest
+    unsigned dtype that fits) and term frequencies, sliced by per-term offsets.
+    """
+
+    def __init__(self, vocab, offsets, gaps, tfs, doc_lengths, k1=1.2, b=0.75, tokenizer_version=TOKENIZER_VERSION):
+        self.vocab = vocab
+        self.tokenizer_version = tokenizer_version
+        self.offsets = offsets
+        self.gaps = gaps
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths.astype(np.float32)
+        self.k1 = k1
+        self.b = b
+        n = len(doc_lengths)
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = self.doc_lengths.mean() if n else 1.0
+        # per document part of the BM25 denominator, computed once
+        self.norm = (k1 * (1 - b + b * self.doc_lengths / avgdl)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts, **kwargs):
+        """
+        Build the index from an iterable of chunk texts, document ids are their positions
+        """
+        postings = {}
+        lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.uint32)
+        for term, i in vocab.items():
+            offsets[i + 1] = len(postings[term])
+        offsets = np.cumsum(offsets, dtype=np.uint32)
+        gap_dtype = np.min_scalar_type(max(len(lengths), 1))
+        gaps = np.empty(int(offsets[-1]), dtype=gap_dtype)
+        tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+        for term, i in vocab.items():
+            docs = np.array([d for d, _ in postings[term]], dtype=np.int64)
+            gaps[offsets[i]:offsets[i + 1]] = np.diff(docs, prepend=0)
+            tfs[offsets[i]:offsets[i + 1]] = np.minimum([tf for _, tf in postings[term]], 65535)
+        index = cls(vocab, offsets, gaps, tfs, np.asarray(lengths), **kwargs)
+        log.info(f"Built BM25 index over {len(lengths)} chunks, {len(vocab)} terms, {index.nbytes()} bytes of postings")
+        return index
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.gaps.nbytes + self.tfs.nbytes + self.doc_lengths.nbytes
+
+    def scores(self, query):
+        """
+        BM25 score of every document for the query
+        """
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = np.cumsum(self.gaps[start:end], dtype=np.int64)
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[i] * tf * (self.k1 + 1) / (tf + self.norm[docs])
+        return scores
+
+    def search(self, query, k=5, mask=None):
+        """
+        Top-k documents for the query
+        :param mask: Optional boolean mask of the documents allowed by a filter
+        :return: List of (score, document id), best first, documents with a zero score are left out
+        """
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(float(scores[i]), int(i)) for i in candidates]
+
+    def save(self, path):
+        path = Path(path)
+        np.savez(path / "bm25.npz", offsets=self.offsets, gaps=self.gaps, tfs=self.tfs,
+                 doc_lengths=self.doc_lengths, params=np.array([self.k1, self.b]),
+                 tokenizer=np.array(self.tokenizer_version))
+        with open(path / "bm25_vocab.json", "w", encoding="utf-8") as f:
+            json.dump(list(self.vocab), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        z = np.load(path / "bm25.npz")
+        with open(path / "bm25_vocab.json", encoding="utf-8") as f:
+            vocab = {term: i for i, term in enumerate(json.load(f))}
+        k1, b = z["params"]
+        # indexes saved before the version was recorded are version 1
+        version = int(z["tokenizer"]) if "tokenizer" in z.files else 1
+        return cls(vocab, z["offsets"], z["gaps"], z["tfs"], z["doc_lengths"], k1=float(k1), b=float(b),
+                   tokenizer_version=version)
@@ -0,0 +1,183 @@
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import rag_demos.utils as U
+import rag_demos.http_transport as HT
+import rag_demos.index_helpers as IH
+
+log = U.get_logger(__name__)
+
+# Azure AI Search limits for a single /docs/index request
+MAX_BATCH_DOCS = 1000
+MAX_BATCH_BYTES = 16 * 1024 * 1024
+# per-document status codes that the service documents as transient
+RETRYABLE_STATUS = {409, 422, 429, 503}
+
+_BATCH_PREFIX = b'{"value":['
+_BATCH_SUFFIX = b']}'
+
+
+class UploadStats:
+    """
+    Counters of a bulk upload run, safe to update from worker threads
+    """
+
+    def __init__(self):
+        self.docs = 0
+        self.failed = 0
+        self.bytes = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed_keys = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, docs=0, failed=0, nbytes=0, batches=0, retried=0, failed_keys=()):
+        with self._lock:
+            self.docs += docs
+            self.failed += failed
+            self.bytes += nbytes
+            self.batches += batches
+            self.retried += retried
+            self.failed_keys.extend(failed_keys)
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        elapsed = self.elapsed or (time.perf_counter() - self.started)
+        return {
+            "docs": self.docs,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "batches": self.batches,
+            "retried": self.retried,
+            "elapsed": round(elapsed, 3),
+            "docs_per_sec": round(self.docs / elapsed, 1) if elapsed else 0.0,
+            "bytes_per_sec": round(self.bytes / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def iter_batches(documents, action="mergeOrUpload", key_field="id",
+                 max_docs=MAX_BATCH_DOCS, max_bytes=MAX_BATCH_BYTES):
+    """
+    Pack documents into batches that respect the per-request document count and byte limits.
+    Every document is serialized exactly once, batches are lists of (key, encoded document).
+    :param documents: Iterable or generator of documents (dicts)
+    :param action: The @search.action set on each document
+    :param key_field: Name of the key field of the index
+    """
+    overhead = len(_BATCH_PREFIX) + len(_BATCH_SUFFIX)
+    batch, size = [], overhead
+    for doc in documents:
+        if "@search.action" not in doc:
+            doc = {"@search.action": action, **doc}
+        encoded = json.dumps(doc, ensure_ascii=False).encode('utf-8')
+        if len(encoded) + overhead > max_bytes:
+            raise Exception(f"Document {doc.get(key_field)} is {len(encoded)} bytes, over the {max_bytes} bytes batch limit")
+        if batch and (len(batch) >= max_docs or size + len(encoded) + 1 > max_bytes):
+            yield batch
+            batch, size = [], overhead
+        batch.append((doc.get(key_field), encoded))
+        size += len(encoded) + 1
+    if batch:
+        yield batch
+
+
+def _batch_body(batch):
+    return _BATCH_PREFIX + b','.join(encoded for _, encoded in batch) + _BATCH_SUFFIX
+
+
+def _send_batch(index_name, batch, stats, max_retries, backoff):
+    import requests
+    url = IH.search_endpoint() + f"/indexes/{index_name}/docs/index"
+    headers = {**IH.search_headers(), 'Content-Type': 'application/json; charset=utf-8'}
+    attempt = 0
+    while batch:
+        body = _batch_body(batch)
+        try:
+            r = HT.post(url, data=body, headers=headers, params=IH.search_params())
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # a dropped connection or a timeout fails the whole batch, like a 503
+            log.warning(f"Sending {len(batch)} documents failed: {e}")
+            r = None
+        stats.add(nbytes=len(body), batches=1)
+        if r is None or r.status_code in (429, 503):
+            retry = batch
+            failed = []
+        elif r.status_code in (200, 207):
+            by_key = {key: (key, encoded) for key, encoded in batch}
+            retry, failed = [], []
+            for item in r.json()['value']:
+                if item.get('status'):
+                    continue
+                if item.get('statusCode') in RETRYABLE_STATUS:
+                    retry.append(by_key[item['key']])
+                else:
+                    log.error(f"Document {item['key']} rejected: {item.get('errorMessage')}")
+                    failed.append(item['key'])
+            stats.add(docs=len(batch) - len(retry) - len(failed), failed=len(failed), failed_keys=failed)
+        else:
+            log.error(f"Error uploading batch to index")
+            log.error(r.text)
+            stats.add(failed=len(batch), failed_keys=[key for key, _ in batch])
+            return
+        if not retry:
+            return
+        attempt += 1
+        if attempt > max_retries:
+            log.error(f"Giving up on {len(retry)} documents after {max_retries} retries")
+            stats.add(failed=len(retry), failed_keys=[key for key, _ in retry])
+            return
+        stats.add(retried=len(retry))
+        delay = backoff * 2 ** (attempt - 1)
+        wait_seconds = r.headers.get('Retry-After') if r is not None else None
+        if wait_seconds:
+            delay = max(delay, float(wait_seconds))
+        log.warning(f"Retrying {len(retry)} documents in {delay:.1f}s (attempt {attempt})")
+        time.sleep(delay * (0.5 + random.random() / 2))
+        batch = retry
+
+
+def upload_documents(index_name, documents, action="mergeOrUpload", key_field="id",
+                     max_docs=MAX_BATCH_DOCS, max_bytes=MAX_BATCH_BYTES, max_workers=4,
+                     max_retries=5, backoff=1.0, suppress_errors=False):
+    """
+    Upload a stream of documents to an index with batching and bounded parallelism.
+    Only the documents reported as failed with a transient status in a 207 multi-status response are retried,
+    or the whole batch on a 429 / 503 response, a connection error or a timeout.
+    :param index_name: The name of the target index
+    :param documents: Iterable or generator of documents, consumed lazily
+    :param action: The @search.action for documents that do not set one (upload, merge, mergeOrUpload, delete)
+    :param key_field: Name of the key field of the index
+    :param max_docs: Maximum number of documents per request
+    :param max_bytes: Maximum request body size in bytes
+    :param max_workers: Maximum number of requests in flight
+    :param max_retries: Maximum number of retries of the failed part of a batch
+    :param backoff: Initial backoff in seconds, doubled on each retry
+    :param suppress_errors: Do not raise when some documents could not be uploaded
+    :return: dict with docs, failed, bytes, batches, retried, elapsed, docs_per_sec, bytes_per_sec
+    """
+    log.info(f"Bulk uploading documents to {index_name} (max_docs={max_docs}, max_workers={max_workers})")
+    stats = UploadStats()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        for batch in iter_batches(documents, action, key_field, max_docs, max_bytes):
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    f.result()
+            pending.add(pool.submit(_send_batch, index_name, batch, stats, max_retries, backoff))
+        for f in pending:
+            f.result()
+    report = stats.finish().as_dict()
+    log.info(f"Bulk upload done: {report}")
+    if stats.failed:
+        log.error(f"{stats.failed} documents failed, first keys: {stats.failed_keys[:10]}")
+        if not suppress_errors:
+            raise Exception(f"Error uploading {stats.failed} documents to index")
+    return report
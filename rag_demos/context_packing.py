@@ -0,0 +1,180 @@
+import re
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.rate_limiter as RL
+
+log = U.get_logger(__name__)
+
+# CONTEXT_TOKEN_BUDGET: tokens of retrieved text put into the prompt, 0 for no limit
+# NEAR_DUPLICATE_THRESHOLD: word 5-gram Jaccard similarity above which the lower scored of two chunks is dropped
+__getattr__ = S.lazy_constants(__name__, {"CONTEXT_TOKEN_BUDGET": "context_token_budget",
+                                          "NEAR_DUPLICATE_THRESHOLD": "near_duplicate_threshold"})
+# a chunk cut to the remaining budget is only kept if at least this many tokens are left for it
+MIN_PARTIAL_TOKENS = 128
+
+# chunk ids end in their position within the source file: "..._chunks_12" locally, "..._pages_12" from the skillset
+_CHUNK_NUMBER = re.compile(r"_(\d+)$")
+# this much of the start of a chunk is looked up in the end of the previous one to find their overlap
+_OVERLAP_PROBE = 64
+
+
+def _chunk_number(doc):
+    m = _CHUNK_NUMBER.search(doc.get("id") or "")
+    return int(m.group(1)) if m else None
+
+
+def _source(doc):
+    # ParentKey is unique within an index, results merged from several indexes carry their @search.index
+    return doc.get("@search.index"), doc.get("ParentKey")
+
+
+def _score(doc):
+    return doc.get("@search.score") or 0.0
+
+
+def overlap_length(first, second):
+    """
+    Number of characters at the end of `first` that `second` starts with, the overlap of consecutive chunks
+    """
+    probe = second[:_OVERLAP_PROBE]
+    start = first.find(probe, max(0, len(first) - len(second)))
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+def join_overlapping(first, second):
+    """
+    Concatenate two consecutive chunks, keeping the text they share once
+    """
+    n = overlap_length(first, second)
+    return first + second[n:] if n else first + "\n" + second
+
+
+def merge_adjacent(docs):
+    """
+    Merge chunks of the same ParentKey with consecutive chunk numbers into one document, removing their overlap.
+    The merged document keeps the id of its first chunk and the best score of its parts.
+    :return: (documents ordered by score, number of chunks merged into others)
+    """
+    groups, others = {}, []
+    for doc in docs:
+        number = _chunk_number(doc)
+        if number is None or doc.get("ParentKey") is None:
+            others.append(doc)
+        else:
+            groups.setdefault(_source(doc), []).append((number, doc))
+    merged, absorbed = [], 0
+    for parts in groups.values():
+        parts.sort(key=lambda p: p[0])
+        run_number, run = parts[0][0], dict(parts[0][1])
+        for number, doc in parts[1:]:
+            if number == run_number + 1:
+                run["chunk"] = join_overlapping(run["chunk"] or "", doc["chunk"] or "")
+                run["@search.score"] = max(_score(run), _score(doc))
+                absorbed += 1
+            elif number == run_number:
+                absorbed += 1  # the same chunk retrieved twice
+            else:
+                merged.append(run)
+                run = dict(doc)
+            run_number = number
+        merged.append(run)
+    return sorted(merged + others, key=_score, reverse=True), absorbed
+
+
+def _shingles(text, n=5):
+    words = text.lower().split()
+    return {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def drop_duplicates(docs, threshold=None):
+    """
+    Remove documents contained in, or near-duplicates of, a better scored document
+    :param docs: Documents ordered by score
+    :param threshold: NEAR_DUPLICATE_THRESHOLD by default
+    :return: (kept documents, number dropped)
+    """
+    threshold = S.get_settings().near_duplicate_threshold if threshold is None else threshold
+    kept, kept_shingles = [], []
+    for doc in docs:
+        text = " ".join((doc["chunk"] or "").split())
+        shingles = _shingles(text)
+        duplicate = False
+        for other, other_shingles in zip(kept, kept_shingles):
+            if text in other["_normalized"]:
+                duplicate = True
+                break
+            overlap = len(shingles & other_shingles) / max(len(shingles | other_shingles), 1)
+            if overlap >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append({**doc, "_normalized": text})
+            kept_shingles.append(shingles)
+    dropped = len(docs) - len(kept)
+    for doc in kept:
+        del doc["_normalized"]
+    return kept, dropped
+
+
+def _neighbour(selected, doc, offset):
+    number = _chunk_number(doc)
+    if number is None:
+        return None
+    return selected.get((_source(doc), number + offset))
+
+
+def pack_context(docs, budget=None, dedup=True):
+    """
+    Retrieval post-processing before the chunks go into the prompt: drop duplicates, fill the token budget with
+    chunks in score order and merge the selected chunks that are adjacent in their source file.
+    A chunk next to an already selected one only costs the tokens it does not share with it. The best chunk is cut
+    to the budget if it does not fit on its own, other chunks that do not fit are skipped.
+    :param docs: Retrieved documents with chunk, ParentKey, id and @search.score
+    :param budget: Token budget of the chunk texts, 0 for no limit, CONTEXT_TOKEN_BUDGET by default
+    :return: (packed documents ordered by score, report with the token counts before and after)
+    """
+    budget = S.get_settings().context_token_budget if budget is None else budget
+    retrieved = len(docs)
+    tokens_before = sum(RL.count_tokens(d["chunk"] or "") for d in docs)
+    dropped = 0
+    if dedup:
+        docs, dropped = drop_duplicates(sorted(docs, key=_score, reverse=True))
+    selected, packed, used, skipped = {}, [], 0, 0
+    for doc in docs:
+        text = doc["chunk"] or ""
+        if dedup:
+            previous, following = _neighbour(selected, doc, -1), _neighbour(selected, doc, 1)
+            if previous is not None:
+                text = text[overlap_length(previous["chunk"] or "", text):]
+            if following is not None:
+                text = text[:len(text) - overlap_length(text, following["chunk"] or "")]
+        tokens = RL.count_tokens(text)
+        if budget and used + tokens > budget:
+            if packed or budget - used < MIN_PARTIAL_TOKENS:
+                skipped += 1
+                continue
+            doc = {**doc, "chunk": RL.truncate_to_tokens(doc["chunk"], budget - used)}
+            tokens = budget - used
+        packed.append(doc)
+        used += tokens
+        if dedup and _chunk_number(doc) is not None:
+            selected[(_source(doc), _chunk_number(doc))] = doc
+    merged = 0
+    if dedup:
+        packed, merged = merge_adjacent(packed)
+    report = {
+        "retrieved": retrieved,
+        "packed": len(packed),
+        "merged": merged,
+        "duplicates": dropped,
+        "over_budget": skipped,
+        "tokens_before": tokens_before,
+        "tokens_after": sum(RL.count_tokens(d["chunk"] or "") for d in packed),
+    }
+    report["tokens_saved"] = report["tokens_before"] - report["tokens_after"]
+    log.debug(f"Packed context: {report}")
+    return packed, report
@@ -0,0 +1,42 @@
+import hashlib
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+
+log = U.get_logger(__name__)
+
+
+class FakeEmbedder:
+    """
+    Deterministic embedder for tests and offline runs: the vector of a text only depends on its content.
+    Has EMBEDDING_DIMENSIONS (1536 when unset) dimensions by default.
+    """
+
+    def __init__(self, dimensions=None, model="fake"):
+        self.model = model
+        self.dimensions = dimensions or S.get_settings().fake_embedding_dimensions
+
+    def embed(self, texts):
+        out = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            v = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            out[i] = v / np.linalg.norm(v)
+        return out
+
+
+class AzureOpenAIEmbedder:
+    """
+    Embedder backed by the Azure OpenAI embedding deployment used by the index vectorizer.
+    Requests are packed by input count and token budget and sent concurrently, see embedding_client.
+    They use the batch lane of the rate limiter unless a priority is given, e.g. RL.INTERACTIVE for query embeddings.
+    """
+
+    def __init__(self, model=None, dimensions=None, **client_kwargs):
+        from rag_demos.embedding_client import EmbeddingClient
+        self.client = EmbeddingClient(model=model, dimensions=dimensions, **client_kwargs)
+        self.model = self.client.model
+        self.dimensions = self.client.dimensions
+
+    def embed(self, texts):
+        return self.client.embed(texts)
@@ -0,0 +1,136 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+
+log = U.get_logger(__name__)
+
+__getattr__ = S.lazy_constants(__name__, {"DEFAULT_PATH": "embedding_cache_path",
+                                          "DEFAULT_MAX_BYTES": "embedding_cache_max_bytes"})
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache in a SQLite file.
+    Entries are keyed by (model, dimensions, sha256 of the text) and stored as raw float32 blobs;
+    the least recently used entries are evicted when the vectors exceed max_bytes
+    (EMBEDDING_CACHE_PATH and EMBEDDING_CACHE_MAX_BYTES by default).
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        path = path or S.get_settings().embedding_cache_path
+        max_bytes = max_bytes or S.get_settings().embedding_cache_max_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                model TEXT NOT NULL, dimensions INTEGER NOT NULL, hash BLOB NOT NULL,
+                                vector BLOB NOT NULL, last_used REAL NOT NULL,
+                                PRIMARY KEY (model, dimensions, hash)) WITHOUT ROWID""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0, "bytes": self._bytes}
+
+    def get_many(self, model, dimensions, hashes):
+        """
+        Look up vectors by text hash
+        :return: dict hash -> float32 vector for the hashes found
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND dimensions = ? "
+                    f"AND hash IN ({','.join('?' * len(part))})", (model, dimensions, *part)).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._db.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND hash = ?",
+                                     [(now, model, dimensions, h) for h in found])
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model, dimensions, hashes, vectors):
+        now = time.time()
+        blobs = [np.asarray(v, dtype=np.float32).tobytes() for v in vectors]
+        with self._lock:
+            self._db.execute("BEGIN")
+            for h, blob in zip(hashes, blobs):
+                cur = self._db.execute("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+                                       (model, dimensions, h, blob, now))
+                self._bytes += len(blob) * cur.rowcount
+            self._db.execute("COMMIT")
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # evict least recently used entries down to 90% of the limit so eviction does not run on every insert
+        target = int(self.max_bytes * 0.9)
+        rows = self._db.execute("SELECT model, dimensions, hash, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        doomed, freed = [], 0
+        for model, dimensions, h, size in rows:
+            if self._bytes - freed <= target:
+                break
+            doomed.append((model, dimensions, h))
+            freed += size
+        rows.close()
+        self._db.execute("BEGIN")
+        self._db.executemany("DELETE FROM embeddings WHERE model = ? AND dimensions = ? AND hash = ?", doomed)
+        self._db.execute("COMMIT")
+        self._bytes -= freed
+        self.evicted += len(doomed)
+        log.info(f"Evicted {len(doomed)} embeddings ({freed} bytes) from {self.path}")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedEmbedder:
+    """
+    Wrap an embedder so only texts missing from the cache are sent to it
+    """
+
+    def __init__(self, embedder, cache=None):
+        self.embedder = embedder
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.model = embedder.model
+        self.dimensions = embedder.dimensions
+
+    def embed(self, texts):
+        hashes = [text_hash(t) for t in texts]
+        found = self.cache.get_many(self.model, self.dimensions, list(dict.fromkeys(hashes)))
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, t)
+        if missing:
+            vectors = self.embedder.embed(list(missing.values()))
+            self.cache.put_many(self.model, self.dimensions, list(missing), vectors)
+            found.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+        return np.stack([found[h] for h in hashes]) if hashes else np.empty((0, self.dimensions), dtype=np.float32)
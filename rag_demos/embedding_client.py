@@ -0,0 +1,109 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.rate_limiter as RL
+from rag_demos.rate_limiter import count_tokens
+
+log = U.get_logger(__name__)
+
+MAX_INPUT_TOKENS = 8191  # per input limit of the text-embedding models
+# request packing (EMBEDDING_MAX_INPUTS is the inputs per request accepted by the service) and deployment budget
+__getattr__ = S.lazy_constants(__name__, {"MAX_INPUTS": "embedding_max_inputs",
+                                          "MAX_REQUEST_TOKENS": "embedding_max_request_tokens",
+                                          "EMBEDDING_RPM": "embedding_rpm", "EMBEDDING_TPM": "embedding_tpm"})
+
+
+def _truncate(text, tokens):
+    if tokens <= MAX_INPUT_TOKENS:
+        return text, tokens
+    return RL.truncate_to_tokens(text, MAX_INPUT_TOKENS), MAX_INPUT_TOKENS
+
+
+def iter_requests(texts, max_inputs=None, max_tokens=None):
+    """
+    Pack a stream of texts into requests bounded by input count and token budget.
+    Yields (offset of the first text, texts, token count); texts longer than the model limit are truncated.
+    :param max_inputs: EMBEDDING_MAX_INPUTS by default
+    :param max_tokens: EMBEDDING_MAX_REQUEST_TOKENS by default
+    """
+    max_inputs = max_inputs or S.get_settings().embedding_max_inputs
+    max_tokens = max_tokens or S.get_settings().embedding_max_request_tokens
+    batch, batch_tokens, offset = [], 0, 0
+    for text in texts:
+        text, tokens = _truncate(text or " ", count_tokens(text or " "))
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            yield offset, batch, batch_tokens
+            offset += len(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield offset, batch, batch_tokens
+
+
+class EmbeddingClient:
+    """
+    Batched, concurrent client for an Azure OpenAI embedding deployment.
+    Requests go through the shared scheduler in the batch lane, rpm/tpm configure the deployment's budget there
+    (EMBEDDING_RPM / EMBEDDING_TPM by default, 0 to leave it unconfigured). With a TPM budget, requests are packed to
+    at most the tokens the lane may use per minute.
+    """
+
+    def __init__(self, model=None, dimensions=None, max_workers=4, rpm=None, tpm=None,
+                 max_inputs=None, max_request_tokens=None, max_retries=8, priority=RL.BATCH):
+        settings = S.get_settings()
+        rpm = settings.embedding_rpm if rpm is None else rpm
+        tpm = settings.embedding_tpm if tpm is None else tpm
+        self.model = model or settings.embedding_deployment
+        # only text-embedding-3 models accept "dimensions", it is sent when asked for like in get_embeddings
+        self.request_dimensions = dimensions
+        self.dimensions = dimensions or settings.embedding_dimensions
+        self.max_workers = max_workers
+        self.max_inputs = max_inputs or settings.embedding_max_inputs
+        self.max_request_tokens = max_request_tokens or settings.embedding_max_request_tokens
+        self.max_retries = max_retries
+        self.priority = priority
+        if rpm or tpm:
+            RL.get_scheduler().configure(self.model, rpm, tpm)
+        if tpm:
+            # a request must fit in the part of the TPM budget its lane may use, or the scheduler never admits it
+            headroom = RL.get_scheduler().batch_headroom if priority == RL.BATCH else 0.0
+            self.max_request_tokens = min(self.max_request_tokens, max(MAX_INPUT_TOKENS, int(tpm * (1 - headroom))))
+        self.url = f"{S.get_settings().openai_endpoint}/openai/deployments/{self.model}/embeddings"
+
+    def _post(self, texts, tokens):
+        import rag_demos.openai_helpers as OH
+        body = {"input": texts}
+        if self.request_dimensions:
+            body["dimensions"] = self.request_dimensions
+        r = OH.post_with_retries(self.url, body, self.model, tokens, self.priority, self.max_retries)
+        data = sorted(r.json()["data"], key=lambda d: d["index"])
+        return np.asarray([d["embedding"] for d in data], dtype=np.float32)
+
+    def embed(self, texts):
+        """
+        Embed a stream of texts
+        :param texts: Iterable of strings, consumed lazily
+        :return: float32 array of shape (len(texts), dimensions), rows in input order
+        """
+        requests = iter_requests(texts, self.max_inputs, self.max_request_tokens)
+        first, second = next(requests, None), next(requests, None)
+        if first is None:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        if second is None:
+            # a single request, e.g. the query of a search, is sent from the calling thread
+            return self._post(first[1], first[2])
+        parts = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {}
+            for offset, batch, tokens in itertools.chain((first, second), requests):
+                if len(pending) >= self.max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        parts[pending.pop(f)] = f.result()
+                pending[pool.submit(self._post, batch, tokens)] = offset
+            for f, offset in pending.items():
+                parts[offset] = f.result()
+        return np.concatenate([parts[offset] for offset in sorted(parts)])
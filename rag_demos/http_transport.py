@@ -0,0 +1,127 @@
+import threading
+from urllib.parse import urlsplit
+
+import certifi
+import rag_demos.utils as U
+import rag_demos.settings as S
+
+log = U.get_logger(__name__)
+
+# resolved once instead of on every request
+CA_BUNDLE = certifi.where()
+
+# pool sizes and timeouts are read from the settings when a session or request needs them
+__getattr__ = S.lazy_constants(__name__, {"POOL_CONNECTIONS": "http_pool_connections",
+                                          "POOL_MAXSIZE": "http_pool_maxsize",
+                                          "CONNECT_TIMEOUT": "http_connect_timeout",
+                                          "READ_TIMEOUT": "http_read_timeout"})
+
+_sessions = {}
+_request_counts = {}
+_lock = threading.Lock()
+
+
+def _endpoint_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url) -> "requests.Session":
+    """
+    Return the pooled keep-alive session for the endpoint (scheme + host) of the url.
+    Sessions are created on first use and shared by all helper modules.
+    :param url: Any url on the endpoint
+    """
+    key = _endpoint_key(url)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    # requests takes ~100 ms to import, it is only loaded with the first session
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            settings = S.get_settings()
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=settings.http_pool_connections,
+                                  pool_maxsize=settings.http_pool_maxsize, pool_block=False)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.verify = CA_BUNDLE
+            session.headers['Connection'] = 'keep-alive'
+            _sessions[key] = session
+            _request_counts[key] = 0
+            log.debug(f"Created pooled session for {key} (pool_maxsize={settings.http_pool_maxsize})")
+        return session
+
+
+def request(method, url, **kwargs) -> "requests.Response":
+    """
+    Send a request through the pooled session of the url's endpoint.
+    Accepts the same keyword arguments as requests.request, a default (connect, read) timeout is applied.
+    :param method: HTTP method
+    :param url: Full url of the request
+    """
+    if 'timeout' not in kwargs:
+        settings = S.get_settings()
+        kwargs['timeout'] = (settings.http_connect_timeout, settings.http_read_timeout)
+    session = get_session(url)
+    key = _endpoint_key(url)
+    with _lock:
+        _request_counts[key] += 1
+    return session.request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+
+def get_stats():
+    """
+    Connection reuse counters per endpoint.
+    `connections` is the number of TCP+TLS handshakes performed, `reused` the requests served on an already open connection.
+    """
+    stats = {}
+    with _lock:
+        items = list(_sessions.items())
+        counts = dict(_request_counts)
+    for key, session in items:
+        connections = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+        requests_sent = counts.get(key, 0)
+        stats[key] = {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": max(requests_sent - connections, 0),
+            "reuse_ratio": round(1 - connections / requests_sent, 4) if requests_sent else 0.0,
+        }
+    return stats
+
+
+def close_all():
+    """
+    Close all pooled sessions, e.g. at the end of a batch job.
+    """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _request_counts.clear()
@@ -1,17 +1,34 @@
 import logging
 import os
+import copy
 import json
-import requests
-from dotenv import load_dotenv
 import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.http_transport as HT
 import time
-import certifi
 
-load_dotenv()
 log = U.get_logger(__name__)
 
-headers = {'Content-Type': 'application/json', 'api-key': os.environ['AZURE_SEARCH_KEY']}
-params = {'api-version': os.environ['AZURE_SEARCH_API_VERSION']}
+
+def search_endpoint():
+    return S.get_settings().search_endpoint
+
+
+def search_headers():
+    return {'Content-Type': 'application/json', 'api-key': S.get_settings().search_key}
+
+
+def search_params():
+    return {'api-version': S.get_settings().search_api_version}
+
+
+def __getattr__(name):
+    # headers and params used to be built at import time
+    if name == 'headers':
+        return search_headers()
+    if name == 'params':
+        return search_params()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def create_object(object_name, object_type, payload, suppress_errors=False):
@@ -26,8 +43,8 @@ def create_object(object_name, object_type, payload, suppress_errors=False):
     plural = {'datasource': 'datasources', 'index': 'indexes', 'skillset': 'skillsets', 'indexer': 'indexers'}
     # Setup the Payloads header
 
-    r = requests.put(os.environ['AZURE_SEARCH_ENDPOINT'] + f"/{plural[object_type]}/" + object_name,
-                     data=json.dumps(payload), headers=headers, params=params, verify=certifi.where())
+    r = HT.put(search_endpoint() + f"/{plural[object_type]}/" + object_name,
+               data=json.dumps(payload), headers=search_headers(), params=search_params())
     logging.debug(r.text)
     if r.ok:
         log.info(f"{object_type} created successfully")
@@ -48,8 +65,8 @@ def delete_object(object_name, object_type, suppress_errors=True):
     plural = {'datasource': 'datasources', 'index': 'indexes', 'skillset': 'skillsets', 'indexer': 'indexers'}
     # Setup the Payloads header
 
-    r = requests.delete(os.environ['AZURE_SEARCH_ENDPOINT'] + f"/{plural[object_type]}/" + object_name,
-                        headers=headers, params=params, verify=certifi.where())
+    r = HT.delete(search_endpoint() + f"/{plural[object_type]}/" + object_name,
+                  headers=search_headers(), params=search_params())
     logging.debug(r.text)
     if r.ok:
         log.info(f"{object_type} deleted successfully")
@@ -59,6 +76,27 @@ def delete_object(object_name, object_type, suppress_errors=True):
         if not suppress_errors: raise Exception(f"Error creating {object_type}")
 
 
+def get_object(object_name, object_type):
+    """
+    Get the current definition of an object in Azure Search
+    :param object_name: The name of the object
+    :param object_type: The type of object, must be one of: datasource, index, skillset, indexer
+    :return: The definition, or None if the object does not exist
+    """
+    assert (object_type in ['datasource', 'index', 'skillset', 'indexer'])
+    plural = {'datasource': 'datasources', 'index': 'indexes', 'skillset': 'skillsets', 'indexer': 'indexers'}
+    r = HT.get(search_endpoint() + f"/{plural[object_type]}/" + object_name,
+               headers=search_headers(), params=search_params())
+    log.debug(r.text)
+    if r.status_code == 404:
+        return None
+    if not r.ok:
+        log.error(f"Error getting {object_type} {object_name}")
+        log.error(r.text)
+        raise Exception(f"Error getting {object_type}")
+    return r.json()
+
+
 def create_all_objects(names, payloads):
     """
     Create all objects in Azure Search
@@ -76,9 +114,9 @@ def run_indexer(indexer_name):
     Run the indexer in Azure Search
     """
     log.info("Running indexer")
-    r = requests.post(os.environ['AZURE_SEARCH_ENDPOINT']
-                      + f"/indexers/{indexer_name}/run",
-                      headers=headers, params=params, verify=certifi.where())
+    r = HT.post(search_endpoint()
+                + f"/indexers/{indexer_name}/run",
+                headers=search_headers(), params=search_params())
     log.debug(r.text)
     if not r.ok or "error" in r:
         raise Exception(r.text)
@@ -86,31 +124,41 @@ def run_indexer(indexer_name):
 
 
 
-def get_indexer_status(indexer_name):
+def reset_indexer(indexer_name):
+    """
+    Reset the change tracking of the indexer, so its next run processes all documents
+    """
+    log.info(f"Resetting indexer {indexer_name}")
+    r = HT.post(search_endpoint()
+                + f"/indexers/{indexer_name}/reset",
+                headers=search_headers(), params=search_params())
+    log.debug(r.text)
+    if not r.ok:
+        raise Exception(r.text)
+    return r
+
+
+def get_indexer_status(indexer_name, full=False):
     """
     Get the status of the indexer in Azure Search
+    :param full: Return the whole status payload (status, lastResult, executionHistory, limits) instead of lastResult
     """
     log.info(f"Getting indexer status for: {indexer_name}")
-    r = requests.get(os.environ['AZURE_SEARCH_ENDPOINT']
-                     + f"/indexers/{indexer_name}/status",
-                     headers=headers, params=params, verify=certifi.where())
+    r = HT.get(search_endpoint()
+               + f"/indexers/{indexer_name}/status",
+               headers=search_headers(), params=search_params())
     log.debug(r.text)
     if not r.ok or "error" in r:
         raise Exception(r.text)
-    return r.json().get('lastResult')
-
-# def wait_for_indexer(indexer_name, status='success'):
-#     """
-#     Wait for the indexer to reach a certain status
-#     """
-#     log.info(f"Waiting for indexer to reach status {status}")
-#     while True:
-#         r = get_indexer_status(indexer_name)
-#         log.debug("indexer status: " + str(r))
-#         if r['lastResult']['status'] == status:
-#             break
-#         time.sleep(5)
-#     log.info(f"Indexer reached status {status}")
+    return r.json() if full else r.json().get('lastResult')
+
+
+def wait_for_indexer(indexer_name, timeout=None, since=None):
+    """
+    Wait for the current run of the indexer to finish, see indexer_monitor.wait_for_indexer
+    """
+    import rag_demos.indexer_monitor as IM
+    return IM.wait_for_indexer(indexer_name, timeout=timeout, since=since)
 
 
 def delete_all_objects(names):
@@ -125,13 +173,14 @@ def delete_all_objects(names):
 
 
 def add_filter_to_extra_body(extra_body, fltr):
-    eb = extra_body.copy()
+    # a deep copy, a shallow one would set the filter on the caller's data source too
+    eb = copy.deepcopy(extra_body)
     eb["data_sources"][0]["parameters"]["filter"] = fltr
     return eb
 
 def put_document(index_name, payload):
-    r = requests.post(os.environ['AZURE_SEARCH_ENDPOINT'] + f"/indexes/{index_name}/docs/index",
-                      data=json.dumps(payload), headers=headers, params=params, verify=certifi.where())
+    r = HT.post(search_endpoint() + f"/indexes/{index_name}/docs/index",
+                data=json.dumps(payload), headers=search_headers(), params=search_params())
     log.debug(r.text)
     if not r.ok:
         log.error(f"Error adding document to index")
@@ -139,15 +188,278 @@ def put_document(index_name, payload):
         raise Exception(f"Error adding document to index")
     log.info(f"Document added to index")
 
+# Azure AI Search returns at most 1000 documents per request and rejects a skip above 100000
+MAX_PAGE_SIZE = 1000
+MAX_SKIP = 100000
+SCAN_READ_BYTES = 64 * 1024
+
+# index name -> select clause of its retrievable fields without the vector fields, None when the definition
+# cannot be read with the configured key (a query key), valid for one index generation
+_default_selects = {}
+_default_selects_generation = None
+
+
+def _select_from_definition(definition):
+    # vector fields are the ones with dimensions, e.g. chunkVector of type Collection(Edm.Single)
+    return ",".join(f["name"] for f in definition.get("fields", [])
+                    if str(f.get("retrievable", True)).lower() != "false" and not f.get("dimensions"))
+
+
+def _drop_stale_selects():
+    # a rebuild or schema change bumps the index generation, the fields may have changed with it
+    global _default_selects_generation
+    generation = U.index_generation()
+    if generation != _default_selects_generation:
+        _default_selects.clear()
+        _default_selects_generation = generation
+
+
+def _store_select(index_name, r):
+    # r is the requests or httpx response of GET /indexes/{index_name}
+    if r.status_code in (401, 403):
+        log.warning(f"The search key cannot read the definition of {index_name}, searching without a default select")
+        select = None
+    elif r.status_code == 404:
+        raise Exception(f"Index {index_name} does not exist")
+    elif r.status_code >= 400:
+        log.error(r.text)
+        raise Exception(f"Error getting index {index_name}")
+    else:
+        select = _select_from_definition(r.json())
+    _default_selects[index_name] = select
+    return select
+
+
+def default_select(index_name):
+    """
+    The select clause used when a search payload has none: all retrievable fields except the vectors.
+    Read from the index definition once per index and index generation. None with a query key, which cannot
+    read index definitions, then all retrievable fields are returned.
+    """
+    _drop_stale_selects()
+    if index_name not in _default_selects:
+        return _store_select(index_name, HT.get(search_endpoint() + f"/indexes/{index_name}",
+                                                headers=search_headers(), params=search_params()))
+    return _default_selects[index_name]
+
+
+def _projected(index_name, payload):
+    if payload.get("select"):
+        return payload
+    select = default_select(index_name)
+    return {**payload, "select": select} if select else payload
+
+
 def search(index_name, payload):
-    r = requests.post(os.environ['AZURE_SEARCH_ENDPOINT'] + f"/indexes/{index_name}/docs/search",
-                      data=json.dumps(payload), headers=headers, params=params, verify=certifi.where())
-    search_results = r.json()
+    """
+    Search an index and return the whole response. Without a select in the payload the vector fields are
+    left out of the results, see default_select.
+    """
+    payload = _projected(index_name, payload)
+    r = HT.post(search_endpoint() + f"/indexes/{index_name}/docs/search",
+                data=json.dumps(payload), headers=search_headers(), params=search_params())
     log.debug(r.text)
-    log.info("Results Found: {}, Results Returned: {}".format(search_results['@odata.count'], len(search_results['value'])))
     if not r.ok:
         log.error(f"Error searching index")
         log.error(r.text)
         raise Exception(f"Error searching index")
+    search_results = r.json()
+    log.info("Results Found: {}, Results Returned: {}".format(search_results.get('@odata.count'), len(search_results['value'])))
+    log.info(f"Search successful")
+    return search_results
+
+
+def iter_json_array(chunks, key="value", meta=None):
+    """
+    Parse a JSON object arriving in text chunks and yield the items of its array `key` one at a time,
+    so only one item and one chunk are held in memory. The other top-level members are stored in `meta`.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+
+    def more():
+        nonlocal buf, pos, eof
+        for chunk in chunks:
+            if chunk:
+                buf, pos = buf[pos:] + chunk, 0
+                return True
+        eof = True
+        return False
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not more():
+                raise ValueError("Truncated JSON")
+
+    def skip(chars):
+        nonlocal pos
+        char = peek()
+        if char not in chars:
+            raise ValueError(f"Unexpected {char!r} in JSON, expected one of {chars!r}")
+        pos += 1
+        return char
+
+    def value():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(buf) or eof:
+                    pos = end
+                    return item
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            more()
+
+    skip("{")
+    if peek() == "}":
+        return
+    while True:
+        name = value()
+        skip(":")
+        if name == key:
+            skip("[")
+            if peek() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield value()
+                    if skip(",]") == "]":
+                        break
+        elif meta is not None:
+            meta[name] = value()
+        else:
+            value()
+        if skip(",}") == "}":
+            return
+
+
+def iter_search(index_name, payload=None, page_size=MAX_PAGE_SIZE, max_results=None, meta=None):
+    """
+    Lazily page through the results of a search, e.g. a full scan with {"search": "*"}.
+    Pages are requested with top/skip, or with @search.nextPageParameters when the service returns them, and
+    each response is parsed while it streams in, so memory does not grow with the number of results.
+    Without a select in the payload the vector fields are not returned, see default_select.
+    Results of a query without orderby are only in a stable order between pages for an unchanged index.
+    :param payload: Search request body, its top (or max_results) is the total number of results wanted
+    :param page_size: Documents per request, at most MAX_PAGE_SIZE
+    :param meta: dict receiving the other members of the first response, e.g. @odata.count
+    :return: Iterator of documents
+    """
+    page = _projected(index_name, dict(payload or {"search": "*"}))
+    wanted = page.pop("top", None) or max_results
+    wanted = min(wanted, max_results) if max_results else wanted
+    skip = page.pop("skip", 0)
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    returned = 0
+    while wanted is None or returned < wanted:
+        if skip > MAX_SKIP:
+            raise Exception(f"Cannot page beyond skip {MAX_SKIP}, narrow the search with a filter")
+        size = page_size if wanted is None else min(page_size, wanted - returned)
+        body = {**page, "skip": skip, "top": size}
+        page_meta = {}
+        r = HT.post(search_endpoint() + f"/indexes/{index_name}/docs/search", data=json.dumps(body),
+                    headers=search_headers(), params=search_params(), stream=True)
+        with r:
+            if not r.ok:
+                log.error(f"Error searching index")
+                log.error(r.text)
+                raise Exception(f"Error searching index")
+            r.encoding = r.encoding or "utf-8"
+            n = 0
+            for doc in iter_json_array(r.iter_content(SCAN_READ_BYTES, decode_unicode=True), meta=page_meta):
+                yield doc
+                n += 1
+        if meta is not None and not returned:
+            meta.update(page_meta)
+        returned += n
+        next_page = page_meta.get("@search.nextPageParameters")
+        if next_page:
+            # the service ended the page early, continue from where it says
+            skip = next_page.get("skip", skip + n)
+            continue
+        if n < size:
+            return
+        skip += n
+
+# asyncio counterparts, sharing one async connection pool per endpoint (see async_transport)
+
+async def arun_indexer(indexer_name):
+    """
+    Run the indexer in Azure Search
+    """
+    import rag_demos.async_transport as AT
+    log.info("Running indexer")
+    r = await AT.post(search_endpoint() + f"/indexers/{indexer_name}/run",
+                      headers=search_headers(), params=search_params())
+    log.debug(r.text)
+    if not r.is_success:
+        raise Exception(r.text)
+    return r
+
+
+async def aget_indexer_status(indexer_name, full=False):
+    """
+    Get the status of the indexer in Azure Search
+    :param full: Return the whole status payload instead of lastResult
+    """
+    import rag_demos.async_transport as AT
+    log.info(f"Getting indexer status for: {indexer_name}")
+    r = await AT.get(search_endpoint() + f"/indexers/{indexer_name}/status",
+                     headers=search_headers(), params=search_params())
+    log.debug(r.text)
+    if not r.is_success:
+        raise Exception(r.text)
+    return r.json() if full else r.json().get('lastResult')
+
+
+async def aput_document(index_name, payload):
+    import rag_demos.async_transport as AT
+    r = await AT.post(search_endpoint() + f"/indexes/{index_name}/docs/index",
+                      content=json.dumps(payload), headers=search_headers(), params=search_params())
+    log.debug(r.text)
+    if not r.is_success:
+        log.error(f"Error adding document to index")
+        log.error(r.text)
+        raise Exception(f"Error adding document to index")
+    log.info(f"Document added to index")
+
+
+async def adefault_select(index_name):
+    """
+    Async default_select, sharing its cache
+    """
+    import rag_demos.async_transport as AT
+    _drop_stale_selects()
+    if index_name not in _default_selects:
+        return _store_select(index_name, await AT.get(search_endpoint() + f"/indexes/{index_name}",
+                                                      headers=search_headers(), params=search_params()))
+    return _default_selects[index_name]
+
+
+async def asearch(index_name, payload):
+    import rag_demos.async_transport as AT
+    select = None if payload.get("select") else await adefault_select(index_name)
+    if select:
+        payload = {**payload, "select": select}
+    r = await AT.post(search_endpoint() + f"/indexes/{index_name}/docs/search",
+                      content=json.dumps(payload), headers=search_headers(), params=search_params())
+    log.debug(r.text)
+    if not r.is_success:
+        log.error(f"Error searching index")
+        log.error(r.text)
+        raise Exception(f"Error searching index")
+    search_results = r.json()
+    log.info("Results Found: {}, Results Returned: {}".format(search_results.get('@odata.count'), len(search_results['value'])))
     log.info(f"Search successful")
-    return r.json()
\ No newline at end of file
+    return search_results
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime, timezone
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.index_helpers as IH
+
+log = U.get_logger(__name__)
+
+# final run reports are appended to INDEXER_RUN_LOG
+__getattr__ = S.lazy_constants(__name__, {"RUN_LOG": "indexer_run_log"})
+# a reset also ends an execution record, but it is not the run that is waited for
+FINAL_STATUSES = ("success", "transientFailure", "persistentFailure")
+# `since` of an indexer without executions
+NEVER = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def poll_intervals(initial=1.0, fast_for=30.0, factor=1.5, max_interval=60.0):
+    """
+    Polling delays: every `initial` seconds for the first `fast_for` seconds, then growing by `factor` up to max_interval
+    """
+    elapsed, interval = 0.0, initial
+    while True:
+        yield interval
+        elapsed += interval
+        if elapsed >= fast_for:
+            interval = min(interval * factor, max_interval)
+
+
+def progress(indexer_name, status, started=None):
+    """
+    Structured progress of the current (or last) run from a full status payload.
+    The ETA assumes the run processes as many items as the last successful run did.
+    """
+    last = status.get("lastResult") or {}
+    start = _parse_time(last.get("startTime")) or started
+    end = _parse_time(last.get("endTime"))
+    now = datetime.now(timezone.utc)
+    elapsed = ((end or now) - start).total_seconds() if start else None
+    processed = last.get("itemsProcessed", 0)
+    failed = last.get("itemsFailed", 0)
+    throughput = processed / elapsed if elapsed else None
+    expected = next((run.get("itemsProcessed") for run in status.get("executionHistory", [])[1:]
+                     if run.get("status") == "success" and run.get("itemsProcessed")), None)
+    eta = None
+    if last.get("status") == "inProgress" and expected and throughput:
+        eta = max(expected - processed, 0) / throughput
+    return {
+        "indexer": indexer_name,
+        "status": last.get("status"),
+        "indexer_status": status.get("status"),
+        "start_time": last.get("startTime"),
+        "end_time": last.get("endTime"),
+        "items_processed": processed,
+        "items_failed": failed,
+        "elapsed": round(elapsed, 1) if elapsed is not None else None,
+        "throughput": round(throughput, 2) if throughput is not None else None,
+        "eta": round(eta, 1) if eta is not None else None,
+        "errors": [e.get("errorMessage") for e in last.get("errors", [])][:10],
+        "warnings": len(last.get("warnings", [])),
+        "error_message": last.get("errorMessage"),
+    }
+
+
+def _latest_start(status, finished=False):
+    runs = [status.get("lastResult") or {}] + (status.get("executionHistory") or [])
+    starts = [_parse_time(run.get("startTime")) for run in runs if not finished or run.get("status") != "inProgress"]
+    return max((start for start in starts if start), default=NEVER)
+
+
+def last_run_start(indexer_name):
+    """
+    Start time of the latest execution of the indexer (a run or a reset) by the service's clock.
+    Take it before starting a run and pass it as `since`, the local clock may be skewed against the service.
+    """
+    return _latest_start(IH.get_indexer_status(indexer_name, full=True))
+
+
+def last_success_end(status):
+    """
+    End time of the latest successful run in a full status payload, None if the indexer never succeeded
+    """
+    runs = [status.get("lastResult") or {}] + (status.get("executionHistory") or [])
+    ends = [_parse_time(run.get("endTime")) for run in runs if run.get("status") == "success"]
+    return max((end for end in ends if end), default=None)
+
+
+def _is_done(status, since):
+    last = status.get("lastResult") or {}
+    if last.get("status") not in FINAL_STATUSES:
+        return False
+    # a finished result that did not start after `since` is an earlier run
+    start = _parse_time(last.get("startTime"))
+    return start is None or start > since
+
+
+def write_report(report, path=None):
+    """
+    Append a final run report to the JSONL run log, to track ingestion throughput over time
+    """
+    path = path or S.get_settings().indexer_run_log
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({**report, "recorded": datetime.now(timezone.utc).isoformat()}) + "\n")
+
+
+async def await_indexer(indexer_name, timeout=None, since=None, on_progress=None, intervals=None):
+    """
+    Poll the indexer status with adaptive intervals until its run finishes
+    :param since: Only accept a run that started after this service time, see last_run_start. By default the run
+        in progress at the first poll, or the next one if none is
+    :param timeout: Give up after this many seconds
+    :param on_progress: Callback receiving the progress dict after every poll
+    :return: The final progress report, which is also appended to the run log
+    """
+    started = datetime.now(timezone.utc)
+    deadline = time.monotonic() + timeout if timeout else None
+    intervals = intervals or poll_intervals()
+    while True:
+        status = await IH.aget_indexer_status(indexer_name, full=True)
+        if since is None:
+            since = _latest_start(status, finished=True)
+        report = progress(indexer_name, status, started)
+        if on_progress:
+            on_progress(report)
+        else:
+            log.info(f"{indexer_name}: {report['status']} processed={report['items_processed']} "
+                     f"failed={report['items_failed']} throughput={report['throughput']} eta={report['eta']}")
+        if _is_done(status, since):
+            break
+        if deadline and time.monotonic() > deadline:
+            raise Exception(f"Timed out waiting for indexer {indexer_name}")
+        await asyncio.sleep(next(intervals))
+    write_report(report)
+    log.info(f"Indexer {indexer_name} finished with status {report['status']} in {report['elapsed']}s")
+    return report
+
+
+async def await_indexers(indexer_names, timeout=None, since=None, on_progress=None):
+    """
+    Wait for several indexers concurrently
+    :return: dict indexer name -> final report
+    """
+    reports = await asyncio.gather(*[await_indexer(name, timeout, since, on_progress) for name in indexer_names])
+    return dict(zip(indexer_names, reports))
+
+
+def wait_for_indexer(indexer_name, timeout=None, since=None, on_progress=None):
+    """
+    Blocking version of await_indexer
+    """
+    import rag_demos.async_transport as AT
+    return AT.run(await_indexer(indexer_name, timeout, since, on_progress))
+
+
+def wait_for_indexers(indexer_names, timeout=None, since=None, on_progress=None):
+    """
+    Blocking version of await_indexers
+    """
+    import rag_demos.async_transport as AT
+    return AT.run(await_indexers(indexer_names, timeout, since, on_progress))
+
+
+def run_and_wait(indexer_name, timeout=None):
+    """
+    Start a run of the indexer and wait for it to finish
+    """
+    since = last_run_start(indexer_name)
+    IH.run_indexer(indexer_name)
+    report = wait_for_indexer(indexer_name, timeout=timeout, since=since)
+    if report["status"] == "success":
+        U.bump_index_generation()
+    return report
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime, timezone
+import rag_demos.utils as U
+
+log = U.get_logger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def default_path(index_name):
+    return U.CACHE_DIR / f"ingest_manifest_{index_name}.json"
+
+
+def file_hash(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IngestManifest:
+    """
+    Record of the source files already ingested into an index: content hash, size, mtime, ParentKey and chunk ids
+    per file name. Size and mtime are a quick check, the file is only hashed when they changed.
+    """
+
+    def __init__(self, path, files=None, chunking=None):
+        self.path = Path(path)
+        self.files = files or {}
+        self.chunking = chunking or {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path)
+        if data.get("version") != MANIFEST_VERSION:
+            log.warning(f"Ignoring manifest {path} with version {data.get('version')}")
+            return cls(path)
+        return cls(path, data.get("files"), data.get("chunking"))
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "chunking": self.chunking, "files": self.files}, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def plan(self, paths):
+        """
+        Compare the files on disk with the manifest
+        :return: dict with lists "changed" (new or modified paths), "unchanged" (paths) and "removed" (file names)
+        """
+        changed, unchanged = [], []
+        for path in paths:
+            path = Path(path)
+            entry = self.files.get(path.name)
+            if entry is None:
+                changed.append(path)
+                continue
+            stat = path.stat()
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                unchanged.append(path)
+            elif entry["size"] == stat.st_size and entry["sha256"] == file_hash(path):
+                # touched but identical, remember the new mtime to skip hashing next time
+                entry["mtime"] = stat.st_mtime_ns
+                unchanged.append(path)
+            else:
+                changed.append(path)
+        names = {Path(p).name for p in paths}
+        removed = [name for name in self.files if name not in names]
+        return {"changed": changed, "unchanged": unchanged, "removed": removed}
+
+    def record(self, path, parent_key, chunk_ids):
+        path = Path(path)
+        stat = path.stat()
+        self.files[path.name] = {
+            "sha256": file_hash(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "ParentKey": parent_key,
+            "chunk_ids": list(chunk_ids),
+            "ingested": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def forget(self, name):
+        return self.files.pop(name, None)
+
+    def chunk_ids(self, name):
+        entry = self.files.get(name)
+        return entry["chunk_ids"] if entry else []
@@ -0,0 +1,239 @@
+import re
+import rag_demos.utils as U
+import rag_demos.zakon_index as ZI
+
+log = U.get_logger(__name__)
+
+# a line holding only an article heading: "Član 24a", "Члан 5", "Article 38", "19. člen" (Slovenian)
+ARTICLE_HEADING = re.compile(r"^[»“\"]?\s*(?:(?:Član|Članak|Člen|Члан|Чланак|Article)\s+(\d+[a-zа-ш]?)"
+                             r"|(\d+[a-z]?)\.\s*[čČ]len)\.?\s*$")
+# a line holding only a chapter heading: "GLAVA XIIa", "ГЛАВА I", "CHAPTER ONE", "PRVO POGLAVJE", "V. DEL",
+# or an upper case Slovenian section title like "XI. POSEBNA DOLOČBA"
+CHAPTER_HEADING = re.compile(r"^[»“\"]?\s*(?:(?:GLAVA|Glava|ГЛАВА|Глава|CHAPTER|Chapter)\s+\S+"
+                             r"|\S+\s+(?:POGLAVJE|poglavje)|[IVXLC]+\.\s+DEL|(?:SPLOŠNI|POSEBNI)\s+DEL"
+                             r"|[IVXLC]+\.\s+[A-ZČĆŠŽĐ][A-ZČĆŠŽĐ ,\-]+)\s*$")
+# numbered paragraphs "(1)" / "1)" start a line, oversized articles are split in front of them
+PARAGRAPH_START = re.compile(r"^\s*\(?\d+[a-z]?\)\s")
+# lines following a chapter heading that are taken as its title rather than as text
+CHAPTER_TITLE_MAX_LENGTH = 200
+
+
+def iter_sections(pages):
+    """
+    Split a stream of page texts of one law into its articles. Only the current article is held in memory.
+    :param pages: Iterable of page texts of one document
+    :return: Iterator of dicts with chapter (heading and title, None before the first chapter), article
+        (number, None for text outside of articles), heading (the heading line) and body
+    """
+    chapter, article, heading, lines = None, None, None, []
+    in_title = False
+
+    def section():
+        body = "\n".join(lines).strip()
+        return {"chapter": chapter, "article": article, "heading": heading, "body": body} if body else None
+
+    for page in pages:
+        for line in page.splitlines():
+            m = ARTICLE_HEADING.match(line)
+            if m:
+                done = section()
+                if done:
+                    yield done
+                article, heading, lines, in_title = m.group(1) or m.group(2), line.strip(" »“\""), [], False
+                continue
+            if CHAPTER_HEADING.match(line):
+                done = section()
+                if done:
+                    yield done
+                chapter, article, heading, lines, in_title = line.strip(" »“\""), None, None, [], True
+                continue
+            if in_title:
+                if not line.strip():
+                    continue
+                if len(chapter) + len(line) < CHAPTER_TITLE_MAX_LENGTH:
+                    chapter = f"{chapter} {line.strip()}"
+                    continue
+                in_title = False
+            lines.append(line)
+    done = section()
+    if done:
+        yield done
+
+
+def _split_body(body, max_length, overlap):
+    """
+    Parts of an oversized article of at most max_length characters, cut in front of numbered paragraphs.
+    Each part repeats up to `overlap` characters of trailing paragraphs of the previous one, paragraphs longer
+    than max_length are split like the fixed splitter.
+    """
+    from rag_demos.local_ingest import iter_chunks
+    paragraphs, current = [], []
+    for line in body.splitlines():
+        if PARAGRAPH_START.match(line) and current:
+            paragraphs.append("\n".join(current))
+            current = []
+        current.append(line)
+    paragraphs.append("\n".join(current))
+
+    part, size = [], 0
+    for paragraph in paragraphs:
+        if len(paragraph) > max_length:
+            if part:
+                yield "\n".join(part)
+                part, size = [], 0
+            yield from iter_chunks([paragraph], max_length, overlap)
+            continue
+        if part and size + len(paragraph) + 1 > max_length:
+            yield "\n".join(part)
+            carried, carried_size = [], 0
+            for previous in reversed(part):
+                if carried_size + len(previous) + 1 > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            # the carried overlap gives way to a paragraph that would not fit with it
+            while carried and carried_size + len(paragraph) + 1 > max_length:
+                carried_size -= len(carried.pop(0)) + 1
+            part, size = carried, carried_size
+        part.append(paragraph)
+        size += len(paragraph) + 1
+    if part:
+        yield "\n".join(part)
+
+
+def _header(section, max_length):
+    # chapter and article heading, at most half of a chunk: a long chapter title is cut, the heading is kept
+    heading = section["heading"] or ""
+    chapter = section["chapter"] or ""
+    limit = max_length // 2
+    if len(chapter) + len(heading) + 1 > limit:
+        chapter = chapter[:max(limit - len(heading) - 1, 0)].rstrip()
+    return "\n".join(h for h in (chapter, heading[:limit]) if h)
+
+
+def _iter_legal_parts(pages, max_length, overlap):
+    # (section, header, parts of its body), the header counts toward max_length
+    for section in iter_sections(pages):
+        header = _header(section, max_length)
+        budget = max_length - len(header) - 1 if header else max_length
+        if len(section["body"]) <= budget:
+            yield section, header, [section["body"]]
+        else:
+            yield section, header, list(_split_body(section["body"], budget, min(overlap, budget // 2 - 1)))
+
+
+def iter_legal_chunks(pages, max_length=ZI.CHUNK_MAX_LENGTH, overlap=ZI.CHUNK_OVERLAP):
+    """
+    Split a stream of page texts into one chunk per article, headed by its chapter and article heading.
+    Articles longer than max_length are split at paragraph boundaries and only these parts overlap.
+    Chunks are at most max_length characters, heading included; a chapter title longer than half of that is cut.
+    :param pages: Iterable of page texts of one document
+    :return: Iterator of dicts with chunk, chapter and article
+    """
+    for section, header, parts in _iter_legal_parts(pages, max_length, overlap):
+        for part in parts:
+            yield {"chunk": f"{header}\n{part}" if header else part, "chapter": section["chapter"],
+                   "article": section["article"]}
+
+
+def _overlap_chars(chunks):
+    # characters at the start of each chunk repeated from the end of the previous one
+    from rag_demos.context_packing import overlap_length
+    return sum(overlap_length(previous, chunk) for previous, chunk in zip(chunks, chunks[1:]))
+
+
+def _normalize_space(text):
+    return " ".join(text.split())
+
+
+def _sample_queries(sections, n_queries, seed, max_length):
+    """
+    Sentences of 60 to 300 characters drawn from the articles, with the normalized text of their article
+    """
+    import random
+    candidates = []
+    for section in sections:
+        body = _normalize_space(section["body"])
+        if section["article"] is None or len(body) > max_length:
+            continue
+        for sentence in re.split(r"(?<=[.;:])\s+", body):
+            if 60 <= len(sentence) <= 300:
+                candidates.append((sentence, body))
+    rng = random.Random(seed)
+    return rng.sample(candidates, min(n_queries, len(candidates)))
+
+
+def _retrieval_rates(chunks, queries, k, embedder):
+    """
+    Share of queries whose sentence (hit_rate), and whose whole article (article_complete_rate),
+    is contained in one of the top-k chunks
+    """
+    import numpy as np
+    texts = [_normalize_space(c) for c in chunks]
+    if embedder is None:
+        from rag_demos.bm25_index import BM25Index
+        bm25 = BM25Index.build(chunks)
+        rankings = [[i for _, i in bm25.search(q, k)] for q, _ in queries]
+    else:
+        vectors = np.asarray(embedder.embed(chunks))
+        query_vectors = np.asarray(embedder.embed([q for q, _ in queries]))
+        rankings = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :k].tolist()
+    hits = sum(any(q in texts[i] for i in ranking) for (q, _), ranking in zip(queries, rankings))
+    complete = sum(any(body in texts[i] for i in ranking) for (_, body), ranking in zip(queries, rankings))
+    return round(hits / max(len(queries), 1), 4), round(complete / max(len(queries), 1), 4)
+
+
+def compare_chunkers(data_dir=None, k=5, n_queries=300, seed=42, embedder=None, workers=None,
+                     max_length=ZI.CHUNK_MAX_LENGTH, overlap=ZI.CHUNK_OVERLAP):
+    """
+    Compare the fixed splitter with the legal chunker on the PDFs under data_dir: chunk count, embedded tokens,
+    characters repeated by overlaps and retrieval rates for sentences sampled from the articles
+    :param embedder: Retrieve with this embedder (e.g. AzureOpenAIEmbedder), BM25 when None
+    :return: dict with one report per chunker
+    """
+    from rag_demos.local_ingest import DATA_DIR, iter_pages, iter_chunks, list_pdfs
+    from rag_demos.rate_limiter import count_tokens
+    documents = [list(pages) for _, pages in iter_pages(list_pdfs(data_dir or DATA_DIR), workers=workers)]
+    sections = [s for pages in documents for s in iter_sections(pages)]
+    queries = _sample_queries(sections, n_queries, seed, max_length)
+    text_chars = sum(len(page) for pages in documents for page in pages)
+    report = {"queries": len(queries), "k": k, "retriever": "bm25" if embedder is None else "vector"}
+    for name in ("fixed", "legal"):
+        chunks, overlap_chars = [], 0
+        for pages in documents:
+            if name == "fixed":
+                parts = list(iter_chunks(pages, max_length, overlap))
+                chunks += parts
+                overlap_chars += _overlap_chars(parts)
+            else:
+                # only the parts of a split article overlap, the repeated headers are not counted
+                for _, header, parts in _iter_legal_parts(pages, max_length, overlap):
+                    chunks += [f"{header}\n{part}" if header else part for part in parts]
+                    overlap_chars += _overlap_chars(parts)
+        hit_rate, complete_rate = _retrieval_rates(chunks, queries, k, embedder)
+        report[name] = {
+            "chunks": len(chunks),
+            "embedded_tokens": sum(count_tokens(c) for c in chunks),
+            "embedded_chars": sum(len(c) for c in chunks),
+            "source_chars": text_chars,
+            "overlap_chars": overlap_chars,
+            "hit_rate": hit_rate,
+            "article_complete_rate": complete_rate,
+        }
+        log.info(f"{name}: {report[name]}")
+    return report
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare the fixed and the structure-aware chunker on data/")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--vector", action="store_true", help="retrieve with the Azure OpenAI embedder instead of BM25")
+    args = parser.parse_args()
+    embedder = None
+    if args.vector:
+        from rag_demos.embedders import AzureOpenAIEmbedder
+        embedder = AzureOpenAIEmbedder()
+    print(json.dumps(compare_chunkers(k=args.k, n_queries=args.queries, embedder=embedder), indent=2))
@@ -0,0 +1,267 @@
+import os
+import base64
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.zakon_index as ZI
+import rag_demos.bulk_upload as BU
+
+log = U.get_logger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+PAGES_PER_TASK = 8
+
+_readers = {}
+
+
+def _extract_pages(path, start, stop):
+    """
+    Extract the text of pages [start, stop) of a PDF. Runs in a worker process, which keeps the reader of the last file open.
+    """
+    from pypdf import PdfReader
+    reader = _readers.get(path)
+    if reader is None:
+        _readers.clear()
+        reader = _readers[path] = PdfReader(path)
+    return path, [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _page_count(path):
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+def _page_tasks(paths, pages_per_task):
+    for path in paths:
+        n = _page_count(path)
+        for start in range(0, n, pages_per_task):
+            yield str(path), start, min(start + pages_per_task, n)
+
+
+def _bounded_map(pool, fn, tasks, window):
+    """
+    Ordered pool.map that never has more than `window` tasks submitted, so a slow consumer applies back-pressure.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_pages(paths, workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Stream (path, page texts) of the PDFs, extracting pages in a process pool.
+    :param paths: PDF files, in the order they should be streamed
+    :param workers: Number of worker processes, defaults to the number of CPUs
+    """
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = _bounded_map(pool, _extract_pages, _page_tasks(paths, pages_per_task), window=2 * workers)
+        for path, group in itertools.groupby(results, key=lambda res: res[0]):
+            yield path, (page for _, pages in group for page in pages)
+
+
+def _split_point(text, max_length):
+    # prefer paragraph, then sentence, then word boundaries, in the second half of the window
+    window = text[:max_length]
+    for sep in ("\n\n", ". ", "? ", "! ", "\n", " "):
+        i = window.rfind(sep, max_length // 2)
+        if i != -1:
+            return i + len(sep)
+    return max_length
+
+
+def iter_chunks(pages, max_length=ZI.CHUNK_MAX_LENGTH, overlap=ZI.CHUNK_OVERLAP):
+    """
+    Split a stream of page texts into chunks of at most max_length characters overlapping by about `overlap`
+    characters, like the SplitSkill in "pages" mode. Only a window of roughly one chunk is held in memory.
+    :param pages: Iterable of page texts of one document
+    """
+    assert overlap < max_length // 2
+    buf = ""
+    for page in pages:
+        buf = buf + page + "\n" if buf else page + "\n"
+        while len(buf) > max_length:
+            end = _split_point(buf, max_length)
+            chunk = buf[:end].strip()
+            if chunk:
+                yield chunk
+            start = end - overlap
+            ws = buf.find(" ", start, end)
+            buf = buf[ws + 1 if ws != -1 else start:]
+    if buf.strip():
+        yield buf.strip()
+
+
+def parent_key(path):
+    """
+    Index-safe key of a source file, used as ParentKey and as the prefix of its chunk ids
+    """
+    return base64.urlsafe_b64encode(Path(path).name.encode('utf-8')).decode('ascii').rstrip("=")
+
+
+def _chunk_stream(pages, chunker, max_length, overlap):
+    if chunker == "fixed":
+        return ({"chunk": chunk} for chunk in iter_chunks(pages, max_length, overlap))
+    if chunker == "legal":
+        from rag_demos.legal_chunker import iter_legal_chunks
+        return iter_legal_chunks(pages, max_length, overlap)
+    raise Exception(f"Unknown chunker {chunker}, use fixed or legal")
+
+
+def iter_chunk_documents(paths, workers=None, max_length=ZI.CHUNK_MAX_LENGTH, overlap=ZI.CHUNK_OVERLAP,
+                         chunker=None):
+    """
+    Stream index documents (without vectors) for the chunks of the PDFs, using the zakon-index field names.
+    :param chunker: "fixed" or "legal", CHUNKER by default; legal also sets the chapter and article fields
+    """
+    chunker = chunker or S.get_settings().chunker
+    for path, pages in iter_pages(paths, workers=workers):
+        key = parent_key(path)
+        name = Path(path).name
+        n = 0
+        for n, chunk in enumerate(_chunk_stream(pages, chunker, max_length, overlap), 1):
+            yield {
+                "id": f"{key}_chunks_{n - 1}",
+                "ParentKey": key,
+                "title": Path(path).stem,
+                "name": name,
+                "location": f"data/{name}",
+                **chunk,
+            }
+        log.info(f"{name}: {n} chunks")
+
+
+def embed_documents(documents, embedder, batch_size=512):
+    """
+    Attach chunkVector to a stream of documents, embedding `batch_size` chunks per call
+    """
+    it = iter(documents)
+    while True:
+        batch = list(itertools.islice(it, batch_size))
+        if not batch:
+            return
+        vectors = embedder.embed([doc["chunk"] for doc in batch])
+        for doc, vector in zip(batch, vectors):
+            doc["chunkVector"] = vector.tolist()
+            yield doc
+
+
+def list_pdfs(data_dir=DATA_DIR):
+    return sorted(p for p in Path(data_dir).iterdir() if p.suffix.lower() == ".pdf")
+
+
+def run(data_dir=DATA_DIR, index_name=None, embedder=None, workers=None, embed_batch_size=512,
+        upload=True, cache=True, vector_store_path=None, paths=None, on_documents=None, chunker=None,
+        **upload_kwargs):
+    """
+    Local alternative to the skillset: extract, chunk and embed the PDFs under data_dir and push them to the index.
+    Every stage pulls from the previous one, so memory stays flat regardless of corpus size.
+    :param embedder: Object with an embed(texts) method, defaults to AzureOpenAIEmbedder
+    :param upload: If False, run everything but the upload and only count documents
+    :param cache: True for the default embedding cache, an EmbeddingCache instance, or False to disable caching
+    :param vector_store_path: Also write the documents to a local vector store in this directory
+    :param paths: Ingest these PDFs instead of all PDFs under data_dir
+    :param on_documents: Function wrapping the stream of embedded documents, e.g. to record their ids
+    :param chunker: "fixed" or "legal", CHUNKER by default
+    :return: The bulk upload report, with the embedding cache statistics of this run
+    """
+    index_name = index_name or ZI.current_index_name()
+    if embedder is None:
+        from rag_demos.embedders import AzureOpenAIEmbedder
+        embedder = AzureOpenAIEmbedder()
+    if cache is not False:
+        from rag_demos.embedding_cache import CachedEmbedder, EmbeddingCache
+        embedder = CachedEmbedder(embedder, EmbeddingCache() if cache is True else cache)
+        embedder.cache.reset_stats()
+    paths = list_pdfs(data_dir) if paths is None else paths
+    docs = embed_documents(iter_chunk_documents(paths, workers=workers, chunker=chunker), embedder, embed_batch_size)
+    if on_documents:
+        docs = on_documents(docs)
+    if vector_store_path:
+        from rag_demos.vector_store import tee_to_store
+        docs = tee_to_store(docs, vector_store_path)
+    if upload:
+        report = BU.upload_documents(index_name, docs, **upload_kwargs)
+    else:
+        report = {"docs": sum(1 for _ in docs)}
+        log.info(f"Produced {report['docs']} documents")
+    U.bump_index_generation()
+    if cache is not False:
+        report["embedding_cache"] = embedder.cache.stats()
+        log.info(f"Embedding cache: {report['embedding_cache']}")
+    return report
+
+
+def _record_chunk_ids(documents, chunk_ids):
+    for doc in documents:
+        chunk_ids.setdefault(doc["name"], []).append(doc["id"])
+        yield doc
+
+
+def run_incremental(data_dir=DATA_DIR, index_name=None, embedder=None, workers=None,
+                    embed_batch_size=512, cache=True, manifest_path=None, **upload_kwargs):
+    """
+    Ingest only the PDFs that changed since the last run, as recorded in the ingestion manifest of the index.
+    New and modified files are extracted, chunked, embedded and uploaded, chunks they no longer produce and the
+    chunks of removed files are deleted from the index. The manifest is only written after the index was updated,
+    so an interrupted run is repeated next time.
+    :param manifest_path: Manifest file, defaults to one per index in the cache directory
+    :return: dict with the changed, unchanged and removed file names, the deleted chunk count and the upload report
+    """
+    from rag_demos.ingest_manifest import IngestManifest, default_path
+    index_name = index_name or ZI.current_index_name()
+    manifest = IngestManifest.load(manifest_path or default_path(index_name))
+    chunking = {"max_length": ZI.CHUNK_MAX_LENGTH, "overlap": ZI.CHUNK_OVERLAP}
+    chunker = S.get_settings().chunker
+    if chunker != "fixed":
+        # only recorded when set, so manifests written before the legal chunker still match
+        chunking["chunker"] = chunker
+    paths = list_pdfs(data_dir)
+    if manifest.chunking and manifest.chunking != chunking:
+        log.info(f"Chunking changed from {manifest.chunking} to {chunking}, re-ingesting all files")
+        plan = {"changed": paths, "unchanged": [],
+                "removed": [name for name in manifest.files if name not in {p.name for p in paths}]}
+    else:
+        plan = manifest.plan(paths)
+    result = {"changed": [p.name for p in plan["changed"]], "unchanged": [p.name for p in plan["unchanged"]],
+              "removed": plan["removed"], "deleted_chunks": 0, "upload": None}
+    log.info(f"Incremental ingestion: {len(plan['changed'])} changed, {len(plan['unchanged'])} unchanged, "
+             f"{len(plan['removed'])} removed")
+    if not plan["changed"] and not plan["removed"]:
+        manifest.chunking = chunking
+        manifest.save()
+        return result
+
+    chunk_ids = {}
+    if plan["changed"]:
+        result["upload"] = run(data_dir, index_name, embedder, workers, embed_batch_size, cache=cache,
+                               paths=plan["changed"], on_documents=lambda docs: _record_chunk_ids(docs, chunk_ids),
+                               **upload_kwargs)
+    stale = [doc_id for name in result["removed"] for doc_id in manifest.chunk_ids(name)]
+    for path in plan["changed"]:
+        current = set(chunk_ids.get(path.name, []))
+        stale += [doc_id for doc_id in manifest.chunk_ids(path.name) if doc_id not in current]
+    if stale:
+        BU.upload_documents(index_name, ({"id": doc_id} for doc_id in stale), action="delete")
+        result["deleted_chunks"] = len(stale)
+        if not plan["changed"]:
+            U.bump_index_generation()
+
+    for path in plan["changed"]:
+        manifest.record(path, parent_key(path), chunk_ids.get(path.name, []))
+    for name in result["removed"]:
+        manifest.forget(name)
+    manifest.chunking = chunking
+    manifest.save()
+    return result
+
+
+if __name__ == "__main__":
+    run()
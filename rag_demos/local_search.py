@@ -0,0 +1,73 @@
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.rate_limiter as RL
+import rag_demos.vector_store as VS
+from rag_demos.bm25_index import BM25Index, TOKENIZER_VERSION, rrf_fuse
+
+log = U.get_logger(__name__)
+
+# query types of the data source that can be answered without the service; semantic ranking cannot
+LOCAL_QUERY_TYPES = ("simple", "vector", "vector_simple_hybrid")
+HYBRID_CANDIDATES = 50
+
+
+class LocalSearch:
+    """
+    In-process retrieval over a local vector store: BM25 for `simple`, cosine for `vector`
+    and reciprocal rank fusion of both for `vector_simple_hybrid`.
+    The vectors are compressed like the index (VECTOR_COMPRESSION, VECTOR_TRUNCATE_DIMENSIONS) unless a
+    vector_mode is given.
+    """
+
+    def __init__(self, path=None, embedder=None, vector_mode=None, truncate=None, oversampling=None):
+        settings = S.get_settings()
+        self.store = VS.VectorStore(path)
+        try:
+            self.bm25 = BM25Index.load(self.store.path)
+        except FileNotFoundError:
+            self.bm25 = None
+        if (self.bm25 is None or len(self.bm25.doc_lengths) != len(self.store)
+                or self.bm25.tokenizer_version != TOKENIZER_VERSION):
+            # missing, left over from a store written before stale indexes were deleted, or tokenized differently
+            self.bm25 = BM25Index.build(doc["chunk"] or "" for doc in self.store.docs)
+            self.bm25.save(self.store.path)
+        self.embedder = embedder
+        self.vector_mode = vector_mode or settings.vector_compression or "exact"
+        self.truncate = truncate or (settings.vector_truncate_dimensions
+                                     if self.vector_mode in VS.COMPRESSED_MODES else None)
+        self.oversampling = settings.vector_oversampling if oversampling is None else oversampling
+
+    def _vector_search(self, query_vector, k, filter):
+        return self.store.search(query_vector, k, filter=filter, mode=self.vector_mode, truncate=self.truncate,
+                                 oversampling=self.oversampling)
+
+    def _embed(self, query):
+        if self.embedder is None:
+            from rag_demos.embedders import AzureOpenAIEmbedder
+            # query embeddings are on the path of a chat request
+            self.embedder = AzureOpenAIEmbedder(priority=RL.INTERACTIVE)
+        return self.embedder.embed([query])[0]
+
+    def _lexical(self, query, k, mask):
+        return [{**self.store.docs[i], "@search.score": s} for s, i in self.bm25.search(query, k, mask)]
+
+    def search(self, query, query_type="vector_simple_hybrid", top_k=5, filter=None, query_vector=None):
+        """
+        Retrieve the top_k chunks for a question
+        :param query: The question text
+        :param query_type: One of LOCAL_QUERY_TYPES
+        :param filter: OData filter on ParentKey, title, chapter or article
+        :param query_vector: Embedding of the query, computed with the embedder when not given
+        :return: List of documents with @search.score, best first
+        """
+        if query_type not in LOCAL_QUERY_TYPES:
+            raise Exception(f"Query type {query_type} cannot be served locally, use one of {LOCAL_QUERY_TYPES}")
+        if query_type == "simple":
+            return self._lexical(query, top_k, self.store.filter_mask(filter))
+        if query_vector is None:
+            query_vector = self._embed(query)
+        if query_type == "vector":
+            return self._vector_search(query_vector, top_k, filter)
+        k = max(HYBRID_CANDIDATES, top_k)
+        return rrf_fuse([self._lexical(query, k, self.store.filter_mask(filter)),
+                         self._vector_search(query_vector, k, filter)], top=top_k)
@@ -0,0 +1,142 @@
+import time
+import asyncio
+import threading
+import rag_demos.utils as U
+import rag_demos.settings as S
+import rag_demos.index_helpers as IH
+import rag_demos.telemetry as TM
+
+log = U.get_logger(__name__)
+
+# SEARCH_INDEXES: comma separated indexes searched together, e.g. one per law family; the active zakon-index when unset
+# SEARCH_INDEX_TIMEOUT: seconds an index has to answer before the query goes on without it
+__getattr__ = S.lazy_constants(__name__, {"SEARCH_INDEXES": "search_indexes",
+                                          "SEARCH_INDEX_TIMEOUT": "search_index_timeout"})
+SEMANTIC_CONFIGURATION = "my-semantic-config"
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def search_indexes():
+    indexes = S.get_settings().search_indexes
+    if indexes:
+        return indexes
+    import rag_demos.zakon_index as ZI
+    return [ZI.current_index_name()]
+
+
+def search_payload(query, query_type="vector_simple_hybrid", top_k=5, filter=None):
+    """
+    Search request body for a question, with the query types of the "On Your Data" data source.
+    Vector queries are sent as text and embedded by the index vectorizer.
+    """
+    payload = {"top": top_k}
+    if query_type in ("simple", "vector_simple_hybrid", "vector_semantic_hybrid"):
+        payload["search"] = query
+    if query_type in ("vector", "vector_simple_hybrid", "vector_semantic_hybrid"):
+        payload["vectorQueries"] = [{"kind": "text", "text": query, "fields": "chunkVector", "k": top_k}]
+    if query_type == "vector_semantic_hybrid":
+        payload["queryType"] = "semantic"
+        payload["semanticConfiguration"] = SEMANTIC_CONFIGURATION
+    elif query_type not in ("simple", "vector", "vector_simple_hybrid"):
+        raise Exception(f"Unknown query type {query_type}")
+    if filter:
+        payload["filter"] = filter
+    return payload
+
+
+def _score(doc):
+    # the semantic ranker's score is comparable across queries, prefer it when present
+    score = doc.get("@search.rerankerScore")
+    return score if score is not None else doc.get("@search.score") or 0.0
+
+
+def normalize_scores(docs):
+    """
+    Scale scores to [0, 1] by dividing by the best one. The raw score is kept as @search.originalScore.
+    """
+    best = max((_score(d) for d in docs), default=0.0)
+    return [{**d, "@search.originalScore": _score(d), "@search.score": _score(d) / best if best > 0 else 0.0}
+            for d in docs]
+
+
+def merge_results(results, top=None, method="normalized"):
+    """
+    Merge the ranked results of several indexes into one list
+    :param results: dict index name -> list of documents, best first
+    :param method: normalized for the scores of all indexes scaled by the best of them, rrf for reciprocal rank
+        fusion of the rankings
+    :return: Documents ordered by merged score, each with its @search.index
+    """
+    results = {name: [{**d, "@search.index": name} for d in docs] for name, docs in results.items()}
+    if method == "rrf":
+        from rag_demos.bm25_index import rrf_fuse
+        # ids are only unique within an index
+        ranked = [[{**d, "id": f"{d['@search.index']}/{d['id']}", "_id": d["id"]} for d in docs]
+                  for docs in results.values()]
+        return [{**{k: v for k, v in d.items() if k != "_id"}, "id": d["_id"]} for d in rrf_fuse(ranked, top=top)]
+    if method != "normalized":
+        raise Exception(f"Unknown merge method {method}")
+    # one scale for all indexes: every index asked the same query the same way, so their scores compare, while scaling
+    # each index by its own best would put the top hit of every index at 1.0 however weak it is
+    merged = normalize_scores([d for docs in results.values() for d in docs])
+    merged.sort(key=lambda d: d["@search.score"], reverse=True)
+    return merged[:top] if top else merged
+
+
+async def _search_one(index_name, payload, timeout):
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(IH.asearch(index_name, payload), timeout)
+    except asyncio.TimeoutError:
+        log.warning(f"Search of {index_name} timed out after {timeout}s, answering without it")
+        TM.registry.inc("search_timeouts", index=index_name)
+        return None
+    except Exception as e:
+        log.error(f"Search of {index_name} failed: {e}")
+        TM.record_error("search", index=index_name)
+        return None
+    TM.registry.observe("index_search_seconds", time.perf_counter() - started, index=index_name)
+    return response["value"]
+
+
+async def amulti_search(payload, indexes=None, timeout=None, top=None, method="normalized"):
+    """
+    Send the same search to several indexes concurrently and merge their results.
+    An index that fails or does not answer within `timeout` seconds is left out instead of delaying the answer.
+    :param payload: Search request body, see search_payload
+    :param indexes: Index names, search_indexes() by default
+    :param timeout: SEARCH_INDEX_TIMEOUT by default
+    :param top: Number of merged results, the payload's top by default
+    :return: (merged documents, dict index name -> number of results or None if it failed or timed out)
+    """
+    indexes = indexes or search_indexes()
+    timeout = S.get_settings().search_index_timeout if timeout is None else timeout
+    responses = await asyncio.gather(*(_search_one(name, payload, timeout) for name in indexes))
+    answered = {name: docs for name, docs in zip(indexes, responses) if docs is not None}
+    merged = merge_results(answered, top=top or payload.get("top"), method=method)
+    return merged, {name: None if docs is None else len(docs) for name, docs in zip(indexes, responses)}
+
+
+def _get_loop():
+    # one event loop in a background thread serves the synchronous callers, so its connection pools are reused
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="multi-search", daemon=True).start()
+    return _loop
+
+
+def multi_search(query, query_type="vector_simple_hybrid", top_k=5, filter=None, indexes=None,
+                 timeout=None, method="normalized"):
+    """
+    Synchronous fan-out search of a question over the law indexes, for the chat app
+    :return: Merged documents, best first, with @search.score normalized and @search.index set
+    """
+    payload = search_payload(query, query_type, top_k, filter)
+    future = asyncio.run_coroutine_threadsafe(amulti_search(payload, indexes, timeout, top_k, method), _get_loop())
+    docs, answered = future.result()
+    log.debug(f"Multi-index search answered by {answered}")
+    return docs
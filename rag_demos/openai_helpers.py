@@ -1,36 +1,84 @@
 import logging
 import os
+import asyncio
 import json
-import requests
-from dotenv import load_dotenv
 import rag_demos.utils as U
-import requests
+import rag_demos.settings as S
+import rag_demos.http_transport as HT
+import rag_demos.rate_limiter as RL
+import rag_demos.telemetry as TM
 import time
 import re
-load_dotenv()
 log = U.get_logger(__name__)
 
-from openai import AzureOpenAI
 #import spl_space.indexes.satellite_index as IDX
-import rag_demos.index_helpers as index_helpers
 
-#
-# client = AzureOpenAI(
-#     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-#     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-#     api_version=os.getenv("AZURE_OPENAI_API_VERSION")
-# )
 
+def aoai_endpoint():
+    return S.get_settings().openai_endpoint
 
-aoai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-headers = {
-    'Content-Type': 'application/json',
-    'api-key': os.environ['AZURE_OPENAI_API_KEY']
-  }
 
-params = {'api-version': os.environ['AZURE_OPENAI_API_VERSION']}
+def aoai_headers():
+    return {'Content-Type': 'application/json', 'api-key': S.get_settings().openai_key}
 
-deployment_name  = os.environ['GPT4_DEPLOYMENT_NAME']
+
+def aoai_params():
+    return {'api-version': S.get_settings().openai_api_version}
+
+
+def __getattr__(name):
+    # these used to be read from the environment at import time
+    if name == 'headers':
+        return aoai_headers()
+    if name == 'params':
+        return aoai_params()
+    if name == 'deployment_name':
+        return S.get_settings().chat_deployment
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _text_retry_after(r):
+    # some throttling errors only state the delay in the message
+    for pattern in (r'retry after (\d+) seconds', r'Try again in (\d+) seconds'):
+        match = re.search(pattern, r.text)
+        if match:
+            return int(match.group(1))
+    return 0
+
+
+def post_with_retries(url, body, deployment, tokens, priority=RL.INTERACTIVE, max_retries=20, stream=False):
+    """
+    POST a request to Azure OpenAI through the shared scheduler.
+    Throttling (429), server errors (5xx), timeouts and connection errors are retried with the delay requested
+    by the service or jittered exponential backoff; other errors raise requests.HTTPError as before.
+    """
+    import requests
+    scheduler = RL.get_scheduler()
+    headers, params = aoai_headers(), aoai_params()
+    for attempt in range(max_retries + 1):
+        error, r = None, None
+        with scheduler.slot(deployment, tokens, priority):
+            try:
+                r = HT.post(url, headers=headers, params=params, json=body, stream=stream)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                error = e
+            else:
+                retry_after = scheduler.update_from_headers(deployment, r.headers)
+        if r is not None and r.ok:
+            return r
+        if r is not None and r.status_code not in RL.RETRYABLE_STATUS:
+            log.error(f"Error: {r.status_code}, response: {r.text}")
+            r.raise_for_status()
+        if attempt == max_retries:
+            log.error(f"Error: {error or r.status_code}, response: {r.text if r is not None else ''}")
+            raise Exception(f"Retry count exceeded {max_retries}")
+        wait_seconds = RL.backoff(attempt)
+        if r is not None:
+            wait_seconds = max(wait_seconds, retry_after or _text_retry_after(r))
+            r.close()
+        TM.registry.inc("retries", deployment=deployment, status=r.status_code if r is not None else "error")
+        log.warning(f"Request failed ({error or r.status_code}), retry {attempt + 1} after {wait_seconds:.1f} seconds")
+        time.sleep(wait_seconds)
 
 
 def get_openai_response(messages, body,
@@ -38,57 +86,187 @@ def get_openai_response(messages, body,
                              temperature=0.5,
                              top_p = 0.2,
                              max_tokens=4096,
-                             max_retries = 20):
-    retry = 0
-    while 1 == 1:
+                             max_retries = 20,
+                             priority=RL.INTERACTIVE):
+    url = f"{aoai_endpoint()}/openai/deployments/{model}/chat/completions"
+    with TM.span("build", model=model):
+        body = {**body, "messages": messages, "temperature": temperature, "top_p": top_p, "max_tokens": max_tokens,
+                "response_format": {"type": "json_object"}}
+        tokens = RL.estimate_chat_tokens(messages, max_tokens)
+    with TM.span("network", model=model):
+        r = post_with_retries(url, body, model, tokens, priority, max_retries)
+    with TM.span("decode", model=model):
+        r_json = r.json()
+    log.debug("Response: %s", r_json)
+    full_js = r_json["choices"][0]
+    if r_json.get("usage"):
+        full_js["usage"] = r_json["usage"]
+        TM.record_usage(r_json["usage"], model=model)
+    res = full_js["message"]["content"]
+    log.debug("Response: %s", res)
+    return res, full_js
+
+
+async def apost_with_retries(url, body, deployment, tokens, priority=RL.INTERACTIVE, max_retries=20):
+    """
+    asyncio counterpart of post_with_retries: waits for the scheduler without blocking the event loop
+    and raises the same exceptions.
+    """
+    import httpx
+    import requests
+    import rag_demos.async_transport as AT
+    scheduler = RL.get_scheduler()
+    headers, params = aoai_headers(), aoai_params()
+    for attempt in range(max_retries + 1):
+        await scheduler.aacquire(deployment, tokens, priority)
+        error, r = None, None
         try:
-            url = f"{aoai_endpoint}/openai/deployments/{model}/chat/completions"
-
-            body["messages"] = messages
-            body["temperature"] = temperature
-            body["top_p"] = top_p
-            body["max_tokens"] = max_tokens
-            body["response_format"] = {"type": "json_object"}
-            r = requests.post(url, headers=headers, params=params, json=body)
-            r.raise_for_status()
-            r_json = r.json()
-            log.debug("Response: " + str(r_json))
-            full_js = r_json["choices"][0]
-            res = r_json["choices"][0]["message"]["content"]
-            log.debug("Response: " + str(res))
-            #dirty hack until I figure what is wrong with OpenAI and why it returns markdown
-            #TODO: remove this hack
-
-            log.info("Response: " + str(res))
-            return res, full_js
-        except Exception as e:
-            wait_seconds = 0
-            if r is dict and r.headers is not None:
-                for k, v in r.headers.items():
-                    if k.lower() == 'retry-after':
-                        log.warning(f'Too many requests, retry after {v} seconds')
-                        wait_seconds = int(v)
-
-            match = re.search(r'retry after (\d+) seconds', r.text)
-            if match:
-                wait_seconds = int(match.group(1))
-                log.warning(f'Too many requests, retry after {wait_seconds} seconds')
-
-            match = re.search(r'Try again in (\d+) seconds', r.text)
-            if match:
-                wait_seconds = int(match.group(1))
-                log.warning(f'Too many requests, retry after {wait_seconds} seconds')
-
-            if wait_seconds > 0:
-                time.sleep(wait_seconds + 1)
-                retry += 1
-                if retry > max_retries:
-                    log.error(f"Error: {str(e)}, response: {r.text}")
-                    raise Exception(f"Retry count exceeded {max_retries}")
+            r = await AT.post(url, headers=headers, params=params, json=body)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            error = e
+        else:
+            retry_after = scheduler.update_from_headers(deployment, r.headers)
+        finally:
+            scheduler.release()
+        if r is not None and r.is_success:
+            return r
+        if r is not None and r.status_code not in RL.RETRYABLE_STATUS:
+            log.error(f"Error: {r.status_code}, response: {r.text}")
+            raise requests.HTTPError(f"{r.status_code} Error: {r.reason_phrase} for url: {r.url}")
+        if attempt == max_retries:
+            log.error(f"Error: {error or r.status_code}, response: {r.text if r is not None else ''}")
+            raise Exception(f"Retry count exceeded {max_retries}")
+        wait_seconds = RL.backoff(attempt)
+        if r is not None:
+            wait_seconds = max(wait_seconds, retry_after or _text_retry_after(r))
+        TM.registry.inc("retries", deployment=deployment, status=r.status_code if r is not None else "error")
+        log.warning(f"Request failed ({error or r.status_code}), retry {attempt + 1} after {wait_seconds:.1f} seconds")
+        await asyncio.sleep(wait_seconds)
 
-            else:
-                log.error(f"Error: {str(e)}, response: {r.text}")
-                raise
+
+async def aget_openai_response(messages, body,
+                               model="gpt-4o",
+                               temperature=0.5,
+                               top_p=0.2,
+                               max_tokens=4096,
+                               max_retries=20,
+                               priority=RL.INTERACTIVE):
+    """
+    asyncio counterpart of get_openai_response
+    """
+    url = f"{aoai_endpoint()}/openai/deployments/{model}/chat/completions"
+    body = {**body, "messages": messages, "temperature": temperature, "top_p": top_p, "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}}
+    with TM.span("network", model=model):
+        r = await apost_with_retries(url, body, model, RL.estimate_chat_tokens(messages, max_tokens), priority,
+                                     max_retries)
+    with TM.span("decode", model=model):
+        r_json = r.json()
+    log.debug("Response: %s", r_json)
+    full_js = r_json["choices"][0]
+    if r_json.get("usage"):
+        full_js["usage"] = r_json["usage"]
+        TM.record_usage(r_json["usage"], model=model)
+    res = full_js["message"]["content"]
+    log.debug("Response: %s", res)
+    return res, full_js
+
+
+def iter_sse_data(r):
+    """
+    Yield the decoded JSON payloads of a server-sent events response until [DONE]
+    """
+    for line in r.iter_lines():
+        if not line or not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return
+        yield json.loads(data)
+
+
+def get_openai_response_stream(messages, body,
+                               model="gpt-4o",
+                               temperature=0.5,
+                               top_p=0.2,
+                               max_tokens=4096,
+                               max_retries=20,
+                               priority=RL.INTERACTIVE):
+    """
+    Streaming variant of get_openai_response.
+    Yields {"type": "citations", "citations": [...]} when the data source context arrives,
+    {"type": "token", "content": "..."} for every content delta and finally
+    {"type": "done", "content": full answer, "full_js": choice like get_openai_response returns}.
+    full_js["timings"] holds time to first token, total time and tokens per second of the call.
+    """
+    url = f"{aoai_endpoint()}/openai/deployments/{model}/chat/completions"
+    body = {**body, "messages": messages, "temperature": temperature, "top_p": top_p, "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}, "stream": True}
+    started = time.perf_counter()
+    r = post_with_retries(url, body, model, RL.estimate_chat_tokens(messages, max_tokens), priority, max_retries,
+                          stream=True)
+
+    parts, context, finish_reason, usage = [], None, None, None
+    first_token = context_time = None
+    with r:
+        for chunk in iter_sse_data(r):
+            usage = chunk.get("usage") or usage
+            if not chunk.get("choices"):
+                continue
+            choice = chunk["choices"][0]
+            delta = choice.get("delta") or {}
+            if delta.get("context") and context is None:
+                context = delta["context"]
+                context_time = time.perf_counter()
+                yield {"type": "citations", "citations": context.get("citations", [])}
+            if delta.get("content"):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                parts.append(delta["content"])
+                yield {"type": "token", "content": delta["content"]}
+            finish_reason = choice.get("finish_reason") or finish_reason
+    ended = time.perf_counter()
+    res = "".join(parts)
+    generation = ended - first_token if first_token else 0.0
+    # a stream delta can hold several tokens, the service's count is used when it sends a usage block
+    tokens = (usage or {}).get("completion_tokens")
+    if tokens is None:
+        tokens = RL.count_tokens(res)
+    timings = {
+        # the data source context arrives once retrieval is done, before generation starts
+        "retrieval": round(context_time - started, 4) if context_time else None,
+        "time_to_first_token": round(first_token - started, 4) if first_token else None,
+        "generation": round(generation, 4),
+        "total": round(ended - started, 4),
+        "tokens": tokens,
+        "tokens_per_sec": round(tokens / generation, 1) if generation > 0 else None,
+    }
+    log.debug(f"Streamed response: {timings}")
+    message = {"role": "assistant", "content": res}
+    if context is not None:
+        message["context"] = context
+    full_js = {"index": 0, "finish_reason": finish_reason, "message": message, "timings": timings}
+    if usage:
+        full_js["usage"] = usage
+    yield {"type": "done", "content": res, "full_js": full_js}
+
+
+def get_embeddings(texts, model=None, dimensions=None):
+    """
+    Embed a list of texts with one call to the Azure OpenAI embeddings endpoint
+    :param texts: List of strings
+    :param model: Embedding deployment name, defaults to EMBEDDING_DEPLOYMENT_NAME
+    :param dimensions: Output dimensions, only supported by text-embedding-3 models
+    :return: List of embeddings in input order
+    """
+    model = model or S.get_settings().embedding_deployment
+    url = f"{aoai_endpoint()}/openai/deployments/{model}/embeddings"
+    body = {"input": list(texts)}
+    if dimensions:
+        body["dimensions"] = dimensions
+    r = post_with_retries(url, body, model, sum(RL.count_tokens(t) for t in body["input"]), RL.BATCH)
+    data = sorted(r.json()["data"], key=lambda d: d["index"])
+    return [d["embedding"] for d in data]
 
 
 
@@ -1,49 +1,270 @@
-import os
+import functools
+from pathlib import Path
 
-# load dotenv
-from dotenv import load_dotenv
-from openai import AzureOpenAI
 from rag_demos import zakon_index as ZI
-from rag_demos.openai_helpers import get_openai_response
+import rag_demos.utils as U
+from rag_demos.openai_helpers import get_openai_response, get_openai_response_stream
+import rag_demos.settings as S
+import rag_demos.telemetry as TM
+import rag_demos.rate_limiter as RL
 import json
+import time
 
-load_dotenv()
-
-client = AzureOpenAI(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-15-preview"
-)
+log = U.get_logger(__name__)
 
 DEPLOYMENT_LIST = ["gpt-4o", "gpt4-turbo", "gpt-4v"]
-# read prompt from prompt.txt
-with open("chat_system_prompt.txt") as f:
-    prompt = f.read()
-# with open("advanced_prompt.txt") as f:
-#     prompt = f.read()
+# RETRIEVAL_MODE remote: retrieval by the "On Your Data" data source, local: retrieval in-process where the query
+# type allows it, search: retrieval by the app across the SEARCH_INDEXES (see multi_search)
+_settings_constants = S.lazy_constants(__name__, {"RETRIEVAL_MODE": "retrieval_mode",
+                                                   "SERVE_CONCURRENCY": "serve_concurrency",
+                                                   "SERVE_QUEUE_SIZE": "serve_queue_size"})
+PROMPT_PATH = Path(__file__).resolve().parent / "chat_system_prompt.txt"
+# PROMPT_PATH = Path(__file__).resolve().parent / "advanced_prompt.txt"
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """
+    The openai SDK client, the SDK is only imported when the client is first needed
+    """
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        azure_endpoint=S.get_settings().openai_endpoint,
+        api_key=S.get_settings().openai_key,
+        api_version="2024-02-15-preview"
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_prompt():
+    # read prompt from prompt.txt
+    with open(PROMPT_PATH) as f:
+        return f.read()
+
+
+def __getattr__(name):
+    # client and prompt used to be created at import time
+    if name == 'client':
+        return get_client()
+    if name == 'prompt':
+        return get_prompt()
+    return _settings_constants(name)
+
 
 def user(user_message, history: list):
     return "", history + [{"role": "user", "content": user_message}]
 
 
-def respond(msg, chat_history, model, temperature, top_p, top_k, query_type):
-    body = ZI.extra_body.copy()
-    body["data_sources"][0]["parameters"]["query_type"] = query_type
-    body["data_sources"][0]["parameters"]["top_n_documents"] = top_k
-    if query_type == "vector_semantic_hybrid":
-        body["data_sources"][0]["parameters"]["semantic_configuration"] = "my-semantic-config"
-    bot_response, full_js = get_openai_response(messages=[
-        {"role": "system", "content": prompt},
+_local_search = None
+
+
+def get_local_search():
+    global _local_search
+    if _local_search is None:
+        from rag_demos.local_search import LocalSearch
+        _local_search = LocalSearch()
+    return _local_search
+
+
+def context_messages(msg, docs):
+    """
+    Messages for a completion grounded on locally retrieved chunks, referenced as [docN] like the data source does
+    """
+    sources = "\n\n".join(f"[doc{i}] {d['title']}\n{d['chunk']}" for i, d in enumerate(docs, 1))
+    return [
+        {"role": "system", "content": get_prompt() + "\n\nAnswer only from the following documents and cite them as [docN]:\n\n" + sources},
+        {"role": "user", "content": msg}
+    ]
+
+
+def citations(docs):
+    return [{"content": d["chunk"], "title": d["name"], "url": d["location"], "filepath": d["location"],
+             "chunk_id": d["id"]} for d in docs]
+
+
+def build_request(msg, top_k, query_type):
+    """
+    Messages and body of the completion for a question, plus the locally retrieved documents and the report of
+    their packing into the context (see context_packing) if any
+    """
+    from rag_demos.local_search import LOCAL_QUERY_TYPES
+    retrieval_mode = S.get_settings().retrieval_mode
+    if retrieval_mode == "search" or (retrieval_mode == "local" and query_type in LOCAL_QUERY_TYPES):
+        from rag_demos.context_packing import pack_context
+        with TM.span("retrieval"):
+            if retrieval_mode == "search":
+                from rag_demos.multi_search import multi_search
+                docs = multi_search(msg, query_type=query_type, top_k=top_k)
+            else:
+                docs = get_local_search().search(msg, query_type=query_type, top_k=top_k)
+        with TM.span("context_packing"):
+            docs, packing = pack_context(docs)
+        return context_messages(msg, docs), {}, docs, packing
+    return [
+        {"role": "system", "content": get_prompt()},
         {"role": "user", "content": msg}
-    ], body=ZI.extra_body, model=model, temperature=temperature, top_p=top_p)
+    ], data_source_body(top_k, query_type), None, None
+
+
+def data_source_body(top_k, query_type):
+    """
+    A new "On Your Data" body for one request, so concurrent requests never share or modify the same dict
+    """
+    body = ZI.extra_body_for()
+    parameters = body["data_sources"][0]["parameters"]
+    parameters["query_type"] = query_type
+    parameters["top_n_documents"] = top_k
+    if query_type == "vector_semantic_hybrid":
+        parameters["semantic_configuration"] = "my-semantic-config"
+    return body
+
+
+def answer(msg, model, temperature, top_p, top_k, query_type, priority=RL.INTERACTIVE):
+    """
+    Answer a question without the answer cache
+    :param priority: Rate limiter lane of the completion, RL.BATCH for offline jobs
+    """
+    with TM.span("build_request"):
+        messages, body, docs, packing = build_request(msg, top_k, query_type)
+    with TM.span("completion"):
+        bot_response, full_js = get_openai_response(messages=messages, body=body, model=model,
+                                                    temperature=temperature, top_p=top_p, priority=priority)
+    if docs is not None:
+        full_js["message"]["context"] = {"citations": citations(docs)}
+        full_js["context_packing"] = packing
+    return bot_response, full_js
+
+
+def answer_stream(msg, model, temperature, top_p, top_k, query_type):
+    """
+    Like answer, but yields the events of get_openai_response_stream
+    """
+    messages, body, docs, packing = build_request(msg, top_k, query_type)
+    if docs is not None:
+        yield {"type": "citations", "citations": citations(docs)}
+    for event in get_openai_response_stream(messages=messages, body=body, model=model,
+                                            temperature=temperature, top_p=top_p):
+        if event["type"] == "done" and docs is not None:
+            event["full_js"]["message"]["context"] = {"citations": citations(docs)}
+            event["full_js"]["context_packing"] = packing
+        yield event
+
+
+_answer_cache = None
+_singleflight = None
+
+
+def get_answer_cache():
+    global _answer_cache
+    if _answer_cache is None:
+        from rag_demos.answer_cache import AnswerCache
+        _answer_cache = AnswerCache()
+    return _answer_cache
+
+
+def get_singleflight():
+    global _singleflight
+    if _singleflight is None:
+        from rag_demos.singleflight import SingleFlight
+        _singleflight = SingleFlight()
+    return _singleflight
+
+
+def _flight_key(kind, msg, settings):
+    from rag_demos.answer_cache import normalize_question
+    return kind, normalize_question(msg), tuple(sorted(settings.items()))
+
+
+def _stage_ms(stages):
+    return {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()}
+
+
+def respond(msg, chat_history, model, temperature, top_p, top_k, query_type):
+    cache = get_answer_cache()
+    settings = dict(model=model, temperature=temperature, top_p=top_p, top_k=top_k, query_type=query_type)
+    with TM.request(model=model, query_type=query_type) as stages:
+        with TM.span("cache_lookup"):
+            cached = cache.get(msg, **settings)
+        if cached is not None:
+            bot_response, full_js, hit = cached
+        else:
+            started = time.perf_counter()
+
+            def call():
+                result = answer(msg, **settings)
+                cache.put(msg, *result, time.perf_counter() - started, **settings)
+                return result
+
+            # identical questions asked while this one is in flight wait for it instead of calling upstream again
+            (bot_response, full_js), shared = get_singleflight().do(_flight_key("answer", msg, settings), call)
+            hit = "coalesced" if shared else None
+    TM.registry.inc("requests", model=model, query_type=query_type, cache=hit or "miss")
     chat_history.append({"role": "user", "content": msg})
     chat_history.append({"role": "assistant", "content": bot_response})
-    return "", chat_history, json.dumps(full_js)
+    return "", chat_history, json.dumps({**full_js, "stages_ms": _stage_ms(stages),
+                                         "cache": {"hit": hit, **cache.stats()}})
+
+
+def respond_stream(msg, chat_history, model, temperature, top_p, top_k, query_type):
+    """
+    Generator version of respond for the Gradio chat: the answer is shown token by token as it is generated
+    """
+    cache = get_answer_cache()
+    settings = dict(model=model, temperature=temperature, top_p=top_p, top_k=top_k, query_type=query_type)
+    # a generator can resume in another context, so stages are recorded with explicit labels instead of TM.request
+    labels = dict(model=model, query_type=query_type)
+    chat_history.append({"role": "user", "content": msg})
+    started = time.perf_counter()
+    cached = cache.get(msg, **settings)
+    TM.record("cache_lookup", time.perf_counter() - started, **labels)
+    if cached is not None:
+        bot_response, full_js, hit = cached
+        chat_history.append({"role": "assistant", "content": bot_response})
+        TM.record("request", time.perf_counter() - started, **labels)
+        TM.registry.inc("requests", cache=hit, **labels)
+        yield "", chat_history, json.dumps({**full_js, "cache": {"hit": hit, **cache.stats()}})
+        return
+    chat_history.append({"role": "assistant", "content": ""})
+
+    def stream():
+        for event in answer_stream(msg, **settings):
+            if event["type"] == "done":
+                cache.put(msg, event["content"], event["full_js"], time.perf_counter() - started, **settings)
+            yield event
+
+    last_js = None
+    try:
+        for event in get_singleflight().stream(_flight_key("stream", msg, settings), stream):
+            if event["type"] == "token":
+                chat_history[-1]["content"] += event["content"]
+                yield "", chat_history, last_js
+            elif event["type"] == "citations":
+                last_js = json.dumps({"message": {"context": {"citations": event["citations"]}}})
+                yield "", chat_history, last_js
+            elif event["type"] == "done":
+                full_js = event["full_js"]
+                for stage in ("retrieval", "time_to_first_token", "generation"):
+                    if full_js["timings"].get(stage) is not None:
+                        TM.record(stage, full_js["timings"][stage], **labels)
+                TM.record("request", time.perf_counter() - started, **labels)
+                TM.record_usage(full_js.get("usage") or {"completion_tokens": full_js["timings"]["tokens"]}, **labels)
+                TM.registry.inc("requests", cache="miss", **labels)
+                yield "", chat_history, json.dumps({**full_js, "cache": {"hit": None, **cache.stats()}})
+    except Exception as e:
+        log.error(f"Streaming the answer failed: {e}")
+        TM.record_error("request", **labels)
+        # the empty message appended for the answer is replaced, a partial answer is kept and followed by the error
+        if not chat_history[-1]["content"]:
+            chat_history.pop()
+        chat_history.append({"role": "assistant", "content": f"Error: {e}"})
+        yield "", chat_history, last_js
 
 
 if __name__ == "__main__":
     import gradio as gr
 
+    TM.start_exporters()
+
     with gr.Blocks() as demo:
         with gr.Row():
             with gr.Accordion("Settings", open=False):
@@ -67,7 +288,10 @@ if __name__ == "__main__":
 
         # (model, is_stream, temperature, history)
 
-        bot_btn.click(respond, [bot_input_tb, bot, model_name_ddn, temperature_sldr, top_p_sldr, top_k_sldr, query_type_ddn ], [bot_input_tb, bot, full_js],
-                      queue=False)
+        # streaming handlers are generators, which gradio only runs through its queue
+        bot_btn.click(respond_stream, [bot_input_tb, bot, model_name_ddn, temperature_sldr, top_p_sldr, top_k_sldr, query_type_ddn ], [bot_input_tb, bot, full_js])
 
+    # at most SERVE_CONCURRENCY requests run at once, SERVE_QUEUE_SIZE more wait and further ones are rejected
+    settings = S.get_settings()
+    demo.queue(default_concurrency_limit=settings.serve_concurrency, max_size=settings.serve_queue_size)
     demo.launch(share=True)
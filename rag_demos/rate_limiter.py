@@ -0,0 +1,277 @@
+import time
+import asyncio
+import random
+import threading
+from contextlib import contextmanager
+import rag_demos.utils as U
+import rag_demos.settings as S
+
+log = U.get_logger(__name__)
+
+# priority lanes: interactive chat traffic is served ahead of batch jobs
+INTERACTIVE = 0
+BATCH = 1
+
+# limits of the process-wide scheduler, AOAI_BATCH_HEADROOM is the share of the per-minute budget that batch
+# traffic leaves for interactive requests
+__getattr__ = S.lazy_constants(__name__, {"AOAI_RPM": "aoai_rpm", "AOAI_TPM": "aoai_tpm",
+                                          "AOAI_MAX_CONCURRENCY": "aoai_max_concurrency",
+                                          "BATCH_HEADROOM": "aoai_batch_headroom"})
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+_encoding = False
+
+
+def _get_encoding():
+    # loading the BPE ranks takes a while (and a download on first use), only done when tokens are counted
+    global _encoding
+    if _encoding is False:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Token count of a text with cl100k_base if tiktoken is installed, otherwise a conservative estimate
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Serbian/Bosnian text averages well under 3 characters per token
+    return len(text) // 2 + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cut a text to at most max_tokens tokens (by the same measure as count_tokens)
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[:max_tokens * 2]
+
+
+def estimate_chat_tokens(messages, max_tokens):
+    """
+    Tokens a chat request counts against the TPM limit: the prompt plus the max_tokens reservation
+    """
+    return sum(count_tokens(m.get("content") or "") + 4 for m in messages) + max_tokens
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute, holding at most one minute of budget
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now, reserve=0.0):
+        """
+        Seconds to wait before `amount` units are available while keeping `reserve` of the capacity, 0 if available now.
+        An amount larger than the bucket can hold is admitted once the bucket is full (less the reserve).
+        """
+        self._refill(now)
+        needed = min(amount, self.capacity * (1 - reserve)) + reserve * self.capacity
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def clamp(self, remaining):
+        """
+        Align the local view with the remaining budget reported by the service
+        """
+        self.level = min(self.level, float(remaining))
+
+
+class _Deployment:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        # interactive callers queued for this deployment, batch callers of the same deployment wait for them
+        self.waiting_interactive = 0
+
+
+class Scheduler:
+    """
+    Process-wide admission control for Azure OpenAI calls.
+    Every deployment has request and token buckets, throttling headers of responses feed back into them,
+    and at most max_concurrency calls are in flight. Batch requests wait while interactive ones are queued for the
+    same deployment and never use the last batch_headroom of a bucket.
+    :param rpm: Default requests per minute of a deployment, None for no limit
+    :param tpm: Default tokens per minute of a deployment, None for no limit
+    :param max_concurrency: AOAI_MAX_CONCURRENCY by default
+    :param batch_headroom: AOAI_BATCH_HEADROOM by default
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=None, batch_headroom=None):
+        settings = S.get_settings()
+        self.default_rpm = rpm
+        self.default_tpm = tpm
+        self.max_concurrency = settings.aoai_max_concurrency if max_concurrency is None else max_concurrency
+        self.batch_headroom = settings.aoai_batch_headroom if batch_headroom is None else batch_headroom
+        self.in_flight = 0
+        self._deployments = {}
+        self._lock = threading.Lock()
+
+    def configure(self, deployment, rpm=None, tpm=None):
+        """
+        Set the limits of one deployment, e.g. from its quota in the Azure portal
+        """
+        with self._lock:
+            d = _Deployment(rpm, tpm)
+            d.waiting_interactive = self._deployment(deployment).waiting_interactive
+            self._deployments[deployment] = d
+
+    def _deployment(self, deployment):
+        d = self._deployments.get(deployment)
+        if d is None:
+            d = self._deployments[deployment] = _Deployment(self.default_rpm, self.default_tpm)
+        return d
+
+    def reserve(self, deployment, tokens=0, priority=INTERACTIVE):
+        """
+        Non-blocking admission: take a concurrency slot and the budget of one request and return 0,
+        or return the number of seconds to wait before trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            d = self._deployment(deployment)
+            wait_seconds = d.blocked_until - now
+            reserve = 0.0
+            if priority == BATCH:
+                if d.waiting_interactive:
+                    wait_seconds = max(wait_seconds, 0.05)
+                reserve = self.batch_headroom
+            if d.requests:
+                wait_seconds = max(wait_seconds, d.requests.delay(1, now, reserve))
+            if d.tokens:
+                wait_seconds = max(wait_seconds, d.tokens.delay(tokens, now, reserve))
+            if self.in_flight >= self.max_concurrency:
+                wait_seconds = max(wait_seconds, 0.01)
+            if wait_seconds > 0:
+                return wait_seconds
+            if d.requests:
+                d.requests.take(1)
+            if d.tokens:
+                d.tokens.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, deployment, tokens=0, priority=INTERACTIVE):
+        """
+        Block until the request is admitted, see reserve
+        """
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._deployment(deployment).waiting_interactive += 1
+        try:
+            while True:
+                wait_seconds = self.reserve(deployment, tokens, priority)
+                if wait_seconds <= 0:
+                    return
+                time.sleep(min(wait_seconds, 1.0))
+        finally:
+            if priority == INTERACTIVE:
+                with self._lock:
+                    self._deployment(deployment).waiting_interactive -= 1
+
+    async def aacquire(self, deployment, tokens=0, priority=INTERACTIVE):
+        """
+        asyncio version of acquire, waits without blocking the event loop
+        """
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._deployment(deployment).waiting_interactive += 1
+        try:
+            while True:
+                wait_seconds = self.reserve(deployment, tokens, priority)
+                if wait_seconds <= 0:
+                    return
+                await asyncio.sleep(min(wait_seconds, 1.0))
+        finally:
+            if priority == INTERACTIVE:
+                with self._lock:
+                    self._deployment(deployment).waiting_interactive -= 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def slot(self, deployment, tokens=0, priority=INTERACTIVE):
+        self.acquire(deployment, tokens, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def update_from_headers(self, deployment, headers):
+        """
+        Feed Retry-After and x-ratelimit-remaining-* response headers back into the deployment's budget
+        :return: The retry delay requested by the service in seconds, 0 if none
+        """
+        retry_after = retry_after_seconds(headers)
+        with self._lock:
+            d = self._deployment(deployment)
+            if retry_after:
+                d.blocked_until = max(d.blocked_until, time.monotonic() + retry_after)
+            remaining = headers.get('x-ratelimit-remaining-requests')
+            if remaining is not None and d.requests:
+                d.requests.clamp(remaining)
+            remaining = headers.get('x-ratelimit-remaining-tokens')
+            if remaining is not None and d.tokens:
+                d.tokens.clamp(remaining)
+        return retry_after
+
+
+def retry_after_seconds(headers):
+    """
+    Delay requested by a throttled response, from retry-after-ms or retry-after
+    """
+    value = headers.get('retry-after-ms')
+    if value:
+        return float(value) / 1000
+    value = headers.get('retry-after')
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def backoff(attempt, base=1.0, cap=60.0):
+    """
+    Full-jitter exponential backoff, so clients throttled together do not retry together
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                settings = S.get_settings()
+                _scheduler = Scheduler(settings.aoai_rpm, settings.aoai_tpm)
+    return _scheduler
@@ -0,0 +1,78 @@
+import rag_demos.utils as U
+
+log = U.get_logger(__name__)
+
+# secrets come back redacted (null or masked) from the service and cannot be compared
+SECRET_KEYS = {"apiKey", "connectionString", "key"}
+# field attributes that cannot be changed on an existing field
+IMMUTABLE_FIELD_ATTRIBUTES = ("type", "key", "searchable", "filterable", "sortable", "facetable", "analyzer",
+                              "indexAnalyzer", "dimensions", "vectorSearchProfile")
+
+
+def _normalize(value):
+    # the payloads use "true"/"false" strings where the service returns booleans
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    return value
+
+
+def _empty(value):
+    return value is None or value == [] or value == {} or value == ""
+
+
+def diff(desired, current, path=""):
+    """
+    Paths where the desired definition differs from the current one.
+    Only keys present in the desired definition are compared, so defaults and read-only properties
+    added by the service (@odata.etag, ...) do not count as changes.
+    """
+    if isinstance(desired, dict):
+        if not isinstance(current, dict):
+            return [path or "/"]
+        changes = []
+        for key, value in desired.items():
+            if key in SECRET_KEYS:
+                continue
+            if key not in current or current[key] is None:
+                if not _empty(value):
+                    changes.append(f"{path}/{key}")
+                continue
+            changes += diff(value, current[key], f"{path}/{key}")
+        return changes
+    if isinstance(desired, list):
+        if not isinstance(current, list) or len(desired) != len(current):
+            return [path]
+        if all(isinstance(d, dict) and "name" in d for d in desired):
+            by_name = {c.get("name"): c for c in current if isinstance(c, dict)}
+            return [change for d in desired
+                    for change in (diff(d, by_name[d["name"]], f"{path}[{d['name']}]")
+                                   if d["name"] in by_name else [f"{path}[{d['name']}]"])]
+        return [change for i, (d, c) in enumerate(zip(desired, current)) for change in diff(d, c, f"{path}[{i}]")]
+    return [] if _normalize(desired) == _normalize(current) else [path]
+
+
+def index_update_problems(desired, current):
+    """
+    Reasons why the desired index definition cannot be applied to the existing index in place.
+    Adding fields, vectorizers, profiles or semantic configurations is an in-place update; removing fields or
+    changing their type or attributes, and changing existing vector algorithms or compressions, are not.
+    """
+    problems = []
+    current_fields = {f["name"]: f for f in current.get("fields", [])}
+    desired_fields = {f["name"]: f for f in desired.get("fields", [])}
+    for name in current_fields.keys() - desired_fields.keys():
+        problems.append(f"field {name} removed")
+    for name, field in desired_fields.items():
+        if name not in current_fields:
+            continue
+        for attribute in IMMUTABLE_FIELD_ATTRIBUTES:
+            if attribute in field and diff(field[attribute], current_fields[name].get(attribute)):
+                problems.append(f"field {name}: {attribute} changed")
+    current_vs = current.get("vectorSearch") or {}
+    desired_vs = desired.get("vectorSearch") or {}
+    for section in ("algorithms", "compressions", "profiles"):
+        existing = {item["name"]: item for item in current_vs.get(section) or []}
+        for item in desired_vs.get(section) or []:
+            if item["name"] in existing and diff(item, existing[item["name"]]):
+                problems.append(f"vectorSearch {section} {item['name']} changed")
+    return problems
@@ -0,0 +1,266 @@
+import os
+import functools
+import rag_demos.utils as U
+
+
+class Settings:
+    """
+    Connection settings of the Azure services and the tuning knobs of the package, read from the environment
+    (and .env, loaded by utils) once. A missing variable only fails when the setting is used, so modules can be
+    imported without credentials, and the environment can be changed after import (see get_settings).
+    """
+
+    def __init__(self, environ=None):
+        self._environ = dict(os.environ if environ is None else environ)
+
+    def get(self, name, default=None):
+        return self._environ.get(name, default)
+
+    def require(self, name):
+        value = self._environ.get(name)
+        if value is None:
+            raise KeyError(f"Environment variable {name} is not set (see credentials.env)")
+        return value
+
+    def _int(self, name, default):
+        return int(self._environ.get(name, default))
+
+    def _float(self, name, default):
+        return float(self._environ.get(name, default))
+
+    def _flag(self, name, default):
+        return self._environ.get(name, default) == '1'
+
+    @property
+    def environment(self):
+        return self.require('ENVIRONMENT')
+
+    @property
+    def search_endpoint(self):
+        return self.require('AZURE_SEARCH_ENDPOINT')
+
+    @property
+    def search_key(self):
+        return self.require('AZURE_SEARCH_KEY')
+
+    @property
+    def search_api_version(self):
+        return self.require('AZURE_SEARCH_API_VERSION')
+
+    @property
+    def openai_endpoint(self):
+        return self.require('AZURE_OPENAI_ENDPOINT')
+
+    @property
+    def openai_key(self):
+        return self.require('AZURE_OPENAI_API_KEY')
+
+    @property
+    def openai_api_version(self):
+        return self.require('AZURE_OPENAI_API_VERSION')
+
+    @property
+    def chat_deployment(self):
+        return self.require('GPT4_DEPLOYMENT_NAME')
+
+    @property
+    def embedding_deployment(self):
+        return self.require('EMBEDDING_DEPLOYMENT_NAME')
+
+    @property
+    def embedding_dimensions(self):
+        return int(self.require('EMBEDDING_DIMENSIONS'))
+
+    @property
+    def blob_connection_string(self):
+        return self.require('BLOB_CONNECTION_STRING')
+
+    # HTTP clients (http_transport, async_transport)
+    @property
+    def http_pool_connections(self):
+        return self._int('HTTP_POOL_CONNECTIONS', 4)
+
+    @property
+    def http_pool_maxsize(self):
+        return self._int('HTTP_POOL_MAXSIZE', 16)
+
+    @property
+    def http_connect_timeout(self):
+        return self._float('HTTP_CONNECT_TIMEOUT', 5)
+
+    @property
+    def http_read_timeout(self):
+        return self._float('HTTP_READ_TIMEOUT', 120)
+
+    @property
+    def http_async_max_connections(self):
+        return self._int('HTTP_ASYNC_MAX_CONNECTIONS', 200)
+
+    @property
+    def http_async_max_keepalive(self):
+        return self._int('HTTP_ASYNC_MAX_KEEPALIVE', 50)
+
+    @property
+    def http_async_http2(self):
+        return self._flag('HTTP_ASYNC_HTTP2', '1')
+
+    # Azure OpenAI rate limits (rate_limiter), unset or 0 for no limit
+    @property
+    def aoai_rpm(self):
+        return self._int('AOAI_RPM', 0) or None
+
+    @property
+    def aoai_tpm(self):
+        return self._int('AOAI_TPM', 0) or None
+
+    @property
+    def aoai_max_concurrency(self):
+        return self._int('AOAI_MAX_CONCURRENCY', 32)
+
+    @property
+    def aoai_batch_headroom(self):
+        return self._float('AOAI_BATCH_HEADROOM', 0.2)
+
+    # embeddings (embedding_client, embedding_cache, embedders)
+    @property
+    def embedding_max_inputs(self):
+        return self._int('EMBEDDING_MAX_INPUTS', 2048)
+
+    @property
+    def embedding_max_request_tokens(self):
+        return self._int('EMBEDDING_MAX_REQUEST_TOKENS', 300000)
+
+    @property
+    def embedding_rpm(self):
+        return self._int('EMBEDDING_RPM', 0) or None
+
+    @property
+    def embedding_tpm(self):
+        return self._int('EMBEDDING_TPM', 0) or None
+
+    @property
+    def embedding_cache_path(self):
+        return self.get('EMBEDDING_CACHE_PATH', str(U.CACHE_DIR / "embeddings.sqlite"))
+
+    @property
+    def embedding_cache_max_bytes(self):
+        return self._int('EMBEDDING_CACHE_MAX_BYTES', 1024 ** 3)
+
+    @property
+    def fake_embedding_dimensions(self):
+        return self._int('EMBEDDING_DIMENSIONS', 1536)
+
+    # index and local ingestion (zakon_index, local_ingest, vector_store, indexer_monitor)
+    @property
+    def chunker(self):
+        return self.get('CHUNKER', 'fixed')
+
+    @property
+    def vector_compression(self):
+        return self.get('VECTOR_COMPRESSION', '')
+
+    @property
+    def vector_truncate_dimensions(self):
+        return self._int('VECTOR_TRUNCATE_DIMENSIONS', 0) or None
+
+    @property
+    def vector_oversampling(self):
+        return self._float('VECTOR_OVERSAMPLING', 10)
+
+    @property
+    def vector_store_path(self):
+        return self.get('VECTOR_STORE_PATH', str(U.CACHE_DIR / "vector_store"))
+
+    @property
+    def indexer_run_log(self):
+        return self.get('INDEXER_RUN_LOG', str(U.CACHE_DIR / "indexer_runs.jsonl"))
+
+    # chat app (oyd_chat, answer_cache, context_packing, multi_search)
+    @property
+    def retrieval_mode(self):
+        return self.get('RETRIEVAL_MODE', 'remote')
+
+    @property
+    def serve_concurrency(self):
+        return self._int('SERVE_CONCURRENCY', 16)
+
+    @property
+    def serve_queue_size(self):
+        return self._int('SERVE_QUEUE_SIZE', 64)
+
+    @property
+    def answer_cache_size(self):
+        return self._int('ANSWER_CACHE_SIZE', 1000)
+
+    @property
+    def answer_cache_ttl(self):
+        return self._float('ANSWER_CACHE_TTL', 24 * 3600)
+
+    @property
+    def answer_cache_semantic_threshold(self):
+        return self._float('ANSWER_CACHE_SEMANTIC_THRESHOLD', 0)
+
+    @property
+    def answer_cache_indexer_check(self):
+        return self._float('ANSWER_CACHE_INDEXER_CHECK', 60)
+
+    @property
+    def context_token_budget(self):
+        return self._int('CONTEXT_TOKEN_BUDGET', 8000)
+
+    @property
+    def near_duplicate_threshold(self):
+        return self._float('NEAR_DUPLICATE_THRESHOLD', 0.8)
+
+    @property
+    def search_indexes(self):
+        return [name.strip() for name in self.get('SEARCH_INDEXES', '').split(',') if name.strip()]
+
+    @property
+    def search_index_timeout(self):
+        return self._float('SEARCH_INDEX_TIMEOUT', 3)
+
+    # evaluation and telemetry (batch_eval, telemetry, bench)
+    @property
+    def eval_concurrency(self):
+        return self._int('EVAL_CONCURRENCY', 8)
+
+    @property
+    def telemetry_enabled(self):
+        return self._flag('TELEMETRY_ENABLED', '1')
+
+    @property
+    def telemetry_export_path(self):
+        return self.get('TELEMETRY_EXPORT_PATH')
+
+    @property
+    def telemetry_export_interval(self):
+        return self._float('TELEMETRY_EXPORT_INTERVAL', 60)
+
+    @property
+    def telemetry_port(self):
+        return self._int('TELEMETRY_PORT', 0) or None
+
+    @property
+    def import_budget_ms(self):
+        return self._float('IMPORT_BUDGET_MS', 150)
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    The process-wide settings, built on first use. Call get_settings.cache_clear() after changing the environment.
+    """
+    return Settings()
+
+
+def lazy_constants(module_name, names):
+    """
+    Module __getattr__ serving the former import-time constants of a module from the current settings
+    :param names: dict constant name -> Settings property
+    """
+    def __getattr__(name):
+        if name in names:
+            return getattr(get_settings(), names[name])
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+    return __getattr__
@@ -0,0 +1,102 @@
+import threading
+import rag_demos.utils as U
+
+log = U.get_logger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.events = []
+        self.result = None
+        self.error = None
+        self.done = False
+
+
+class SingleFlight:
+    """
+    Coalescing of identical in-flight calls: while a call for a key runs, callers with the same key
+    wait for it and share its result instead of issuing their own upstream request.
+    Nothing is kept once the call finished, caching results is left to the answer cache.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+            return flight, True
+
+    def _finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            self._flights.pop(key, None)
+        with flight.cond:
+            flight.result, flight.error, flight.done = result, error, True
+            flight.cond.notify_all()
+
+    def do(self, key, fn):
+        """
+        Run fn() unless a call with the same key is in flight, in which case wait for that call
+        :return: (result, shared), shared is True when the result came from another caller's call
+        """
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                result = fn()
+            except BaseException as e:
+                self._finish(key, flight, error=e)
+                raise
+            self._finish(key, flight, result=result)
+            return result, False
+        with flight.cond:
+            flight.cond.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    def _pump(self, key, flight, fn):
+        error = None
+        try:
+            for event in fn():
+                with flight.cond:
+                    flight.events.append(event)
+                    flight.cond.notify_all()
+        except BaseException as e:
+            log.error(f"Coalesced stream failed: {e}")
+            error = e
+        self._finish(key, flight, error=error)
+
+    def stream(self, key, fn):
+        """
+        Generator version of do: fn() returns an iterable of events, every caller with the same key receives all
+        events of one run. The run is driven by a background thread, so it completes (and its result can be cached)
+        even if the first caller goes away.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            threading.Thread(target=self._pump, args=(key, flight, fn), name="singleflight", daemon=True).start()
+        seen = 0
+        while True:
+            with flight.cond:
+                flight.cond.wait_for(lambda: len(flight.events) > seen or flight.done)
+                events, done = flight.events[seen:], flight.done
+            for event in events:
+                yield event
+            seen += len(events)
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
@@ -0,0 +1,357 @@
+import re
+import sys
+import json
+import socket
+import time
+import random
+import hashlib
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from datetime import datetime, timedelta, timezone
+import rag_demos.utils as U
+
+log = U.get_logger(__name__)
+
+OBJECT_TYPES = ("datasources", "indexes", "skillsets", "indexers")
+_LOREM = ("Ko drugome nanese tešku tjelesnu povredu ili teško naruši zdravlje kazniće se zatvorom "
+          "od jedne do osam godina. Porez na dohodak plaća se na prihode iz radnog odnosa. ")
+
+
+class StubConfig:
+    """
+    Behaviour of the stand-in server
+    :param latency: Base server time per request in seconds
+    :param jitter: Random extra server time, uniform in [0, jitter] seconds
+    :param throttle_rate: Share of requests answered with 429 and a Retry-After header
+    :param retry_after: Retry-After of throttled responses in seconds
+    :param results: Documents returned by a search (capped by top)
+    :param chunk_chars: Characters of chunk text per returned document or citation
+    :param completion_tokens: Tokens of a generated answer
+    :param token_interval: Delay between streamed tokens in seconds
+    :param indexer_seconds: Time an indexer run stays inProgress
+    :param throttle_pattern: Regex of the paths that can be throttled, by default the Azure OpenAI ones
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=0.05, results=5,
+                 chunk_chars=2000, completion_tokens=100, token_interval=0.0, indexer_seconds=0.0,
+                 throttle_pattern=r"^/openai/"):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.results = results
+        self.chunk_chars = chunk_chars
+        self.completion_tokens = completion_tokens
+        self.token_interval = token_interval
+        self.indexer_seconds = indexer_seconds
+        self.throttle_pattern = throttle_pattern
+
+
+class _State:
+    def __init__(self):
+        self.objects = {t: {} for t in OBJECT_TYPES}
+        self.documents = {}
+        self.runs = {}
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+
+def _chunk(seed, chars):
+    text = (_LOREM * (chars // len(_LOREM) + 1))[:chars]
+    return f"{seed}: {text}"
+
+
+def _vector(text, dimensions):
+    rng = np.random.default_rng(int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little"))
+    return rng.uniform(-1, 1, dimensions).round(6).tolist()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = None
+    state: _State = None
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, without this delayed ACKs add ~40 ms per request
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _send(self, status, payload=None, headers=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _admit(self, path):
+        config, state = self.config, self.state
+        with state.lock:
+            state.requests += 1
+            throttled = (config.throttle_rate and re.search(config.throttle_pattern, path)
+                         and random.random() < config.throttle_rate)
+            if throttled:
+                state.throttled += 1
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        if throttled:
+            self._send(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                       {"retry-after-ms": str(int(config.retry_after * 1000)),
+                        "Retry-After": str(max(1, round(config.retry_after)))})
+        return not throttled
+
+    def _route(self, method):
+        path = urlsplit(self.path).path.rstrip("/")
+        # the body is read first, an unread body would be parsed as the next request on the connection
+        body = self._body() if method in ("PUT", "POST") else {}
+        if not self._admit(path):
+            return
+        match = re.fullmatch(r"/openai/deployments/([^/]+)/(chat/completions|embeddings)", path)
+        if match:
+            if match.group(2) == "embeddings":
+                return self._embeddings(body)
+            return self._chat(body)
+        match = re.fullmatch(r"/indexes/([^/]+)/docs/(index|search)", path)
+        if match and method == "POST":
+            if match.group(2) == "index":
+                return self._index_documents(match.group(1), body)
+            return self._search(match.group(1), body)
+        match = re.fullmatch(r"/indexers/([^/]+)/(run|reset|status)", path)
+        if match:
+            return self._indexer(match.group(1), match.group(2))
+        match = re.fullmatch(r"/(" + "|".join(OBJECT_TYPES) + r")/([^/]+)", path)
+        if match:
+            return self._object(method, match.group(1), match.group(2), body)
+        self._send(404, {"error": {"code": "NotFound", "message": f"No route for {method} {path}"}})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _object(self, method, object_type, name, body):
+        objects = self.state.objects[object_type]
+        if method == "PUT":
+            existed = name in objects
+            objects[name] = {**body, "name": name, "@odata.etag": f"\"{time.time_ns()}\""}
+            return self._send(200 if existed else 201, objects[name])
+        if name not in objects:
+            return self._send(404, {"error": {"code": "ResourceNotFound", "message": f"{name} not found"}})
+        if method == "DELETE":
+            del objects[name]
+            return self._send(204)
+        return self._send(200, objects[name])
+
+    def _index_documents(self, index_name, body):
+        docs = self.state.documents.setdefault(index_name, {})
+        results = []
+        with self.state.lock:
+            for doc in body.get("value", []):
+                key = doc.get("id")
+                if doc.get("@search.action") == "delete":
+                    docs.pop(key, None)
+                else:
+                    docs[key] = {k: v for k, v in doc.items() if k != "@search.action"}
+                results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200})
+        self._send(200, {"value": results})
+
+    def _search_documents(self, docs, body):
+        # pages through the uploaded documents like the service: at most 1000 per response, with
+        # @search.nextPageParameters when top was not given or is larger than one page
+        with self.state.lock:
+            docs = list(docs.values())
+        skip, top = body.get("skip", 0), body.get("top")
+        size = min(top or 50, 1000)
+        select = body.get("select")
+        fields = [f.strip() for f in select.split(",")] if select and select != "*" else None
+        value = [{"@search.score": 1.0, **({k: v for k, v in doc.items() if k in fields} if fields else doc)}
+                 for doc in docs[skip:skip + size]]
+        payload = {}
+        if body.get("count"):
+            payload["@odata.count"] = len(docs)
+        if skip + size < len(docs) and (top is None or top > size):
+            payload["@search.nextPageParameters"] = {**body, "skip": skip + size,
+                                                     "top": top - size if top else None}
+        payload["value"] = value
+        self._send(200, payload)
+
+    def _search(self, index_name, body):
+        docs = self.state.documents.get(index_name)
+        if docs:
+            return self._search_documents(docs, body)
+        top = body.get("top", 50)
+        count = min(top, self.config.results)
+        select = body.get("select")
+        fields = [f.strip() for f in select.split(",")] if select else None
+        value = []
+        for i in range(count):
+            doc = {"@search.score": round(1.0 / (i + 1), 4), "id": f"doc_chunks_{i}", "ParentKey": "doc",
+                   "title": f"Zakon {i}", "name": f"zakon_{i}.pdf", "location": f"data/zakon_{i}.pdf",
+                   "chunk": _chunk(i, self.config.chunk_chars)}
+            if fields:
+                doc = {k: v for k, v in doc.items() if k in fields or k.startswith("@search")}
+            value.append(doc)
+        payload = {"value": value}
+        if body.get("count"):
+            payload["@odata.count"] = max(count, len(self.state.documents.get(index_name, {})))
+        self._send(200, payload)
+
+    def _indexer(self, name, action):
+        now = datetime.now(timezone.utc)
+        # executions of the indexer, newest first: ("run", start time) or ("reset", time)
+        history = self.state.runs.setdefault(name, [])
+        if action in ("run", "reset"):
+            history.insert(0, (action, now))
+            return self._send(202 if action == "run" else 204)
+        results = []
+        for kind, started in history:
+            if kind == "reset":
+                results.append({"status": "reset", "startTime": started.isoformat(), "endTime": started.isoformat()})
+                continue
+            ended = started + timedelta(seconds=self.config.indexer_seconds)
+            running = now < ended
+            results.append({"status": "inProgress" if running else "success", "startTime": started.isoformat(),
+                            "endTime": None if running else ended.isoformat(), "itemsProcessed": 10, "itemsFailed": 0,
+                            "errors": [], "warnings": []})
+        self._send(200, {"status": "running", "lastResult": results[0] if results else None,
+                         "executionHistory": results})
+
+    def _citations(self, body):
+        if not body.get("data_sources"):
+            return None
+        top = body["data_sources"][0].get("parameters", {}).get("top_n_documents", 5)
+        return {"citations": [{"content": _chunk(i, self.config.chunk_chars), "title": f"zakon_{i}.pdf",
+                               "url": f"data/zakon_{i}.pdf", "filepath": f"data/zakon_{i}.pdf",
+                               "chunk_id": str(i)} for i in range(min(top, self.config.results))]}
+
+    def _tokens(self):
+        return [f"tok{i} " for i in range(self.config.completion_tokens)]
+
+    def _chat(self, body):
+        context = self._citations(body)
+        tokens = self._tokens()
+        if body.get("stream"):
+            return self._chat_stream(context, tokens)
+        message = {"role": "assistant", "content": "".join(tokens)}
+        if context:
+            message["context"] = context
+        prompt_tokens = sum(len(m.get("content") or "") // 4 for m in body.get("messages", []))
+        self._send(200, {"id": "stub", "object": "chat.completion", "model": "stub",
+                         "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                   "total_tokens": prompt_tokens + len(tokens)}})
+
+    def _chat_stream(self, context, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload):
+            data = b"data: " + payload + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        if context:
+            event(json.dumps({"choices": [{"index": 0, "delta": {"role": "assistant", "context": context}}]}).encode())
+        for token in tokens:
+            if self.config.token_interval:
+                time.sleep(self.config.token_interval)
+            event(json.dumps({"choices": [{"index": 0, "delta": {"content": token}}]}).encode())
+        event(json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}).encode())
+        event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _embeddings(self, body):
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        dimensions = body.get("dimensions", 1536)
+        self._send(200, {"object": "list", "model": "stub",
+                         "data": [{"object": "embedding", "index": i, "embedding": _vector(t, dimensions)}
+                                  for i, t in enumerate(texts)],
+                         "usage": {"prompt_tokens": sum(len(t) // 4 for t in texts),
+                                   "total_tokens": sum(len(t) // 4 for t in texts)}})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing pooled keep-alive connections is expected
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """
+    Local stand-in for the Azure AI Search REST endpoints and the Azure OpenAI chat completions and embeddings
+    endpoints used in this repo, for offline benchmarks. Runs a threading HTTP server in a background thread:
+
+        with StubServer(StubConfig(latency=0.05, throttle_rate=0.1)) as server:
+            os.environ['AZURE_SEARCH_ENDPOINT'] = server.url
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        self.state = _State()
+        handler = type("StubHandler", (_Handler,), {"config": self.config, "state": self.state})
+        self.httpd = _Server((host, port), handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        log.info(f"Stub server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        return {"requests": self.state.requests, "throttled": self.state.throttled}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Stand-in Azure AI Search / Azure OpenAI server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.05)
+    parser.add_argument("--chunk-chars", type=int, default=2000)
+    parser.add_argument("--completion-tokens", type=int, default=100)
+    args = parser.parse_args()
+    server = StubServer(StubConfig(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                                   retry_after=args.retry_after, chunk_chars=args.chunk_chars,
+                                   completion_tokens=args.completion_tokens), port=args.port)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import rag_demos.utils as U
+import rag_demos.settings as S
+
+log = U.get_logger(__name__)
+
+# TELEMETRY_EXPORT_PATH: JSONL file the metrics are appended to every TELEMETRY_EXPORT_INTERVAL seconds, unset to
+# disable. TELEMETRY_PORT: port of the Prometheus /metrics endpoint, unset to disable
+__getattr__ = S.lazy_constants(__name__, {"TELEMETRY_ENABLED": "telemetry_enabled",
+                                          "TELEMETRY_EXPORT_PATH": "telemetry_export_path",
+                                          "TELEMETRY_EXPORT_INTERVAL": "telemetry_export_interval",
+                                          "TELEMETRY_PORT": "telemetry_port"})
+
+# upper bounds in seconds, from local cache hits to slow generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+
+# labels (model, query_type) of the request being served, inherited by the spans of its stages
+_request = contextvars.ContextVar("telemetry_request", default=None)
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, a sum and a count, like a Prometheus histogram
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def as_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95), "p99": self.quantile(0.99),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+
+class Registry:
+    """
+    Histograms and counters keyed by metric name and labels. Observations take a lock and a bisect,
+    cheap enough to leave on for every request.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "histograms": [{"name": name, "labels": dict(labels), **h.as_dict()}
+                               for (name, labels), h in self.histograms.items()],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+            }
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def to_prometheus(self):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += n
+                    lines.append(f"rag_{name}_bucket{fmt(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"rag_{name}_sum{fmt(labels)} {h.sum}")
+                lines.append(f"rag_{name}_count{fmt(labels)} {h.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"rag_{name}_total{fmt(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+@contextmanager
+def request(**labels):
+    """
+    Scope of one chat request: spans inside it are labelled with `labels` (model, query_type) and their durations
+    are collected in the yielded dict, stage -> seconds. The total is recorded as the "request" stage.
+    """
+    if not S.get_settings().telemetry_enabled:
+        yield {}
+        return
+    stages = {}
+    token = _request.set((labels, stages))
+    started = time.perf_counter()
+    try:
+        yield stages
+    finally:
+        _request.reset(token)
+        stages["request"] = time.perf_counter() - started
+        registry.observe("stage_seconds", stages["request"], stage="request", **labels)
+
+
+def record(stage, seconds, **labels):
+    """
+    Record the duration of a stage measured elsewhere, e.g. time to first token of a stream
+    """
+    if not S.get_settings().telemetry_enabled:
+        return
+    current = _request.get()
+    if current is not None:
+        labels = {**current[0], **labels}
+        current[1][stage] = current[1].get(stage, 0.0) + seconds
+    registry.observe("stage_seconds", seconds, stage=stage, **labels)
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Time a stage of the current request
+    """
+    if not S.get_settings().telemetry_enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started, **labels)
+
+
+def record_usage(usage, **labels):
+    """
+    Count the prompt and completion tokens of a completion's usage block
+    """
+    if not S.get_settings().telemetry_enabled or not usage:
+        return
+    current = _request.get()
+    if current is not None:
+        labels = {**current[0], **labels}
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind) is not None:
+            registry.inc(kind, usage[kind], **labels)
+            registry.observe(kind, usage[kind], buckets=TOKEN_BUCKETS, **labels)
+
+
+def record_error(stage, **labels):
+    if S.get_settings().telemetry_enabled:
+        current = _request.get()
+        registry.inc("errors", stage=stage, **({**current[0], **labels} if current else labels))
+
+
+def export_jsonl(path=None):
+    """
+    Append a snapshot of all metrics to a JSONL file, TELEMETRY_EXPORT_PATH by default
+    """
+    path = path or S.get_settings().telemetry_export_path
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"recorded": datetime.now(timezone.utc).isoformat(), **registry.snapshot()}) + "\n")
+
+
+def start_file_exporter(path=None, interval=None):
+    """
+    Export to a JSONL file every `interval` seconds from a daemon thread
+    """
+    path = path or S.get_settings().telemetry_export_path
+    interval = interval or S.get_settings().telemetry_export_interval
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                export_jsonl(path)
+            except OSError as e:
+                log.warning(f"Could not export telemetry to {path}: {e}")
+
+    thread = threading.Thread(target=loop, name="telemetry-exporter", daemon=True)
+    thread.start()
+    log.info(f"Exporting telemetry to {path} every {interval}s")
+    return thread
+
+
+def start_http_server(port=None, host="0.0.0.0"):
+    """
+    Serve the metrics in the Prometheus format on http://host:port/metrics from a daemon thread
+    """
+    port = port or S.get_settings().telemetry_port
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = registry.to_prometheus().encode("utf-8") if self.path.startswith("/metrics") else b""
+            self.send_response(200 if data else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="telemetry-http", daemon=True).start()
+    log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def start_exporters():
+    """
+    Start the exporters configured by TELEMETRY_EXPORT_PATH and TELEMETRY_PORT
+    """
+    settings = S.get_settings()
+    if not settings.telemetry_enabled:
+        return
+    if settings.telemetry_export_path:
+        start_file_exporter()
+    if settings.telemetry_port:
+        start_http_server()
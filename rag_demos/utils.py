@@ -1,19 +1,29 @@
 import logging, sys
 import os
 import base64
+import time
+from pathlib import Path
 from dotenv import load_dotenv
 
+# the only load_dotenv of the package: every module imports utils first
 load_dotenv()
 
+# local state (embedding cache, vector store, manifests) lives here
+CACHE_DIR = Path(os.getenv('RAG_CACHE_DIR', str(Path(__file__).resolve().parent.parent / ".cache")))
+
 
 def get_logger(name: str) -> logging.Logger:
     log = logging.getLogger(name)
-    log.setLevel(os.environ['LOG_LEVEL'])
+    log.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+    # a logger is shared by every caller asking for its name, add the handler only once
+    if any(getattr(h, '_rag_demos', False) for h in log.handlers):
+        return log
 
     formatter = logging.Formatter('[%(asctime)s] {%(module)s.%(funcName)s:%(lineno)d %(levelname)s} - %(message)s')
     # '%m-%d %H:%M:%S'
     handl = logging.StreamHandler(stream=sys.stdout)
     handl.setFormatter(formatter)
+    handl._rag_demos = True
     log.addHandler(handl)
     return log
 
@@ -27,4 +37,21 @@ def text_to_base64(text):
     # Convert the result back to a UTF-8 string representation
     base64_text = base64_encoded.decode('utf-8')
 
-    return base64_text
\ No newline at end of file
+    return base64_text
+
+
+def index_generation() -> str:
+    """
+    Marker of the last index rebuild, caches of retrieval results compare it to detect stale entries
+    """
+    try:
+        return (CACHE_DIR / "index_generation").read_text()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_index_generation() -> str:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    generation = str(time.time_ns())
+    (CACHE_DIR / "index_generation").write_text(generation)
+    return generation
@@ -0,0 +1,597 @@
+import os
+import re
+import json
+import heapq
+from pathlib import Path
+import numpy as np
+import rag_demos.utils as U
+import rag_demos.settings as S
+
+log = U.get_logger(__name__)
+
+# the store lives in VECTOR_STORE_PATH unless a path is given
+__getattr__ = S.lazy_constants(__name__, {"DEFAULT_PATH": "vector_store_path"})
+
+# modes of VectorStore.search that scan compressed vectors and rescore the best candidates in full precision
+COMPRESSED_MODES = ("scalar", "binary")
+# rows scanned per block when scoring compressed vectors, bounds the float32 scratch memory
+SCAN_BLOCK_ROWS = 8192
+
+# same retrievable fields as zakon_index.index_payload, chunkVector lives in the matrix
+DOC_FIELDS = ("id", "ParentKey", "title", "name", "location", "chapter", "article", "chunk")
+FILTERABLE_FIELDS = ("ParentKey", "title", "chapter", "article")
+# indexes built from the vectors and chunks on first use, deleted when the store is rewritten
+DERIVED_FILES = ("hnsw_M*.npz", "compressed_*.npz", "bm25.npz", "bm25_vocab.json")
+
+
+def _normalize(v):
+    v = np.asarray(v, dtype=np.float32)
+    norm = np.linalg.norm(v, axis=-1, keepdims=True)
+    return v / np.where(norm == 0, 1, norm)
+
+
+class VectorStoreWriter:
+    """
+    Stream documents with a chunkVector into a local vector store directory.
+    Vectors are normalized and appended to a raw float32 file, so building uses constant memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or S.get_settings().vector_store_path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.count = 0
+        self.dimensions = None
+        self._vectors = open(self.path / "vectors.f32.tmp", "wb")
+        self._docs = open(self.path / "docs.jsonl.tmp", "w", encoding="utf-8")
+
+    def add(self, doc):
+        vector = _normalize(doc["chunkVector"])
+        if self.dimensions is None:
+            self.dimensions = vector.shape[0]
+        elif vector.shape[0] != self.dimensions:
+            raise Exception(f"Vector of {doc['id']} has {vector.shape[0]} dimensions, expected {self.dimensions}")
+        self._vectors.write(vector.tobytes())
+        self._docs.write(json.dumps({f: doc.get(f) for f in DOC_FIELDS}, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self):
+        self._vectors.close()
+        self._docs.close()
+        os.replace(self.path / "vectors.f32.tmp", self.path / "vectors.f32")
+        os.replace(self.path / "docs.jsonl.tmp", self.path / "docs.jsonl")
+        for pattern in DERIVED_FILES:
+            for stale in self.path.glob(pattern):
+                stale.unlink()
+        with open(self.path / "meta.json", "w") as f:
+            json.dump({"count": self.count, "dimensions": self.dimensions}, f)
+        log.info(f"Wrote {self.count} vectors to {self.path}")
+
+    def abort(self):
+        """
+        Drop what was written and leave the existing store untouched
+        """
+        self._vectors.close()
+        self._docs.close()
+        for name in ("vectors.f32.tmp", "docs.jsonl.tmp"):
+            (self.path / name).unlink(missing_ok=True)
+        log.warning(f"Discarded {self.count} vectors, {self.path} is unchanged")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # an error, or a consumer of tee_to_store stopping early (GeneratorExit), must not replace a good store
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def tee_to_store(documents, path=None):
+    """
+    Pass documents through unchanged while writing them to a local vector store.
+    The store is only replaced once all documents went through.
+    """
+    with VectorStoreWriter(path) as writer:
+        for doc in documents:
+            writer.add(doc)
+            yield doc
+
+
+_FILTER_TOKEN = re.compile(r"\s*(?:(\()|(\))|(,)|'((?:[^']|'')*)'|([A-Za-z_][\w.]*))")
+
+
+def _tokenize_filter(fltr):
+    pos, tokens = 0, []
+    fltr = fltr.strip()
+    while pos < len(fltr):
+        m = _FILTER_TOKEN.match(fltr, pos)
+        if not m:
+            raise Exception(f"Unsupported filter syntax at: {fltr[pos:]}")
+        lpar, rpar, comma, string, word = m.groups()
+        if string is not None:
+            tokens.append(("str", string.replace("''", "'")))
+        else:
+            tokens.append(("op", lpar or rpar or comma or word))
+        pos = m.end()
+    return tokens
+
+
+class _FilterParser:
+    """
+    Recursive-descent parser for the subset of OData used in `filter`:
+    `field eq 'v'`, `field ne 'v'`, `search.in(field, 'a,b', ',')`, `not`, `and`, `or` and parentheses.
+    """
+
+    def __init__(self, fltr, columns):
+        self.tokens = _tokenize_filter(fltr)
+        self.pos = 0
+        self.columns = columns
+
+    def _next(self):
+        tok = self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+        self.pos += 1
+        return tok
+
+    def _peek(self):
+        return self.tokens[self.pos][1] if self.pos < len(self.tokens) else None
+
+    def _expect(self, value):
+        _, v = self._next()
+        if v != value:
+            raise Exception(f"Expected {value} in filter, got {v}")
+
+    def _column(self, name):
+        if name not in self.columns:
+            raise Exception(f"Field {name} is not filterable, use one of {FILTERABLE_FIELDS}")
+        return self.columns[name]
+
+    def parse(self):
+        mask = self._or()
+        if self.pos != len(self.tokens):
+            raise Exception(f"Unexpected token in filter: {self._peek()}")
+        return mask
+
+    def _or(self):
+        mask = self._and()
+        while self._peek() == "or":
+            self.pos += 1
+            mask = mask | self._and()
+        return mask
+
+    def _and(self):
+        mask = self._not()
+        while self._peek() == "and":
+            self.pos += 1
+            mask = mask & self._not()
+        return mask
+
+    def _not(self):
+        if self._peek() == "not":
+            self.pos += 1
+            return ~self._not()
+        return self._atom()
+
+    def _atom(self):
+        kind, value = self._next()
+        if value == "(":
+            mask = self._or()
+            self._expect(")")
+            return mask
+        if value == "search.in":
+            self._expect("(")
+            column = self._column(self._next()[1])
+            self._expect(",")
+            values = self._next()[1]
+            sep = ","
+            if self._peek() == ",":
+                self.pos += 1
+                sep = self._next()[1]
+            self._expect(")")
+            return np.isin(column, [v.strip() for v in values.split(sep)])
+        column = self._column(value)
+        _, op = self._next()
+        kind, literal = self._next()
+        if kind != "str" and literal != "null":
+            raise Exception(f"Only string literals are supported in filter, got {literal}")
+        literal = None if kind != "str" else literal
+        if op == "eq":
+            return column == literal
+        if op == "ne":
+            return column != literal
+        raise Exception(f"Unsupported filter operator {op}")
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph over normalized vectors, for approximate inner product search.
+    The graph is stored as one padded int32 neighbour matrix per layer (-1 = no neighbour).
+    """
+
+    def __init__(self, vectors, M=16, ef_construction=100, seed=42, layers=None, entry_point=None, levels=None):
+        self.vectors = vectors
+        self.M = M
+        self.ef_construction = ef_construction
+        self.layers = layers
+        self.entry_point = entry_point
+        self.levels = levels
+        if layers is None:
+            self._build(seed)
+
+    def _build(self, seed):
+        n = self.vectors.shape[0]
+        rng = np.random.default_rng(seed)
+        self.levels = np.floor(-np.log(rng.random(n)) / np.log(self.M)).astype(np.int32)
+        top = int(self.levels.max()) if n else 0
+        self.layers = [np.full((n, 2 * self.M if l == 0 else self.M), -1, dtype=np.int32) for l in range(top + 1)]
+        self.entry_point = -1
+        for i in range(n):
+            self._insert(i)
+        log.info(f"Built HNSW graph over {n} vectors with {top + 1} layers (M={self.M})")
+
+    def _neighbours(self, layer, node):
+        row = self.layers[layer][node]
+        return row[row >= 0]
+
+    def _search_layer(self, q, entry_points, ef, layer):
+        visited = set(entry_points)
+        sims = self.vectors[entry_points] @ q
+        candidates = [(-s, e) for s, e in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        best = [(s, e) for s, e in zip(sims, entry_points)]
+        heapq.heapify(best)
+        while candidates:
+            neg_sim, c = heapq.heappop(candidates)
+            if -neg_sim < best[0][0] and len(best) >= ef:
+                break
+            nbrs = [n for n in self._neighbours(layer, c) if n not in visited]
+            if not nbrs:
+                continue
+            visited.update(nbrs)
+            for s, n in zip(self.vectors[nbrs] @ q, nbrs):
+                if len(best) < ef or s > best[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(best, (s, n))
+                    if len(best) > ef:
+                        heapq.heappop(best)
+        return sorted(best, reverse=True)
+
+    def _select(self, node, candidates, m):
+        # keep the m most similar candidates; the diversity heuristic does not pay off at our corpus size
+        return [c for _, c in candidates if c != node][:m]
+
+    def _connect(self, layer, node, nbrs):
+        row = self.layers[layer][node]
+        row[:] = -1
+        row[:len(nbrs)] = nbrs
+        width = row.shape[0]
+        for n in nbrs:
+            nrow = self.layers[layer][n]
+            current = nrow[nrow >= 0]
+            if node in current:
+                continue
+            if len(current) < width:
+                nrow[len(current)] = node
+            else:
+                pool = np.append(current, node)
+                sims = self.vectors[pool] @ self.vectors[n]
+                keep = pool[np.argsort(-sims)[:width]]
+                nrow[:] = keep
+
+    def _insert(self, i):
+        q = self.vectors[i]
+        level = self.levels[i]
+        if self.entry_point < 0:
+            self.entry_point = i
+            return
+        ep = [self.entry_point]
+        top = int(self.levels[self.entry_point])
+        for layer in range(top, level, -1):
+            ep = [self._search_layer(q, ep, 1, layer)[0][1]]
+        for layer in range(min(level, top), -1, -1):
+            found = self._search_layer(q, ep, self.ef_construction, layer)
+            self._connect(layer, i, self._select(i, found, self.M))
+            ep = [c for _, c in found]
+        if level > top:
+            self.entry_point = i
+
+    def search(self, q, k, ef=64):
+        if self.entry_point < 0:
+            return []
+        ep = [self.entry_point]
+        for layer in range(int(self.levels[self.entry_point]), 0, -1):
+            ep = [self._search_layer(q, ep, 1, layer)[0][1]]
+        return self._search_layer(q, ep, max(ef, k), 0)[:k]
+
+    def save(self, path):
+        np.savez(path, entry_point=self.entry_point, levels=self.levels, M=self.M,
+                 ef_construction=self.ef_construction, **{f"layer{l}": a for l, a in enumerate(self.layers)})
+
+    @classmethod
+    def load(cls, path, vectors):
+        z = np.load(path)
+        layers = [z[f"layer{l}"] for l in range(len([k for k in z.files if k.startswith("layer")]))]
+        return cls(vectors, M=int(z["M"]), ef_construction=int(z["ef_construction"]), layers=layers,
+                   entry_point=int(z["entry_point"]), levels=z["levels"])
+
+
+# number of set bits of every byte value, for Hamming distances of packed binary codes
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+class CompressedVectors:
+    """
+    Quantized copy of the store's vectors, optionally truncated to their leading dimensions (text-embedding-3 models
+    keep most of their quality when truncated and renormalized), mirroring the compressions of zakon_index:
+    scalar is one int8 per dimension with a per-dimension scale, binary is the sign bit of every dimension.
+    Only the codes are kept in memory, candidates are rescored against the memory-mapped float32 vectors.
+    """
+
+    def __init__(self, kind, codes, scale=None, truncate=None):
+        if kind not in COMPRESSED_MODES:
+            raise Exception(f"Unknown vector compression {kind}, use one of {COMPRESSED_MODES}")
+        self.kind = kind
+        self.codes = codes
+        self.scale = scale
+        self.truncate = truncate
+
+    @staticmethod
+    def _prepare(vectors, truncate):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return _normalize(vectors[:, :truncate]) if truncate else vectors
+
+    @classmethod
+    def build(cls, vectors, kind, truncate=None):
+        n = vectors.shape[0]
+        dims = truncate or vectors.shape[1]
+        if kind == "scalar":
+            scale = np.full(dims, 1e-12, dtype=np.float32)
+            for start in range(0, n, SCAN_BLOCK_ROWS):
+                block = cls._prepare(vectors[start:start + SCAN_BLOCK_ROWS], truncate)
+                scale = np.maximum(scale, np.abs(block).max(axis=0) / 127)
+            codes = np.empty((n, dims), dtype=np.int8)
+        else:
+            scale = None
+            codes = np.empty((n, (dims + 7) // 8), dtype=np.uint8)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            block = cls._prepare(vectors[start:start + SCAN_BLOCK_ROWS], truncate)
+            if kind == "scalar":
+                codes[start:start + len(block)] = np.clip(np.rint(block / scale), -127, 127)
+            else:
+                codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+        log.info(f"Compressed {n} vectors to {kind} codes of {dims} dimensions ({codes.nbytes // 1024} KiB)")
+        return cls(kind, codes, scale, truncate)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def scores(self, queries, rows=None):
+        """
+        Approximate similarities of normalized queries to all (or the given) rows, shape (n_queries, n_rows)
+        """
+        queries = self._prepare(queries, self.truncate)
+        n = self.codes.shape[0] if rows is None else len(rows)
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        if self.kind == "scalar":
+            queries = queries * self.scale
+        else:
+            bits = queries.shape[1]
+            queries = np.packbits(queries > 0, axis=1)
+        for start in range(0, n, SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, n)
+            block = self.codes[start:stop] if rows is None else self.codes[rows[start:stop]]
+            if self.kind == "scalar":
+                scores[:, start:stop] = queries @ block.T.astype(np.float32)
+            else:
+                for qi, q in enumerate(queries):
+                    scores[qi, start:stop] = bits - 2 * _POPCOUNT[block ^ q].sum(axis=1, dtype=np.float32)
+        return scores
+
+    def save(self, path):
+        np.savez(path, kind=self.kind, codes=self.codes, truncate=self.truncate or 0,
+                 **({"scale": self.scale} if self.scale is not None else {}))
+
+    @classmethod
+    def load(cls, path):
+        z = np.load(path)
+        return cls(str(z["kind"]), z["codes"], z["scale"] if "scale" in z.files else None, int(z["truncate"]) or None)
+
+
+class VectorStore:
+    """
+    Local copy of the chunk / chunkVector data of zakon-index.
+    Vectors are a memory-mapped float32 matrix of normalized rows, so cosine similarity is a dot product.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or S.get_settings().vector_store_path)
+        with open(self.path / "meta.json") as f:
+            meta = json.load(f)
+        self.vectors = np.memmap(self.path / "vectors.f32", dtype=np.float32, mode="r",
+                                 shape=(meta["count"], meta["dimensions"]))
+        with open(self.path / "docs.jsonl", encoding="utf-8") as f:
+            self.docs = [json.loads(line) for line in f]
+        self.columns = {field: np.array([d.get(field) for d in self.docs], dtype=object) for field in FILTERABLE_FIELDS}
+        self._hnsw = None
+        self._compressed = {}
+        log.info(f"Loaded {len(self.docs)} vectors from {self.path}")
+
+    def __len__(self):
+        return len(self.docs)
+
+    def filter_mask(self, fltr):
+        """
+        Boolean mask of the documents matching an OData filter on the FILTERABLE_FIELDS
+        """
+        if not fltr:
+            return None
+        return _FilterParser(fltr, self.columns).parse()
+
+    def hnsw(self, M=16, ef_construction=100):
+        """
+        The approximate index, loaded from disk or built (and saved) on first use
+        """
+        if self._hnsw is None or self._hnsw.M != M:
+            graph = self.path / f"hnsw_M{M}.npz"
+            self._hnsw = HNSWIndex.load(graph, self.vectors) if graph.exists() else None
+            if self._hnsw is None or len(self._hnsw.levels) != len(self.docs):
+                # missing, or left over from a store written before stale graphs were deleted
+                self._hnsw = HNSWIndex(np.asarray(self.vectors), M=M, ef_construction=ef_construction)
+                self._hnsw.save(graph)
+        return self._hnsw
+
+    def compressed(self, kind, truncate=None):
+        """
+        The quantized vectors, loaded from disk or built (and saved) on first use
+        """
+        key = (kind, truncate)
+        if key not in self._compressed:
+            path = self.path / f"compressed_{kind}_{truncate or self.vectors.shape[1]}.npz"
+            codes = CompressedVectors.load(path) if path.exists() else None
+            if codes is None or codes.codes.shape[0] != len(self.docs):
+                codes = CompressedVectors.build(self.vectors, kind, truncate)
+                codes.save(path)
+            self._compressed[key] = codes
+        return self._compressed[key]
+
+    def _exact(self, queries, k, mask):
+        if mask is None:
+            scores = queries @ self.vectors.T
+            rows = np.arange(len(self.docs))
+        else:
+            rows = np.flatnonzero(mask)
+            scores = queries @ self.vectors[rows].T
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for qi, idx in enumerate(top):
+            idx = idx[np.argsort(-scores[qi, idx])]
+            results.append([(float(scores[qi, j]), int(rows[j])) for j in idx])
+        return results
+
+    def _approximate(self, queries, k, mask, ef, M):
+        index = self.hnsw(M=M)
+        results = []
+        for q in queries:
+            if mask is None:
+                hits = index.search(q, k, ef)
+            else:
+                hits = [(s, i) for s, i in index.search(q, max(ef, k), max(ef, k)) if mask[i]][:k]
+                if len(hits) < k:
+                    # the filter removed too many neighbours, answer exactly on the filtered subset
+                    hits = self._exact(q[None, :], k, mask)[0]
+            results.append([(float(s), int(i)) for s, i in hits])
+        return results
+
+    def _compressed_search(self, queries, k, mask, kind, truncate, oversampling):
+        compressed = self.compressed(kind, truncate)
+        rows = None if mask is None else np.flatnonzero(mask)
+        scores = compressed.scores(queries, rows)
+        candidates = min(scores.shape[1], max(k, int(k * oversampling)))
+        if candidates == 0:
+            return [[] for _ in range(len(queries))]
+        if not oversampling:
+            return [[(float(scores[qi, j]), int(j if rows is None else rows[j])) for j in idx]
+                    for qi, idx in enumerate(np.argsort(-scores, axis=1)[:, :k])]
+        top = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+        results = []
+        for q, idx in zip(queries, top):
+            idx = np.sort(idx if rows is None else rows[idx])  # sorted rows read the memmap sequentially
+            full = self.vectors[idx] @ q
+            best = np.argsort(-full)[:k]
+            results.append([(float(full[j]), int(idx[j])) for j in best])
+        return results
+
+    def search(self, query_vectors, k=5, filter=None, mode="exact", ef=64, M=16, truncate=None, oversampling=4):
+        """
+        Top-k cosine search for one or a batch of query vectors
+        :param query_vectors: Vector of shape (d,) or matrix of shape (n, d)
+        :param k: Number of results per query
+        :param filter: OData filter on the FILTERABLE_FIELDS, as in the `filter` of the data source
+        :param mode: exact for a brute force NumPy scan, hnsw for the approximate graph search,
+            scalar / binary for a scan of int8 / 1-bit codes with full-precision rescoring
+        :param ef: Size of the dynamic candidate list in hnsw mode
+        :param M: Graph degree in hnsw mode
+        :param truncate: Leading dimensions kept in the codes of the scalar / binary modes, all by default
+        :param oversampling: Candidates per result rescored in the scalar / binary modes, 0 to skip rescoring
+        :return: List (or list of lists for a batch) of documents with @search.score
+        """
+        single = np.ndim(query_vectors) == 1
+        queries = _normalize(np.atleast_2d(query_vectors))
+        mask = self.filter_mask(filter)
+        if mode == "exact":
+            hits = self._exact(queries, k, mask)
+        elif mode == "hnsw":
+            hits = self._approximate(queries, k, mask, ef, M)
+        elif mode in COMPRESSED_MODES:
+            hits = self._compressed_search(queries, k, mask, mode, truncate, oversampling)
+        else:
+            raise Exception(f"Unknown search mode {mode}")
+        results = [[{**self.docs[i], "@search.score": s} for s, i in row] for row in hits]
+        return results[0] if single else results
+
+
+def _recall(hits, truth):
+    return float(np.mean([len({i for _, i in h} & {i for _, i in t}) / max(len(t), 1) for h, t in zip(hits, truth)]))
+
+
+def compression_report(store, queries=None, k=10, n_queries=200, oversampling=4, truncations=(None, 512, 256),
+                       seed=42):
+    """
+    Recall@k against the exact full-precision search and resident vector memory for every compression
+    :param store: VectorStore
+    :param queries: Matrix of query vectors; by default midpoints of random pairs of stored vectors,
+        which are close to the corpus like real questions without being one of its rows
+    :param truncations: Truncated dimensions to try besides the compression kinds, None for all dimensions
+    :return: List of dicts with mode, dimensions, bytes_per_vector, memory_kb, compression_ratio,
+        recall (codes only), recall_rescored and ms_per_query (with rescoring)
+    """
+    import time
+    n, d = store.vectors.shape
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        pairs = rng.integers(0, n, size=(n_queries, 2))
+        queries = store.vectors[pairs[:, 0]] + store.vectors[pairs[:, 1]]
+    queries = _normalize(np.atleast_2d(queries))
+    started = time.perf_counter()
+    truth = store._exact(queries, k, None)
+    rows = [{"mode": "exact", "dimensions": d, "bytes_per_vector": 4 * d, "memory_kb": round(4 * n * d / 1024, 1),
+             "compression_ratio": 1.0, "recall": 1.0, "recall_rescored": 1.0,
+             "ms_per_query": round(1000 * (time.perf_counter() - started) / len(queries), 3)}]
+    for truncate in truncations:
+        if truncate and truncate >= d:
+            continue
+        for kind in COMPRESSED_MODES:
+            compressed = store.compressed(kind, truncate)
+            codes_only = store._compressed_search(queries, k, None, kind, truncate, 0)
+            started = time.perf_counter()
+            rescored = store._compressed_search(queries, k, None, kind, truncate, oversampling)
+            elapsed = time.perf_counter() - started
+            rows.append({"mode": kind, "dimensions": truncate or d,
+                         "bytes_per_vector": round(compressed.codes.nbytes / n, 1),
+                         "memory_kb": round(compressed.nbytes / 1024, 1),
+                         "compression_ratio": round(4 * n * d / compressed.nbytes, 1),
+                         "recall": round(_recall(codes_only, truth), 4),
+                         "recall_rescored": round(_recall(rescored, truth), 4),
+                         "ms_per_query": round(1000 * elapsed / len(queries), 3)})
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Recall vs memory of the vector compressions on a local store")
+    parser.add_argument("--path", default=S.get_settings().vector_store_path)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--oversampling", type=float, default=4)
+    parser.add_argument("--truncate", type=int, nargs="*", default=[512, 256])
+    args = parser.parse_args()
+    report = compression_report(VectorStore(args.path), k=args.k, n_queries=args.queries,
+                                oversampling=args.oversampling, truncations=[None] + args.truncate)
+    columns = list(report[0])
+    print("  ".join(f"{c:>17}" for c in columns))
+    for row in report:
+        print("  ".join(f"{row[c]:>17}" for c in columns))
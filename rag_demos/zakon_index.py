@@ -1,271 +1,512 @@
-import os
-from dotenv import load_dotenv
+import json
 import rag_demos.utils as U
+import rag_demos.settings as S
 import rag_demos.index_helpers as IH
 
-load_dotenv()
 log = U.get_logger(__name__)
 
 # Name of the container in your Blob Storage Datasource ( in credentials.env)
 BLOB_CONTAINER_NAME = "zakonodaja"
 
-DATASOURCE_NAME = "zakon-files" + "-" + os.environ['ENVIRONMENT']
-INDEX_NAME = "zakon-index" + "-" + os.environ['ENVIRONMENT']
-SKILLSET_NAME = "zakon-skillset" + "-" + os.environ['ENVIRONMENT']
-INDEXER_NAME = "zakon-indexer" + "-" + os.environ['ENVIRONMENT']
-
-datasource_payload = {
-    "name": DATASOURCE_NAME,
-    "description": "Demo files to demonstrate cognitive search capabilities.",
-    "type": "azureblob",
-    "credentials": {
-        "connectionString": os.environ['BLOB_CONNECTION_STRING']
-    },
-    "dataDeletionDetectionPolicy" : {
-        "@odata.type" :"#Microsoft.Azure.Search.NativeBlobSoftDeleteDeletionDetectionPolicy" # this makes sure that if the item is deleted from the source, it will be deleted from the index
-    },
-    "container": {
-        "name": BLOB_CONTAINER_NAME
+
+def _object_name(base):
+    return base + "-" + S.get_settings().environment
+
+
+def datasource_name():
+    return _object_name("zakon-files")
+
+
+def base_index_name():
+    return _object_name("zakon-index")
+
+
+def skillset_name():
+    return _object_name("zakon-skillset")
+
+
+def indexer_name():
+    return _object_name("zakon-indexer")
+
+
+# the index can be rebuilt under a versioned name (see reconcile_all); the name in use is kept in this file
+INDEX_STATE_PATH = U.CACHE_DIR / "index_state.json"
+
+
+def _read_index_state():
+    try:
+        with open(INDEX_STATE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_index_state(state):
+    global _current_index_name
+    INDEX_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(INDEX_STATE_PATH, "w") as f:
+        json.dump(state, f)
+    # this process made the swap, so it follows it
+    _current_index_name = state[base_index_name()]
+
+
+def active_index_name():
+    return _read_index_state().get(base_index_name(), base_index_name())
+
+
+_current_index_name = None
+
+
+def current_index_name():
+    """
+    The active index name as of the first call, kept for the life of the process like the chat app expects.
+    A rebuild in this process switches it to the new index.
+    """
+    global _current_index_name
+    if _current_index_name is None:
+        _current_index_name = active_index_name()
+    return _current_index_name
+
+
+# chunking parameters, shared by the SplitSkill and the local ingestion pipeline
+CHUNK_MAX_LENGTH = 5000  # 5000 characters is default and a good choice
+CHUNK_OVERLAP = 750  # 15% overlap among chunks
+# settings read when a payload is built (see Settings):
+# CHUNKER, the chunker of the local ingestion pipeline: "fixed" like the SplitSkill, or "legal" for one chunk per
+#   article (see legal_chunker), which also fills the chapter and article fields
+# VECTOR_COMPRESSION of chunkVector in the index: "" (full precision), "scalar" (int8) or "binary" (1 bit per dimension)
+# VECTOR_TRUNCATE_DIMENSIONS, keep only the first n dimensions of the compressed vectors (text-embedding-3 models),
+#   needs API 2024-09-01-preview+
+# VECTOR_OVERSAMPLING, candidates per requested result scored on the compressed vectors before rescoring with the
+#   originals
+_SETTINGS_ATTRIBUTES = {"CHUNKER": "chunker", "VECTOR_COMPRESSION": "vector_compression",
+                        "VECTOR_TRUNCATE_DIMENSIONS": "vector_truncate_dimensions",
+                        "VECTOR_OVERSAMPLING": "vector_oversampling"}
+COMPRESSION_NAME = "mycompression"
+
+
+def datasource_payload_for():
+    """
+    Definition of the blob datasource
+    """
+    settings = S.get_settings()
+    return {
+        "name": datasource_name(),
+        "description": "Demo files to demonstrate cognitive search capabilities.",
+        "type": "azureblob",
+        "credentials": {
+            "connectionString": settings.blob_connection_string
+        },
+        "dataDeletionDetectionPolicy" : {
+            "@odata.type" :"#Microsoft.Azure.Search.NativeBlobSoftDeleteDeletionDetectionPolicy" # this makes sure that if the item is deleted from the source, it will be deleted from the index
+        },
+        "container": {
+            "name": BLOB_CONTAINER_NAME
+        }
     }
-}
 
-index_payload = {
-    "name": INDEX_NAME,
-    "vectorSearch": {
-        "algorithms": [
-            {
-                "name": "myalgo",
-                "kind": "hnsw"
-            }
-        ],
-        "vectorizers": [
-            {
-                "name": "openai",
-                "kind": "azureOpenAI",
-                "azureOpenAIParameters":
-                    {
-                        "resourceUri": os.environ['AZURE_OPENAI_ENDPOINT'],
-                        "apiKey": os.environ['AZURE_OPENAI_API_KEY'],
-                        "deploymentId": os.environ['EMBEDDING_DEPLOYMENT_NAME'],
-                        "modelName": os.environ['EMBEDDING_DEPLOYMENT_NAME'],
 
+def compressions_for(kind=None, truncate=None, oversampling=None):
+    """
+    The vectorSearch compressions of the index, empty for full-precision vectors
+    :param kind: "scalar", "binary" or "" for none, VECTOR_COMPRESSION by default
+    :param truncate: Number of leading dimensions to keep, VECTOR_TRUNCATE_DIMENSIONS by default
+    :param oversampling: Default oversampling of the rescoring step, VECTOR_OVERSAMPLING by default
+    """
+    settings = S.get_settings()
+    kind = settings.vector_compression if kind is None else kind
+    truncate = settings.vector_truncate_dimensions if truncate is None else truncate
+    oversampling = settings.vector_oversampling if oversampling is None else oversampling
+    if not kind:
+        if truncate:
+            raise Exception("VECTOR_TRUNCATE_DIMENSIONS needs a VECTOR_COMPRESSION, only compressed vectors are truncated")
+        return []
+    if kind not in ("scalar", "binary"):
+        raise Exception(f"Unknown vector compression {kind}, use scalar or binary")
+    compression = {
+        "name": COMPRESSION_NAME,
+        "kind": "scalarQuantization" if kind == "scalar" else "binaryQuantization",
+        "rerankWithOriginalVectors": True,  # rescore the oversampled candidates with the full-precision vectors
+        "defaultOversampling": oversampling,
+    }
+    if kind == "scalar":
+        compression["scalarQuantizationParameters"] = {"quantizedDataType": "int8"}
+    if truncate:
+        compression["truncationDimension"] = truncate
+    return [compression]
+
+
+def index_payload_for(index=None):
+    """
+    Definition of the index, under the active index name by default
+    """
+    settings = S.get_settings()
+    compressions = compressions_for()
+    profile = {"name": "myprofile", "algorithm": "myalgo", "vectorizer": "openai"}
+    if compressions:
+        profile["compression"] = COMPRESSION_NAME
+    return {
+        "name": index or current_index_name(),
+        "vectorSearch": {
+            "algorithms": [
+                {
+                    "name": "myalgo",
+                    "kind": "hnsw"
+                }
+            ],
+            "vectorizers": [
+                {
+                    "name": "openai",
+                    "kind": "azureOpenAI",
+                    "azureOpenAIParameters":
+                        {
+                            "resourceUri": settings.openai_endpoint,
+                            "apiKey": settings.openai_key,
+                            "deploymentId": settings.embedding_deployment,
+                            "modelName": settings.embedding_deployment,
+
+                        }
+                }
+            ],
+            "compressions": compressions,
+            "profiles": [profile]
+        },
+        "semantic": {
+            "configurations": [
+                {
+                    "name": "my-semantic-config",
+                    "prioritizedFields": {
+                        "titleField": {
+                            "fieldName": "title"
+                        },
+                        "prioritizedContentFields": [
+                            {
+                                "fieldName": "chunk"
+                            }
+                        ],
+                        "prioritizedKeywordsFields": []
                     }
-            }
-        ],
-        "profiles": [
+                }
+            ]
+        },
+        "fields": [
+            {"name": "id", "type": "Edm.String", "key": "true", "analyzer": "keyword", "searchable": "true",
+             "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
+            {"name": "ParentKey", "type": "Edm.String", "searchable": "true", "retrievable": "true",
+             "facetable": "false", "filterable": "true", "sortable": "false"},
+            {"name": "title", "type": "Edm.String", "searchable": "true", "retrievable": "true", "facetable": "false",
+             "filterable": "true", "sortable": "false"},
+            {"name": "name", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
+             "filterable": "false", "facetable": "false"},
+            {"name": "location", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
+             "filterable": "false", "facetable": "false"},
+            {"name": "chapter", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
+             "filterable": "true", "facetable": "false"},
+            {"name": "article", "type": "Edm.String", "searchable": "false", "retrievable": "true", "sortable": "false",
+             "filterable": "true", "facetable": "false"},
+            {"name": "chunk", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
+             "filterable": "false", "facetable": "false"},
+
             {
-                "name": "myprofile",
-                "algorithm": "myalgo",
-                "vectorizer": "openai"
+                "name": "chunkVector",
+                "type": "Collection(Edm.Single)",
+                "dimensions": settings.embedding_dimensions,  # IMPORTANT: Make sure these dimmensions match your embedding model name
+                "vectorSearchProfile": "myprofile",
+                "searchable": "true",
+                "retrievable": "true",
+                "filterable": "false",
+                "sortable": "false",
+                "facetable": "false"
             }
         ]
-    },
-    "semantic": {
-        "configurations": [
-            {
-                "name": "my-semantic-config",
-                "prioritizedFields": {
-                    "titleField": {
-                        "fieldName": "title"
-                    },
-                    "prioritizedContentFields": [
+    }
+
+
+def skillset_payload_for(index=None):
+    """
+    Definition of the skillset, projecting chunks into the active index by default
+    """
+    settings = S.get_settings()
+    return {
+        "name": skillset_name(),
+        "description": "e2e Skillset for RAG - Files",
+        "skills":
+            [
+                {
+                    "@odata.type": "#Microsoft.Skills.Text.SplitSkill",
+                    "context": "/document",
+                    "textSplitMode": "pages",  # although it says "pages" it actally means chunks, not actual pages
+                    "maximumPageLength": CHUNK_MAX_LENGTH,
+                    "pageOverlapLength": CHUNK_OVERLAP,
+                    "defaultLanguageCode": "en",
+                    "inputs": [
                         {
-                            "fieldName": "chunk"
+                            "name": "text",
+                            "source": "/document/content"
                         }
                     ],
-                    "prioritizedKeywordsFields": []
+                    "outputs": [
+                        {
+                            "name": "textItems",
+                            "targetName": "chunks"
+                        }
+                    ]
+                },
+                {
+                    "@odata.type": "#Microsoft.Skills.Text.AzureOpenAIEmbeddingSkill",
+                    "description": "Azure OpenAI Embedding Skill",
+                    "context": "/document/chunks/*",
+                    "resourceUri": settings.openai_endpoint,
+                    "apiKey": settings.openai_key,
+                    "deploymentId": settings.embedding_deployment,
+                    "modelName": settings.embedding_deployment,
+                    "inputs": [
+                        {
+                            "name": "text",
+                            "source": "/document/chunks/*"
+                        }
+                    ],
+                    "outputs": [
+                        {
+                            "name": "embedding",
+                            "targetName": "vector"
+                        }
+                    ]
+                }
+            ],
+        "indexProjections": {
+            "selectors": [
+                {
+                    "targetIndexName": index or current_index_name(),
+                    "parentKeyFieldName": "ParentKey",
+                    "sourceContext": "/document/chunks/*",
+                    "mappings": [
+                        {
+                            "name": "title",
+                            "source": "/document/title"
+                        },
+                        {
+                            "name": "name",
+                            "source": "/document/name"
+                        },
+                        {
+                            "name": "location",
+                            "source": "/document/location"
+                        },
+                        {
+                            "name": "chunk",
+                            "source": "/document/chunks/*"
+                        },
+                        {
+                            "name": "chunkVector",
+                            "source": "/document/chunks/*/vector"
+                        }
+                    ]
                 }
+            ],
+            "parameters": {
+                "projectionMode": "skipIndexingParentDocuments"
             }
-        ]
-    },
-    "fields": [
-        {"name": "id", "type": "Edm.String", "key": "true", "analyzer": "keyword", "searchable": "true",
-         "retrievable": "true", "sortable": "false", "filterable": "false", "facetable": "false"},
-        {"name": "ParentKey", "type": "Edm.String", "searchable": "true", "retrievable": "true",
-         "facetable": "false", "filterable": "true", "sortable": "false"},
-        {"name": "title", "type": "Edm.String", "searchable": "true", "retrievable": "true", "facetable": "false",
-         "filterable": "true", "sortable": "false"},
-        {"name": "name", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
-         "filterable": "false", "facetable": "false"},
-        {"name": "location", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
-         "filterable": "false", "facetable": "false"},
-        {"name": "chunk", "type": "Edm.String", "searchable": "true", "retrievable": "true", "sortable": "false",
-         "filterable": "false", "facetable": "false"},
-
-        {
-            "name": "chunkVector",
-            "type": "Collection(Edm.Single)",
-            "dimensions": int(os.environ['EMBEDDING_DIMENSIONS']),  # IMPORTANT: Make sure these dimmensions match your embedding model name
-            "vectorSearchProfile": "myprofile",
-            "searchable": "true",
-            "retrievable": "true",
-            "filterable": "false",
-            "sortable": "false",
-            "facetable": "false"
         }
-    ]
-}
-
+    }
 
 
-skillset_payload = {
-    "name": SKILLSET_NAME,
-    "description": "e2e Skillset for RAG - Files",
-    "skills":
-        [
+def indexer_payload_for(index=None):
+    """
+    Definition of the indexer, populating the active index by default
+    """
+    settings = S.get_settings()
+    return {
+        "name": indexer_name(),
+        "dataSourceName": datasource_name(),
+        "targetIndexName": index or current_index_name(),
+        "skillsetName": skillset_name(),
+        "schedule": {"interval": "PT30M"},  # How often do you want to check for new content in the data source
+        "fieldMappings": [
             {
-                "@odata.type": "#Microsoft.Skills.Text.SplitSkill",
-                "context": "/document",
-                "textSplitMode": "pages",  # although it says "pages" it actally means chunks, not actual pages
-                "maximumPageLength": 5000,  # 5000 characters is default and a good choice
-                "pageOverlapLength": 750,  # 15% overlap among chunks
-                "defaultLanguageCode": "en",
-                "inputs": [
-                    {
-                        "name": "text",
-                        "source": "/document/content"
-                    }
-                ],
-                "outputs": [
-                    {
-                        "name": "textItems",
-                        "targetName": "chunks"
-                    }
-                ]
+                "sourceFieldName": "metadata_title",
+                "targetFieldName": "title"
             },
             {
-                "@odata.type": "#Microsoft.Skills.Text.AzureOpenAIEmbeddingSkill",
-                "description": "Azure OpenAI Embedding Skill",
-                "context": "/document/chunks/*",
-                "resourceUri": os.environ['AZURE_OPENAI_ENDPOINT'],
-                "apiKey": os.environ['AZURE_OPENAI_API_KEY'],
-                "deploymentId": os.environ['EMBEDDING_DEPLOYMENT_NAME'],
-                "modelName": os.environ['EMBEDDING_DEPLOYMENT_NAME'],
-                "inputs": [
-                    {
-                        "name": "text",
-                        "source": "/document/chunks/*"
-                    }
-                ],
-                "outputs": [
-                    {
-                        "name": "embedding",
-                        "targetName": "vector"
-                    }
-                ]
+                "sourceFieldName": "metadata_storage_name",
+                "targetFieldName": "name"
+            },
+
+            {
+                "sourceFieldName": "metadata_storage_path",
+                "targetFieldName": "location"
             }
         ],
-    "indexProjections": {
-        "selectors": [
+        "outputFieldMappings": [
+
+        ],
+        "parameters":
             {
-                "targetIndexName": INDEX_NAME,
-                "parentKeyFieldName": "ParentKey",
-                "sourceContext": "/document/chunks/*",
-                "mappings": [
-                    {
-                        "name": "title",
-                        "source": "/document/title"
-                    },
+                "maxFailedItems": -1,
+                "maxFailedItemsPerBatch": -1,
+                "configuration":
                     {
-                        "name": "name",
-                        "source": "/document/name"
+                        "dataToExtract": "contentAndMetadata",
+                        "imageAction": "none"
+                    }
+            }
+    }
+
+
+def extra_body_for(index=None):
+    """
+    The "On Your Data" data source of the chat completions, searching the active index by default
+    """
+    settings = S.get_settings()
+    return {
+        "data_sources": [
+            {
+                "type": "azure_search",
+                "parameters": {
+                    "endpoint": settings.search_endpoint,
+                    "index_name": index or current_index_name(),
+                    "filter": "",
+                    "fields_mapping": {
+                        "content_fields": ["chunk"],
+                        "vector_fields": ["chunkVector"],
+                        "filepath_field": "location",
+                        "url_field": "location",
+                        "title_field": "name"
                     },
-                    {
-                        "name": "location",
-                        "source": "/document/location"
+                    "embedding_dependency": {
+                        "deployment_name": settings.embedding_deployment,
+                        "type": "deployment_name",
+                        "dimensions": settings.embedding_dimensions
                     },
-                    {
-                        "name": "chunk",
-                        "source": "/document/chunks/*"
+                    "authentication": {
+                        "type": "api_key",
+                        "key": settings.search_key
                     },
-                    {
-                        "name": "chunkVector",
-                        "source": "/document/chunks/*/vector"
-                    }
-                ]
+                    # "semantic_configuration": "my-semantic-config",
+                    "query_type": "vector_semantic_hybrid",
+                    "top_n_documents": 5
+                }
             }
-        ],
-        "parameters": {
-            "projectionMode": "skipIndexingParentDocuments"
-        }
+        ]
     }
-}
 
 
-indexer_payload = {
-    "name": INDEXER_NAME,
-    "dataSourceName": DATASOURCE_NAME,
-    "targetIndexName": INDEX_NAME,
-    "skillsetName": SKILLSET_NAME,
-    "schedule": {"interval": "PT30M"},  # How often do you want to check for new content in the data source
-    "fieldMappings": [
-        {
-            "sourceFieldName": "metadata_title",
-            "targetFieldName": "title"
-        },
-        {
-            "sourceFieldName": "metadata_storage_name",
-            "targetFieldName": "name"
-        },
-
-        {
-            "sourceFieldName": "metadata_storage_path",
-            "targetFieldName": "location"
-        }
-    ],
-    "outputFieldMappings": [
-
-    ],
-    "parameters":
-        {
-            "maxFailedItems": -1,
-            "maxFailedItemsPerBatch": -1,
-            "configuration":
-                {
-                    "dataToExtract": "contentAndMetadata",
-                    "imageAction": "none"
-                }
-        }
+_LAZY_ATTRIBUTES = {
+    "DATASOURCE_NAME": datasource_name,
+    "INDEX_NAME": base_index_name,
+    "SKILLSET_NAME": skillset_name,
+    "INDEXER_NAME": indexer_name,
+    "ACTIVE_INDEX_NAME": current_index_name,
+    "datasource_payload": datasource_payload_for,
+    "index_payload": index_payload_for,
+    "skillset_payload": skillset_payload_for,
+    "indexer_payload": indexer_payload_for,
+    "extra_body": extra_body_for,
 }
 
-extra_body = {
-    "data_sources": [
-        {
-            "type": "azure_search",
-            "parameters": {
-                "endpoint": os.environ["AZURE_SEARCH_ENDPOINT"],
-                "index_name": INDEX_NAME,
-                "filter": "",
-                "fields_mapping": {
-                    "content_fields": ["chunk"],
-                    "vector_fields": ["chunkVector"],
-                    "filepath_field": "location",
-                    "url_field": "location",
-                    "title_field": "name"
-                },
-                "embedding_dependency": {
-                    "deployment_name": os.environ['EMBEDDING_DEPLOYMENT_NAME'],
-                    "type": "deployment_name",
-                    "dimensions": int(os.environ['EMBEDDING_DIMENSIONS'])
-                },
-                "authentication": {
-                    "type": "api_key",
-                    "key": os.environ["AZURE_SEARCH_KEY"]
-                },
-                # "semantic_configuration": "my-semantic-config",
-                "query_type": "vector_semantic_hybrid",
-                "top_n_documents": 5
-            }
-        }
-    ]
-}
+
+def __getattr__(name):
+    # names and payloads depend on the settings, they are built on every access instead of at import time
+    if name in _SETTINGS_ATTRIBUTES:
+        return getattr(S.get_settings(), _SETTINGS_ATTRIBUTES[name])
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def recreate_all():
-    IH.delete_all_objects([DATASOURCE_NAME, INDEX_NAME, SKILLSET_NAME, INDEXER_NAME])
-    IH.create_all_objects([DATASOURCE_NAME, INDEX_NAME, SKILLSET_NAME, INDEXER_NAME],
-                          [datasource_payload, index_payload, skillset_payload, indexer_payload])
+    # the state file, not the name cached by this process: another process may have rebuilt the index
+    index = active_index_name()
+    names = [datasource_name(), index, skillset_name(), indexer_name()]
+    IH.delete_all_objects(names)
+    IH.create_all_objects(names, [datasource_payload_for(), index_payload_for(index), skillset_payload_for(index),
+                                  indexer_payload_for(index)])
+    U.bump_index_generation()
     log.info("All done")
 
+
+def rebuild_versioned_index(timeout=None):
+    """
+    Build the index under a new versioned name, populate it with the indexer, then make it the active index
+    and drop the old one. Queries keep using the old index until the swap.
+    :return: The name of the new index
+    """
+    import rag_demos.indexer_monitor as IM
+    state = _read_index_state()
+    version = state.get("version", 0) + 1
+    new_name = f"{base_index_name()}-v{version}"
+    log.info(f"Rebuilding index into {new_name}")
+    IH.create_object(new_name, "index", index_payload_for(new_name))
+    IH.create_object(skillset_name(), "skillset", skillset_payload_for(new_name))
+    IH.create_object(indexer_name(), "indexer", indexer_payload_for(new_name))
+    old_name = active_index_name()
+    try:
+        since = IM.last_run_start(indexer_name())
+        IH.reset_indexer(indexer_name())
+        IH.run_indexer(indexer_name())
+        report = IM.wait_for_indexer(indexer_name(), timeout=timeout, since=since)
+        if report["status"] != "success":
+            raise Exception(f"Populating {new_name} failed ({report['status']}), {old_name} stays active")
+    except Exception:
+        # scheduled runs must keep feeding the index the app queries
+        log.error(f"Rebuild into {new_name} failed, pointing {skillset_name()} and {indexer_name()} back at {old_name}")
+        IH.create_object(skillset_name(), "skillset", skillset_payload_for(old_name))
+        IH.create_object(indexer_name(), "indexer", indexer_payload_for(old_name))
+        IH.delete_object(new_name, "index")
+        raise
+    _write_index_state({**state, base_index_name(): new_name, "version": version})
+    IH.delete_object(old_name, "index")
+    U.bump_index_generation()
+    log.info(f"{new_name} is now the active index, restart other processes (e.g. the chat app) to pick it up")
+    return new_name
+
+
+def reconcile_all(rebuild_timeout=None):
+    """
+    Non-destructive alternative to recreate_all: compare the current definitions with the payloads
+    and only PUT the objects that changed. An index schema change that cannot be applied in place
+    triggers rebuild_versioned_index instead of dropping the live index.
+    :return: dict object type -> list of changed paths (empty when the object was up to date)
+    """
+    from rag_demos.reconcile import diff, index_update_problems
+    # the state file, not the name cached by this process: another process may have rebuilt the index
+    index = active_index_name()
+    index_payload = index_payload_for(index)
+    objects = [("datasource", datasource_name(), datasource_payload_for()),
+               ("index", index, index_payload),
+               ("skillset", skillset_name(), skillset_payload_for(index)),
+               ("indexer", indexer_name(), indexer_payload_for(index))]
+    current = {typ: IH.get_object(name, typ) for typ, name, _ in objects}
+    problems = index_update_problems(index_payload, current["index"]) if current["index"] is not None else []
+    changes = {}
+    for typ, name, payload in objects:
+        if typ == "index" and problems:
+            # the datasource comes first and is already applied, the rebuild populates the new index from it
+            log.warning(f"Index {name} cannot be updated in place: {problems}")
+            new_name = rebuild_versioned_index(rebuild_timeout)
+            changes["index"] = problems
+            # the rebuild put the skillset and indexer, pointing at the new index
+            rebuilt = {"skillset": skillset_payload_for(new_name), "indexer": indexer_payload_for(new_name)}
+            for other, other_payload in rebuilt.items():
+                changes[other] = ["created"] if current[other] is None else diff(other_payload, current[other])
+                log.info(f"{other} changed with the rebuild: {changes[other]}")
+            return changes
+        changes[typ] = ["created"] if current[typ] is None else diff(payload, current[typ])
+        if changes[typ]:
+            log.info(f"{typ} {name} changed: {changes[typ]}")
+            IH.create_object(name, typ, payload)
+        else:
+            log.info(f"{typ} {name} is up to date")
+    if any(changes.values()):
+        U.bump_index_generation()
+    if changes["skillset"] and current["skillset"] is not None:
+        log.info(f"Skillset changed, reset {indexer_name()} to re-enrich existing documents")
+    return changes
+
+
 if __name__ == "__main__":
-    recreate_all()
\ No newline at end of file
+    import sys
+    if "--recreate" in sys.argv:
+        recreate_all()
+    else:
+        reconcile_all()
\ No newline at end of file